@@ -0,0 +1,6 @@
+"""
+benchmarks
+
+Performance benchmarks for Quart-Uploads, run with
+``python -m benchmarks``.
+"""
@@ -0,0 +1,10 @@
+"""
+benchmarks.__main__
+
+Runs the benchmarks, see `benchmarks.runner.main`.
+"""
+import sys
+
+from .runner import main
+
+sys.exit(main())
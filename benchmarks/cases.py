@@ -0,0 +1,228 @@
+"""
+benchmarks.cases
+
+The benchmarks for saving, conflict resolution, extension validation,
+serving and URL building.
+"""
+from __future__ import annotations
+import asyncio
+import io
+import itertools
+import os
+import tempfile
+from pathlib import Path
+
+from quart import Quart
+from quart.datastructures import FileStorage
+
+from quart_uploads import ALL, UploadConfig, UploadSet, configure_uploads
+
+from .runner import Operation, benchmark
+
+SMALL = os.urandom(1024)
+LARGE_SIZE = 16 * 1024 * 1024
+
+#: The number of numbered duplicates in the colliding folder.
+COLLISIONS = 10_000
+
+
+def _upload_set(folder: Path, **options) -> UploadSet:
+    uset = UploadSet('files', ALL)
+    uset._config = UploadConfig(str(folder), **options)
+    return uset
+
+
+def _spooled(data: bytes) -> tempfile.SpooledTemporaryFile:
+    spool = tempfile.SpooledTemporaryFile(max_size=1)
+    spool.write(data)
+    spool.seek(0)
+    return spool
+
+
+@benchmark('save_small', number=200)
+async def save_small(folder: Path) -> Operation:
+    uset = _upload_set(folder)
+    counter = itertools.count()
+
+    async def operation() -> None:
+        await uset.save(
+            FileStorage(io.BytesIO(SMALL), filename=f'{next(counter)}.bin')
+        )
+    return operation
+
+
+@benchmark('save_small_hashed', number=200)
+async def save_small_hashed(folder: Path) -> Operation:
+    uset = _upload_set(folder)
+    counter = itertools.count()
+
+    async def operation() -> None:
+        await uset.save_with_result(
+            FileStorage(io.BytesIO(SMALL), filename=f'{next(counter)}.bin')
+        )
+    return operation
+
+
+@benchmark('save_large_memory', number=3)
+async def save_large_memory(folder: Path) -> Operation:
+    uset = _upload_set(folder)
+    data = os.urandom(LARGE_SIZE)
+    counter = itertools.count()
+
+    async def operation() -> None:
+        name = f'{next(counter)}.bin'
+        await uset.save(FileStorage(io.BytesIO(data), filename=name))
+        # Keeps the disk usage of a run flat.
+        os.remove(folder / name)
+    return operation
+
+
+@benchmark('save_large_spooled', number=3)
+async def save_large_spooled(folder: Path) -> Operation:
+    uset = _upload_set(folder / 'uploads')
+    data = os.urandom(LARGE_SIZE)
+    counter = itertools.count()
+
+    async def operation() -> None:
+        name = f'{next(counter)}.bin'
+        with _spooled(data) as spool:
+            await uset.save(FileStorage(spool, filename=name))
+        os.remove(folder / 'uploads' / name)
+    return operation
+
+
+async def _colliding_folder(folder: Path) -> Path:
+    target = folder / 'colliding'
+    target.mkdir()
+
+    def create() -> None:
+        (target / 'photo.jpg').touch()
+        for index in range(1, COLLISIONS + 1):
+            (target / f'photo_{index}.jpg').touch()
+
+    await asyncio.to_thread(create)
+    return target
+
+
+@benchmark('save_colliding', number=200)
+async def save_colliding(folder: Path) -> Operation:
+    uset = _upload_set(await _colliding_folder(folder))
+
+    async def operation() -> None:
+        await uset.save(FileStorage(io.BytesIO(SMALL), filename='photo.jpg'))
+    return operation
+
+
+@benchmark('resolve_conflict_cold', number=20)
+async def resolve_conflict_cold(folder: Path) -> Operation:
+    target = await _colliding_folder(folder)
+
+    async def operation() -> None:
+        # A new set has to scan the folder to seed its conflict index.
+        await _upload_set(target).resolve_conflict(str(target), 'photo.jpg')
+    return operation
+
+
+@benchmark('save_concurrent', number=5)
+async def save_concurrent(folder: Path) -> Operation:
+    uset = _upload_set(folder, reserve=True)
+
+    async def operation() -> None:
+        await asyncio.gather(*(
+            uset.save(FileStorage(io.BytesIO(SMALL), filename='same.bin'))
+            for _ in range(50)
+        ))
+    return operation
+
+
+@benchmark('save_many', number=5)
+async def save_many(folder: Path) -> Operation:
+    uset = _upload_set(folder)
+
+    async def operation() -> None:
+        await uset.save_many(
+            FileStorage(io.BytesIO(SMALL), filename='many.bin')
+            for _ in range(50)
+        )
+    return operation
+
+
+@benchmark('extension_allowed_large_lists', number=20)
+async def extension_allowed_large_lists(folder: Path) -> Operation:
+    allow = tuple(f'a{index}' for index in range(5000))
+    deny = tuple(f'd{index}' for index in range(5000))
+    uset = UploadSet('files', tuple(f'e{index}' for index in range(5000)))
+    uset._config = UploadConfig(str(folder), allow=allow, deny=deny)
+    names = [
+        f'file.{ext}' for ext in ('a4999', 'd4999', 'e4999', 'tar.gz', 'x')
+    ] * 200
+
+    async def operation() -> None:
+        for name in names:
+            uset.file_allowed(name)
+    return operation
+
+
+async def _serving_app(folder: Path) -> Quart:
+    (folder / 'small.bin').write_bytes(SMALL)
+    (folder / 'large.bin').write_bytes(os.urandom(LARGE_SIZE))
+    app = Quart(__name__)
+    app.config['UPLOADED_FILES_DEST'] = str(folder)
+    configure_uploads(app, UploadSet('files', ALL))
+    return app
+
+
+@benchmark('serve_small', number=200)
+async def serve_small(folder: Path) -> Operation:
+    client = (await _serving_app(folder)).test_client()
+
+    async def operation() -> None:
+        response = await client.get('/_uploads/files/small.bin')
+        await response.get_data()
+    return operation
+
+
+@benchmark('serve_large', number=3)
+async def serve_large(folder: Path) -> Operation:
+    client = (await _serving_app(folder)).test_client()
+
+    async def operation() -> None:
+        response = await client.get('/_uploads/files/large.bin')
+        await response.get_data()
+    return operation
+
+
+@benchmark('serve_range', number=200)
+async def serve_range(folder: Path) -> Operation:
+    client = (await _serving_app(folder)).test_client()
+
+    async def operation() -> None:
+        response = await client.get(
+            '/_uploads/files/large.bin', headers={'Range': 'bytes=0-65535'}
+        )
+        await response.get_data()
+    return operation
+
+
+@benchmark('serve_not_modified', number=200)
+async def serve_not_modified(folder: Path) -> Operation:
+    client = (await _serving_app(folder)).test_client()
+    etag = (await client.get('/_uploads/files/small.bin')).headers['ETag']
+
+    async def operation() -> None:
+        await client.get(
+            '/_uploads/files/small.bin', headers={'If-None-Match': etag}
+        )
+    return operation
+
+
+@benchmark('urls_gallery', number=200)
+async def urls_gallery(folder: Path) -> Operation:
+    app = await _serving_app(folder)
+    uset = app.extensions['uploads'].sets['files']
+    names = [f'gallery/{number}.jpg' for number in range(500)]
+
+    async def operation() -> None:
+        async with app.test_request_context('/'):
+            uset.urls(names)
+    return operation
@@ -0,0 +1,232 @@
+"""
+benchmarks.runner
+
+A small standalone benchmark runner, so the suite has no dependencies
+beyond the package's own. Each benchmark is an async setup function that
+prepares its fixtures in a temporary folder and returns the operation to
+time. The results are written as JSON, which can be compared with the
+results of another run, i.e. the last release.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+from pathlib import Path
+from typing import (
+    Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+)
+
+#: An operation to time.
+Operation = Callable[[], Awaitable[Any]]
+#: Prepares a benchmark's fixtures in a folder and returns its operation.
+Setup = Callable[[Path], Awaitable[Operation]]
+
+#: The version of the format of the results file.
+RESULTS_FORMAT = 1
+
+
+class Benchmark(NamedTuple):
+    """
+    A registered benchmark, see `benchmark`.
+    """
+    name: str
+    setup: Setup
+    number: int
+
+
+BENCHMARKS: List[Benchmark] = []
+
+
+def benchmark(name: str, number: int) -> Callable[[Setup], Setup]:
+    """
+    Registers a benchmark.
+
+    Arguments:
+        name: The name the results are recorded under.
+        number: How many times the operation runs in each round.
+    """
+    def decorator(setup: Setup) -> Setup:
+        BENCHMARKS.append(Benchmark(name, setup, number))
+        return setup
+    return decorator
+
+
+async def run_benchmark(
+    bench: Benchmark, rounds: int, scale: float
+) -> Dict[str, Any]:
+    """
+    Runs a benchmark in a fresh temporary folder and returns its timings,
+    in seconds per operation.
+
+    Arguments:
+        bench: The benchmark to run.
+        rounds: How many rounds to time.
+        scale: A factor applied to the number of operations per round.
+    """
+    number = max(1, int(bench.number * scale))
+    with tempfile.TemporaryDirectory() as folder:
+        operation = await bench.setup(Path(folder))
+        await operation()  # warm up
+
+        times = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for _ in range(number):
+                await operation()
+            times.append((time.perf_counter() - start) / number)
+
+    return {
+        'number': number,
+        'rounds': rounds,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.fmean(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'ops': 1 / statistics.median(times)
+    }
+
+
+def _version() -> Optional[str]:
+    try:
+        return metadata.version('quart-uploads')
+    except metadata.PackageNotFoundError:
+        return None
+
+
+async def run(
+    names: Optional[List[str]] = None, rounds: int = 5, scale: float = 1.0
+) -> Dict[str, Any]:
+    """
+    Runs the benchmarks and returns the results.
+
+    Arguments:
+        names: The names of the benchmarks to run, or `None` for all.
+        rounds: How many rounds to time each benchmark.
+        scale: A factor applied to the number of operations per round.
+    """
+    # Registers the benchmarks.
+    from . import cases  # noqa: F401
+
+    results: Dict[str, Any] = {}
+    for bench in BENCHMARKS:
+        if names and bench.name not in names:
+            continue
+        result = results[bench.name] = await run_benchmark(
+            bench, rounds, scale
+        )
+        print(
+            f"{bench.name:<28} {result['median'] * 1e6:>12.1f} us",
+            file=sys.stderr
+        )
+
+    return {
+        'format': RESULTS_FORMAT,
+        'version': _version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': datetime.now(timezone.utc).isoformat(),
+        'benchmarks': results
+    }
+
+
+def compare(
+    baseline: Dict[str, Any], current: Dict[str, Any], threshold: float
+) -> List[str]:
+    """
+    Prints how the median time of each benchmark changed from the baseline
+    and returns the names of those that got slower by more than the
+    threshold.
+
+    Arguments:
+        baseline: The results to compare against.
+        current: The results of this run.
+        threshold: The allowed slowdown, i.e. ``0.1`` for 10%.
+    """
+    regressions = []
+    out = sys.stderr
+    print(
+        f"{'benchmark':<28} {'baseline':>12} {'current':>12} {'change':>8}",
+        file=out
+    )
+    for name, result in current['benchmarks'].items():
+        old = baseline['benchmarks'].get(name)
+        if old is None:
+            print(
+                f"{name:<28} {'-':>12} {result['median'] * 1e6:>12.1f}",
+                file=out
+            )
+            continue
+        change = result['median'] / old['median'] - 1
+        print(
+            f"{name:<28} {old['median'] * 1e6:>12.1f} "
+            f"{result['median'] * 1e6:>12.1f} {change:>+8.1%}",
+            file=out
+        )
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Runs the benchmarks from the command line, and returns 1 if comparing
+    with a baseline found a regression, or else 0.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description="Runs the Quart-Uploads benchmarks."
+    )
+    parser.add_argument(
+        'names', nargs='*', help="the benchmarks to run, all by default"
+    )
+    parser.add_argument(
+        '-o', '--output', type=Path, help="write the results as JSON here"
+    )
+    parser.add_argument(
+        '-c', '--compare', type=Path, metavar='BASELINE',
+        help="compare with the results of an earlier run"
+    )
+    parser.add_argument(
+        '-t', '--threshold', type=float, default=0.1,
+        help="the slowdown that counts as a regression (default 0.1)"
+    )
+    parser.add_argument(
+        '-r', '--rounds', type=int, default=5,
+        help="the number of rounds to time (default 5)"
+    )
+    parser.add_argument(
+        '-s', '--scale', type=float, default=1.0,
+        help="scale the operations per round, i.e. 0.1 for a quick run"
+    )
+    parser.add_argument(
+        '-l', '--list', action='store_true', help="list the benchmarks"
+    )
+    args = parser.parse_args(argv)
+
+    if args.list:
+        from . import cases  # noqa: F401
+        for bench in BENCHMARKS:
+            print(bench.name)
+        return 0
+
+    results = asyncio.run(run(args.names, args.rounds, args.scale))
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"Slower: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
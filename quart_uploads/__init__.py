@@ -1,20 +1,61 @@
 """
 quart_uploads
 """
+from .backends import (
+    FileStat, LocalBackend, MemoryBackend, S3Backend, StorageBackend
+)
 from .config import UploadConfig, Uploads, configure_uploads
-from .exceptions import UploadNotAllowed, AllExcept
+from .exceptions import (
+    UploadNotAllowed,
+    UploadTooLarge,
+    UploadTypeMismatch,
+    QuotaExceeded,
+    AllExcept
+)
 from .file_ext import FILE_EXTENSIONS as FE, ALL
+from .images import ImageVariant
+from .listing import StoredFile
+from .metrics import MetricsRegistry
+from .result import UploadResult
 from .set import UploadSet
+from .signals import (
+    conflict_resolved,
+    file_served,
+    upload_deleted,
+    upload_rejected,
+    upload_saved,
+    upload_started
+)
+from .usage import Usage
 from .utils import TestingFileStorage
 
 __all__ = [
+    'FileStat',
+    'LocalBackend',
+    'MemoryBackend',
+    'S3Backend',
+    'StorageBackend',
     'UploadConfig',
     'configure_uploads',
     'Uploads',
     'UploadNotAllowed',
+    'UploadTooLarge',
+    'UploadTypeMismatch',
+    'QuotaExceeded',
     'FE',
     'ALL',
     'AllExcept',
     'UploadSet',
+    'UploadResult',
+    'ImageVariant',
+    'StoredFile',
+    'Usage',
+    'MetricsRegistry',
+    'upload_started',
+    'upload_saved',
+    'upload_rejected',
+    'conflict_resolved',
+    'file_served',
+    'upload_deleted',
     'TestingFileStorage'
     ]
@@ -0,0 +1,297 @@
+"""
+quart_uploads.backends
+
+Defines the storage backend protocol and the backends that ship with the
+extension. A backend is selected per set with the
+`UPLOADED_X_BACKEND` setting.
+"""
+from __future__ import annotations
+import os
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    IO,
+    Optional,
+    Protocol,
+    Tuple,
+    runtime_checkable
+)
+
+import aiofiles
+import aiofiles.os
+from werkzeug.security import safe_join
+
+from .executor import run_blocking
+from .writer import HashingReader, write_stream
+
+#: The error codes S3-compatible services use for a missing key.
+MISSING_CODES = frozenset(('404', 'NoSuchKey', 'NotFound'))
+
+
+@dataclass
+class FileStat:
+    """
+    This holds the metadata of a stored file.
+
+    Arguments:
+        size: The size of the file in bytes.
+        mtime: The time the file was last modified, as a Unix timestamp.
+    """
+
+    size: int
+    mtime: float
+
+
+@runtime_checkable
+class StorageBackend(Protocol):
+    """
+    The interface an upload set uses to store its files. Keys are the names
+    returned by `UploadSet.save`, i.e. ``someguy/photo.jpg``. Methods that
+    look up a key that doesn't exist raise `FileNotFoundError`.
+    """
+
+    async def save(
+        self, key: str, stream: IO[bytes], buffer_size: int = 16384
+    ) -> int:
+        """
+        Stores the stream under the key, replacing anything already there,
+        and returns the number of bytes stored.
+        """
+
+    def open(self, key: str, buffer_size: int = 16384) -> AsyncIterator[bytes]:
+        """
+        Returns an async iterator over the contents of the file in chunks.
+        """
+
+    async def stat(self, key: str) -> FileStat:
+        """
+        Returns the size and modification time of the file.
+        """
+
+    async def exists(self, key: str) -> bool:
+        """
+        Returns whether a file is stored under the key.
+        """
+
+    async def delete(self, key: str) -> None:
+        """
+        Removes the file stored under the key.
+        """
+
+
+class LocalBackend:
+    """
+    This stores files in a directory on the local filesystem.
+
+    Arguments:
+        root: The directory to store files in.
+        executor: The executor to run the file operations in, or `None`
+                  for the event loop's default executor.
+    """
+    def __init__(
+        self, root: str, executor: Optional[Executor] = None
+    ) -> None:
+        self.root = root
+        self.executor = executor
+
+    def path(self, key: str) -> str:
+        """
+        Returns the absolute path for a key, raising `FileNotFoundError` if
+        the key would point outside of the root directory.
+
+        Arguments:
+            key: The key of the file.
+        """
+        path = safe_join(os.fspath(self.root), key)
+        if path is None:
+            raise FileNotFoundError(key)
+        return path
+
+    async def save(
+        self, key: str, stream: IO[bytes], buffer_size: int = 16384
+    ) -> int:
+        path = self.path(key)
+        await aiofiles.os.makedirs(
+            os.path.dirname(path), exist_ok=True, executor=self.executor
+        )
+        return await write_stream(
+            stream, path, buffer_size=buffer_size, executor=self.executor
+        )
+
+    async def open(
+        self, key: str, buffer_size: int = 16384
+    ) -> AsyncIterator[bytes]:
+        async with aiofiles.open(
+            self.path(key), 'rb', executor=self.executor
+        ) as file_:
+            data = await file_.read(buffer_size)
+            while data != b"":
+                yield data
+                data = await file_.read(buffer_size)
+
+    async def stat(self, key: str) -> FileStat:
+        result = await aiofiles.os.stat(
+            self.path(key), executor=self.executor
+        )
+        return FileStat(result.st_size, result.st_mtime)
+
+    async def exists(self, key: str) -> bool:
+        try:
+            return await aiofiles.os.path.isfile(
+                self.path(key), executor=self.executor
+            )
+        except FileNotFoundError:
+            return False
+
+    async def delete(self, key: str) -> None:
+        await aiofiles.os.remove(self.path(key), executor=self.executor)
+
+
+class MemoryBackend:
+    """
+    This keeps files in a dictionary in memory. It is meant for tests and
+    small, short lived sets, as the files are lost when the process exits.
+    """
+    def __init__(self) -> None:
+        self.files: Dict[str, Tuple[bytes, float]] = {}
+
+    async def save(
+        self, key: str, stream: IO[bytes], buffer_size: int = 16384
+    ) -> int:
+        chunks = []
+        data = stream.read(buffer_size)
+        while data != b"":
+            chunks.append(data)
+            data = stream.read(buffer_size)
+        content = b"".join(chunks)
+        self.files[key] = (content, time.time())
+        return len(content)
+
+    async def open(
+        self, key: str, buffer_size: int = 16384
+    ) -> AsyncIterator[bytes]:
+        content = self._get(key)[0]
+        for start in range(0, len(content), buffer_size):
+            yield content[start:start + buffer_size]
+
+    async def stat(self, key: str) -> FileStat:
+        content, mtime = self._get(key)
+        return FileStat(len(content), mtime)
+
+    async def exists(self, key: str) -> bool:
+        return key in self.files
+
+    async def delete(self, key: str) -> None:
+        self._get(key)
+        del self.files[key]
+
+    def _get(self, key: str) -> Tuple[bytes, float]:
+        try:
+            return self.files[key]
+        except KeyError:
+            raise FileNotFoundError(key) from None
+
+
+def _is_missing(error: Exception) -> bool:
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in MISSING_CODES
+
+
+class S3Backend:
+    """
+    This stores files in a bucket of an S3-compatible object store. The
+    client's blocking calls are run in a worker thread, from `executor` if
+    one is given.
+
+    Arguments:
+        bucket: The name of the bucket.
+        client: A ``boto3`` S3 client, or any object with the same
+                ``upload_fileobj``, ``get_object``, ``head_object`` and
+                ``delete_object`` methods, such as a client for a local
+                stand-in. If this is `None`, a client is created with
+                ``boto3.client('s3')``.
+        prefix: A prefix added to every key, i.e. ``uploads/photos/``.
+        executor: The executor to run the client's calls in, or `None` for
+                  the event loop's default executor.
+    """
+    def __init__(
+        self,
+        bucket: str,
+        client: Optional[Any] = None,
+        prefix: str = '',
+        executor: Optional[Executor] = None
+    ) -> None:
+        if client is None:
+            try:
+                import boto3
+            except ImportError as error:
+                raise RuntimeError(
+                    "The S3 backend needs boto3 unless a client is given"
+                ) from error
+            client = boto3.client('s3')
+
+        self.bucket = bucket
+        self.client = client
+        self.prefix = prefix
+        self.executor = executor
+
+    async def save(
+        self, key: str, stream: IO[bytes], buffer_size: int = 16384
+    ) -> int:
+        reader = HashingReader(stream)
+        await run_blocking(
+            self.executor,
+            self.client.upload_fileobj,
+            reader,
+            self.bucket,
+            self.prefix + key
+        )
+        return reader.size
+
+    async def open(
+        self, key: str, buffer_size: int = 16384
+    ) -> AsyncIterator[bytes]:
+        response = await self._call(self.client.get_object, key)
+        body = response['Body']
+        try:
+            data = await run_blocking(self.executor, body.read, buffer_size)
+            while data != b"":
+                yield data
+                data = await run_blocking(
+                    self.executor, body.read, buffer_size
+                )
+        finally:
+            body.close()
+
+    async def stat(self, key: str) -> FileStat:
+        response = await self._call(self.client.head_object, key)
+        return FileStat(
+            response['ContentLength'], response['LastModified'].timestamp()
+        )
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await self.stat(key)
+        except FileNotFoundError:
+            return False
+        return True
+
+    async def delete(self, key: str) -> None:
+        await self._call(self.client.delete_object, key)
+
+    async def _call(self, method: Any, key: str) -> Any:
+        try:
+            return await run_blocking(
+                self.executor,
+                method,
+                Bucket=self.bucket,
+                Key=self.prefix + key
+            )
+        except Exception as error:
+            if _is_missing(error):
+                raise FileNotFoundError(key) from error
+            raise
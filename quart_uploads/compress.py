@@ -0,0 +1,184 @@
+"""
+quart_uploads.compress
+
+Provides precompressed copies of text-like uploads, so the uploads route
+can serve them with a `Content-Encoding` the client accepts instead of
+compressing on every request. Copies are made when the file is saved, or
+the first time they are asked for, and kept in a hidden folder next to
+the file. ``gzip`` uses the standard library, ``br`` needs the `brotli`
+package and ``zstd`` the `zstandard` package.
+"""
+from __future__ import annotations
+import asyncio
+import os
+import zlib
+from concurrent.futures import Executor
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from .executor import run_blocking
+from .file_ext import FILE_EXTENSIONS as FE
+from .utils import extension, make_temp
+
+#: The encodings that can be precompressed, with the suffix of each copy.
+ENCODINGS = {'gzip': '.gz', 'br': '.br', 'zstd': '.zst'}
+
+#: The folder, next to each file, that its compressed copies are kept in.
+COMPRESSED_FOLDER = '.compressed'
+
+#: The extensions of the files worth compressing. Images other than SVG,
+#: media and archives are compressed already.
+COMPRESSIBLE = frozenset(
+    FE.Text + FE.Data + FE.Scripts + FE.Source +
+    ('svg', 'html', 'htm', 'css', 'md', 'rst', 'log', 'tsv')
+)
+
+#: Files smaller than this, in bytes, are always sent as they are.
+MIN_SIZE = 256
+
+#: The compression level for each encoding. Copies are made once and
+#: served many times, so these favour size over speed.
+LEVELS = {'gzip': 9, 'br': 9, 'zstd': 12}
+
+BUFFER_SIZE = 65536
+
+Compressor = Tuple[Callable[[bytes], bytes], Callable[[], bytes]]
+
+
+def _compressor(encoding: str) -> Compressor:
+    """
+    Returns the functions that compress a chunk and finish the stream, for
+    the encoding.
+    """
+    level = LEVELS[encoding]
+    if encoding == 'gzip':
+        gzip = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return gzip.compress, gzip.flush
+    if encoding == 'br':
+        import brotli
+        brotli_ = brotli.Compressor(quality=level)
+        return brotli_.process, brotli_.finish
+    import zstandard
+    zstd = zstandard.ZstdCompressor(level=level).compressobj()
+    return zstd.compress, zstd.flush
+
+
+def check_encodings(encodings: Iterable[str]) -> Tuple[str, ...]:
+    """
+    Returns the encodings as a tuple, after checking each is known and its
+    library is installed.
+
+    Arguments:
+        encodings: The encodings, in order of preference.
+    """
+    encodings = tuple(encodings)
+    for encoding in encodings:
+        if encoding not in ENCODINGS:
+            raise ValueError(
+                f"compress encodings must be from {', '.join(ENCODINGS)}"
+            )
+        try:
+            _compressor(encoding)
+        except ImportError as error:
+            raise RuntimeError(
+                f"The {encoding} encoding needs the "
+                f"{'brotli' if encoding == 'br' else 'zstandard'} package"
+            ) from error
+    return encodings
+
+
+def compressible(filename: str) -> bool:
+    """
+    Returns whether the file's extension is one worth compressing.
+
+    Arguments:
+        filename: The name of the file.
+    """
+    return extension(filename).lower() in COMPRESSIBLE
+
+
+def compressed_path(path: str, encoding: str) -> str:
+    """
+    Returns the path of the file's compressed copy in the encoding.
+
+    Arguments:
+        path: The path of the file.
+        encoding: One of the `ENCODINGS`.
+    """
+    folder, basename = os.path.split(path)
+    return os.path.join(
+        folder, COMPRESSED_FOLDER, basename + ENCODINGS[encoding]
+    )
+
+
+def compress_file(source: str, target: str, encoding: str) -> None:
+    """
+    Writes a compressed copy of the source file to the target path. The
+    copy is written to a temporary file and moved into place, and is given
+    the source's modification time, which marks which version it is of.
+
+    Arguments:
+        source: The path of the file to compress.
+        target: The path to write the copy to.
+        encoding: One of the `ENCODINGS`.
+    """
+    folder = os.path.dirname(target)
+    os.makedirs(folder, exist_ok=True)
+    update, finish = _compressor(encoding)
+    fd, temp = make_temp(dir=folder, prefix='.compress-')
+    try:
+        with open(source, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+            stat = os.fstat(src.fileno())
+            while True:
+                data = src.read(BUFFER_SIZE)
+                if not data:
+                    break
+                dst.write(update(data))
+            dst.write(finish())
+        os.utime(temp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(temp, target)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+_pending: Dict[str, asyncio.Future[None]] = {}
+
+
+async def ensure_compressed(
+    source: str,
+    encoding: str,
+    source_stat: Optional[os.stat_result] = None,
+    executor: Optional[Executor] = None
+) -> os.stat_result:
+    """
+    Makes sure the compressed copy of the source file is up to date,
+    compressing it if it is missing or was made from another version of
+    the file, and returns the copy's stat. Concurrent calls for the same
+    copy share one compression.
+
+    Arguments:
+        source: The path of the file.
+        encoding: One of the `ENCODINGS`.
+        source_stat: The file's stat, if the caller already has it.
+        executor: The executor to compress in.
+    """
+    if source_stat is None:
+        source_stat = await run_blocking(executor, os.stat, source)
+    target = compressed_path(source, encoding)
+    try:
+        stat = await run_blocking(executor, os.stat, target)
+    except FileNotFoundError:
+        pass
+    else:
+        if stat.st_mtime_ns == source_stat.st_mtime_ns:
+            return stat
+
+    future = _pending.get(target)
+    if future is None:
+        future = asyncio.ensure_future(
+            run_blocking(executor, compress_file, source, target, encoding)
+        )
+        _pending[target] = future
+        future.add_done_callback(lambda _: _pending.pop(target, None))
+    await asyncio.shield(future)
+    return await run_blocking(executor, os.stat, target)
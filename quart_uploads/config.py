@@ -8,14 +8,22 @@ helper functions for the extension.
 from __future__ import annotations
 import os
 from collections import UserDict
-from dataclasses import dataclass, astuple
+from concurrent.futures import Executor
+from dataclasses import dataclass, field, fields
 from typing import Any, Dict, Optional, Union
 
 from quart import Quart
 
+from .backends import StorageBackend
+from .compress import check_encodings
+from .expiry import ttl_seconds
+from .metrics import MetricsRegistry
+from .resumable import resumable_mod
 from .route import uploads_mod
+from .serve import ETAG_MODES, ETAG_STAT, SENDFILE_HEADERS, SENDFILE_PATH
 from .set import UploadSet
 from .utils import addslash
+from .writer import FSYNC_NEVER, FSYNC_POLICIES
 
 
 @dataclass
@@ -32,19 +40,88 @@ class UploadConfig:
         `UploadSet` extensions list.
         deny: A tuple of extensions to deny, even if they are in the
         `UploadSet` extensions list.
+        reserve: If `True`, names are claimed with an exclusive create
+        before the file is written, so concurrent saves can't overwrite
+        each other.
+        deduplicate: If `True`, files are stored once per distinct content
+        and the saved names are hardlinked to the stored copy.
+        backend: The `StorageBackend` to keep files in. If this is `None`,
+        files are saved to `destination` on the local filesystem.
+        atomic: If `True`, files are written to a temporary file and moved
+        into place once complete, so a partial file is never visible.
+        fsync: When to fsync atomic writes: ``never``, ``file`` for every
+        file, or ``batch`` to group the fsyncs of concurrent saves.
+        max_age: The `Cache-Control` max-age, in seconds, for files served
+        by Quart-Uploads.
+        etag: How ETags are built for served files: ``stat`` from the size
+        and modification time, or ``hash`` from the content digest stored
+        when the file was saved.
+        max_size: The largest size, in bytes, of a file in this set, or
+        `None` for no limit.
+        folder_max_sizes: Size limits for files saved to particular
+        subfolders, by folder name, overriding `max_size`.
+        sniff: Whether to check that each file's content matches its
+        extension from its first bytes, as it is written.
+        executor: The executor the set's blocking file operations run in,
+        or `None` for the event loop's default executor.
+        max_writes: The most files the set writes at once, or `None` for
+        no limit.
+        shard_depth: The number of levels of hashed folders files are
+        spread over within each folder, or 0 for a flat layout.
+        image_executor: The executor image variants are rendered in, or
+        `None` for a shared process pool.
+        compress: The encodings, such as ``gzip``, that text-like files
+        are precompressed in for serving, in order of preference.
+        compress_on_save: If `True`, the compressed copies are made when a
+        file is saved, rather than when it is first requested.
+        listing: If `True`, the uploads blueprint serves a JSON listing of
+        the set's files.
+        quota: The most bytes the set may store, or `None` for no limit.
+        folder_quota: The most bytes each folder of the set may store, or
+        `None` for no limit.
+        ttl: How long, in seconds, the set's files are kept before they are
+        deleted, or `None` to keep them.
+        sendfile: How served files are handed to the front server,
+        ``x-accel-redirect`` or ``x-sendfile``, or `None` to send them from
+        Quart.
+        sendfile_prefix: The internal location, or for ``x-sendfile`` the
+        destination's path as the front server sees it, that the files'
+        paths are appended to, ending with a /.
     """
 
     destination: str
     base_url: Optional[str] = None
     allow: tuple = ()
     deny: tuple = ()
+    reserve: bool = False
+    deduplicate: bool = False
+    backend: Optional[StorageBackend] = None
+    atomic: bool = False
+    fsync: str = FSYNC_NEVER
+    max_age: Optional[int] = None
+    etag: str = ETAG_STAT
+    max_size: Optional[int] = None
+    folder_max_sizes: Dict[str, int] = field(default_factory=dict)
+    sniff: bool = False
+    executor: Optional[Executor] = None
+    max_writes: Optional[int] = None
+    shard_depth: int = 0
+    image_executor: Optional[Executor] = None
+    compress: tuple = ()
+    compress_on_save: bool = False
+    listing: bool = False
+    quota: Optional[int] = None
+    folder_quota: Optional[int] = None
+    ttl: Optional[float] = None
+    sendfile: Optional[str] = None
+    sendfile_prefix: Optional[str] = None
 
     @property
     def tuple(self) -> tuple:
         """
         Returns the configuration as a tuple.
         """
-        return astuple(self)
+        return tuple(getattr(self, field.name) for field in fields(self))
 
     def __eq__(self, other: Any) -> bool:
         return self.tuple == other.tuple
@@ -52,6 +129,11 @@ class UploadConfig:
 
 MUST_BE_STRING = 'The key must be a string value.'
 MUST_BE_CONFIG = 'The item must be an `UploadConfig` object.'
+MUST_BE_BACKEND = 'The backend must be a `StorageBackend` object.'
+#: The deepest sharding allowed, each level multiplies the folders by 256.
+MAX_SHARD_DEPTH = 4
+
+MUST_BE_EXECUTOR = 'The executor must be a `concurrent.futures.Executor`.'
 
 
 class Uploads(UserDict):
@@ -59,11 +141,45 @@ class Uploads(UserDict):
     Custom dictionary for storing `UploadConfig` objects on the
     `Quart` application.
 
-    This will be stored at `Quart.extensions`.
+    This will be stored at `Quart.extensions`. The configured `UploadSet`
+    objects are kept by name in `sets`, for the routes that need more
+    than the configuration, and the app's `MetricsRegistry` is kept in
+    `metrics` if the `UPLOADS_METRICS` setting is on. The sets' expired
+    files are deleted in the background while the app is serving.
     """
     def __init__(self, app: Quart) -> None:
         super().__init__()
+        self.sets: Dict[str, UploadSet] = {}
+        self.metrics: Optional[MetricsRegistry] = None
         app.extensions['uploads'] = self
+        app.before_serving(self.start_expiry)
+        app.after_serving(self.stop_expiry)
+        app.after_serving(self.close_usage)
+
+    async def start_expiry(self) -> None:
+        """
+        Starts deleting the expired files of the sets with a local
+        destination.
+        """
+        for name, uset in self.sets.items():
+            if self[name].backend is None:
+                await uset.start_expiry()
+
+    async def stop_expiry(self) -> None:
+        """
+        Stops deleting expired files.
+        """
+        for name, uset in self.sets.items():
+            if self[name].backend is None:
+                await uset.stop_expiry()
+
+    async def close_usage(self) -> None:
+        """
+        Writes the sets' usage counters to their snapshots, so the next
+        start doesn't have to scan the destinations.
+        """
+        for uset in self.sets.values():
+            await uset.close_usage()
 
     def __getitem__(self, key: str) -> UploadConfig:
         if not isinstance(key, str):
@@ -91,7 +207,7 @@ class Uploads(UserDict):
 def config_for_set(
     uset: UploadSet,
     app: Quart,
-    defaults: Optional[Dict[str, str]] = None
+    defaults: Optional[Dict[str, Any]] = None
 ) -> UploadConfig:
     """
     This is a helper function for `configure_uploads` that extracts the
@@ -102,7 +218,9 @@ def config_for_set(
         app: The app to load the configuration from.
         defaults: A dict with keys `url` and `dest` from the
                   `UPLOADS_DEFAULT_DEST` and `DEFAULT_UPLOADS_URL`
-                   settings.
+                   settings, and optionally `executor` and
+                   `image_executor`, the executors for sets that don't
+                   set their own.
     """
 
     config = app.config
@@ -115,6 +233,63 @@ def config_for_set(
     deny_extns = tuple(config.get(prefix + 'DENY', ()))
     destination = config.get(prefix + 'DEST')
     base_url = config.get(prefix + 'URL')
+    reserve = bool(config.get(prefix + 'RESERVE', False))
+    deduplicate = bool(config.get(prefix + 'DEDUPLICATE', False))
+    backend = config.get(prefix + 'BACKEND')
+    if backend is not None and not isinstance(backend, StorageBackend):
+        raise TypeError(MUST_BE_BACKEND)
+    atomic = bool(config.get(prefix + 'ATOMIC', False))
+    fsync = config.get(prefix + 'FSYNC', FSYNC_NEVER)
+    if fsync not in FSYNC_POLICIES:
+        raise ValueError(f"fsync must be one of {', '.join(FSYNC_POLICIES)}")
+    max_age = config.get(prefix + 'MAX_AGE')
+    etag = config.get(prefix + 'ETAG', ETAG_STAT)
+    if etag not in ETAG_MODES:
+        raise ValueError(f"etag must be one of {', '.join(ETAG_MODES)}")
+    max_size = config.get(prefix + 'MAX_SIZE')
+    folder_max_sizes = dict(config.get(prefix + 'FOLDER_MAX_SIZES', {}))
+    sniff = bool(config.get(prefix + 'SNIFF', False))
+    executor = config.get(prefix + 'EXECUTOR', defaults.get('executor'))
+    if executor is not None and not isinstance(executor, Executor):
+        raise TypeError(MUST_BE_EXECUTOR)
+    max_writes = config.get(prefix + 'MAX_WRITES')
+    if max_writes is not None and max_writes < 1:
+        raise ValueError("max_writes must be at least 1")
+    shard_depth = int(config.get(prefix + 'SHARD_DEPTH', 0))
+    if not 0 <= shard_depth <= MAX_SHARD_DEPTH:
+        raise ValueError(
+            f"shard_depth must be between 0 and {MAX_SHARD_DEPTH}"
+        )
+    image_executor = config.get(
+        prefix + 'IMAGE_EXECUTOR', defaults.get('image_executor')
+    )
+    if image_executor is not None and \
+            not isinstance(image_executor, Executor):
+        raise TypeError(MUST_BE_EXECUTOR)
+    compress = check_encodings(config.get(prefix + 'COMPRESS', ()))
+    compress_on_save = bool(config.get(prefix + 'COMPRESS_ON_SAVE', False))
+    listing = bool(config.get(prefix + 'LISTING', False))
+    quota = config.get(prefix + 'QUOTA')
+    folder_quota = config.get(prefix + 'FOLDER_QUOTA')
+    if (quota is not None or folder_quota is not None) and \
+            backend is not None:
+        raise ValueError("quotas need a local destination, not a backend")
+    ttl = ttl_seconds(config.get(prefix + 'TTL'))
+    if ttl is not None and backend is not None:
+        raise ValueError("ttl needs a local destination, not a backend")
+    sendfile = config.get(prefix + 'SENDFILE')
+    sendfile_prefix = config.get(prefix + 'SENDFILE_PREFIX')
+    if sendfile is not None:
+        if sendfile not in SENDFILE_HEADERS:
+            raise ValueError(
+                f"sendfile must be one of {', '.join(SENDFILE_HEADERS)}"
+            )
+        if backend is not None:
+            raise ValueError(
+                "sendfile needs a local destination, not a backend"
+            )
+        if sendfile_prefix is None and sendfile != SENDFILE_PATH:
+            raise ValueError(f"{prefix}SENDFILE_PREFIX must be set")
 
     if destination is None:
         # the upload set's destination wasn't given
@@ -129,17 +304,55 @@ def config_for_set(
             if defaults['dest'] is not None:
                 using_defaults = True
                 destination = os.path.join(defaults['dest'], uset.name)
+            elif backend is not None:
+                # the backend doesn't need a local destination.
+                destination = ''
             else:
                 raise RuntimeError(f"no destination for set {uset.name}")
 
     if base_url is None and using_defaults and defaults['url']:
         base_url = addslash(defaults['url']) + uset.name + '/'
 
-    return UploadConfig(destination, base_url, allow_extns, deny_extns)
+    if sendfile is not None:
+        if sendfile_prefix is None:
+            sendfile_prefix = os.path.abspath(destination)
+        sendfile_prefix = addslash(sendfile_prefix)
+
+    return UploadConfig(
+        destination,
+        base_url,
+        allow_extns,
+        deny_extns,
+        reserve,
+        deduplicate,
+        backend,
+        atomic,
+        fsync,
+        max_age,
+        etag,
+        max_size,
+        folder_max_sizes,
+        sniff,
+        executor,
+        max_writes,
+        shard_depth,
+        image_executor,
+        compress,
+        compress_on_save,
+        listing,
+        quota,
+        folder_quota,
+        ttl,
+        sendfile,
+        sendfile_prefix
+    )
 
 
 def configure_uploads(
-        app: Quart, upload_sets: Union[UploadSet, tuple[UploadSet, ...]]
+        app: Quart,
+        upload_sets: Union[UploadSet, tuple[UploadSet, ...]],
+        executor: Optional[Executor] = None,
+        image_executor: Optional[Executor] = None
 ) -> None:
     """
     Call this after the app has been configured. It will go through all the
@@ -147,11 +360,24 @@ def configure_uploads(
     app. It will also register the uploads module if it hasn't been set. This
     can be called multiple times with different upload sets. The uploads
     module/blueprint will only be registered if it is needed to serve the
-    upload sets.
+    upload sets or their listings, or to serve the metrics if the
+    `UPLOADS_METRICS` setting is on. The resumable uploads blueprint is
+    registered if the `UPLOADS_RESUMABLE` setting is on.
 
     Arguments:
         app: The `~quart.Quart` instance to get the configuration from.
         upload_sets: The `UploadSet` instances to configure.
+        executor: A dedicated executor, such as a
+                  `~concurrent.futures.ThreadPoolExecutor`, shared by these
+                  sets' blocking file operations, so they don't compete
+                  with the app's other work in the event loop's default
+                  executor. A set's `UPLOADED_X_EXECUTOR` setting takes
+                  precedence.
+        image_executor: The executor these sets' image variants are
+                        rendered in, such as a
+                        `~concurrent.futures.ProcessPoolExecutor`. By
+                        default they share a process pool. A set's
+                        `UPLOADED_X_IMAGE_EXECUTOR` setting takes precedence.
     """
 
     if isinstance(upload_sets, UploadSet):
@@ -164,13 +390,29 @@ def configure_uploads(
 
     defaults = {
         "dest": app.config.get('UPLOADS_DEFAULT_DEST'),
-        "url": app.config.get('UPLOADS_DEFAULT_URL')
+        "url": app.config.get('UPLOADS_DEFAULT_URL'),
+        "executor": executor,
+        "image_executor": image_executor
     }
 
     for uset in upload_sets:
         config = config_for_set(uset, app, defaults)
         uploads[uset.name] = config
+        uploads.sets[uset.name] = uset
+        uset._configure(app, config)
+
+    if app.config.get('UPLOADS_METRICS', False) and uploads.metrics is None:
+        uploads.metrics = MetricsRegistry(app)
 
-    should_serve = any(s.base_url is None for s in uploads.values())
+    should_serve = any(
+        s.base_url is None or s.listing for s in uploads.values()
+    )
+    should_serve = should_serve or uploads.metrics is not None
     if '_uploads' not in app.blueprints and should_serve:
         app.register_blueprint(uploads_mod)
+
+    resumable = app.config.get('UPLOADS_RESUMABLE', False)
+    if '_uploads_resumable' not in app.blueprints and resumable:
+        # Checked up front rather than on the first upload.
+        ttl_seconds(app.config.get('UPLOADS_RESUMABLE_TTL'))
+        app.register_blueprint(resumable_mod)
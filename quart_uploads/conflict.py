@@ -0,0 +1,115 @@
+"""
+quart_uploads.conflict
+
+Provides the index used by `UploadSet.resolve_conflict` to pick a free name
+for a file without probing every numbered duplicate.
+"""
+from __future__ import annotations
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Callable, Dict, Optional, Tuple
+
+from .executor import run_blocking
+
+SUFFIX_RE = re.compile(r'^(.*)_(\d+)$')
+
+FolderIndex = Dict[Tuple[str, str], int]
+
+
+def scan_folder(target_folder: str) -> FolderIndex:
+    """
+    Builds the index for a single folder with one `os.scandir` pass. The
+    index maps each ``(name, ext)`` pair to the highest numeric suffix
+    found for it, so ``photo_3.jpg`` is recorded as ``('photo', '.jpg'): 3``.
+
+    Arguments:
+        target_folder: The absolute path of the folder to scan.
+    """
+    index: FolderIndex = {}
+    try:
+        with os.scandir(target_folder) as entries:
+            for entry in entries:
+                name, ext = os.path.splitext(entry.name)
+                match = SUFFIX_RE.match(name)
+                if match is None:
+                    continue
+                key = (match.group(1), ext)
+                index[key] = max(index.get(key, 0), int(match.group(2)))
+    except FileNotFoundError:
+        pass
+    return index
+
+
+class ConflictIndex:
+    """
+    This keeps, per folder, the highest suffix handed out for each name, so
+    the next free name can be found in constant time no matter how many
+    duplicates already exist. A folder is scanned the first time it is
+    needed, and only the most recently used folders are kept.
+
+    Arguments:
+        max_folders: The number of folders to keep an index for.
+        scan: The function used to seed the index for a folder. If this is
+              `None`, folders start empty and only learn the names handed
+              out, which is used for storage backends that can't be
+              scanned cheaply.
+    """
+    def __init__(
+        self,
+        max_folders: int = 1024,
+        scan: Optional[Callable[[str], FolderIndex]] = scan_folder
+    ) -> None:
+        self.max_folders = max_folders
+        self.scan = scan
+        self._folders: OrderedDict[str, FolderIndex] = OrderedDict()
+
+    async def _folder(
+        self, target_folder: str, executor: Optional[Executor] = None
+    ) -> FolderIndex:
+        target_folder = os.fspath(target_folder)
+        index = self._folders.get(target_folder)
+        if index is None and self.scan is None:
+            index = self._folders[target_folder] = {}
+        elif index is None:
+            scanned = await run_blocking(executor, self.scan, target_folder)
+            # Another task may have seeded the folder while this one was
+            # scanning, keep the highest suffix from both.
+            index = self._folders.setdefault(target_folder, scanned)
+            if index is not scanned:
+                for key, count in scanned.items():
+                    index[key] = max(index.get(key, 0), count)
+        self._folders.move_to_end(target_folder)
+        while len(self._folders) > self.max_folders:
+            self._folders.popitem(last=False)
+        return index
+
+    async def next_name(
+        self,
+        target_folder: str,
+        basename: str,
+        executor: Optional[Executor] = None
+    ) -> str:
+        """
+        Returns the next numbered name for `basename` in the target folder,
+        i.e. ``photo_4.jpg`` if ``photo_3.jpg`` is the highest seen so far.
+        The name is recorded as used, so it won't be returned again.
+
+        Arguments:
+            target_folder: The absolute path to the target.
+            basename: The file's original basename.
+            executor: The executor to scan the folder in, or `None` for the
+                      event loop's default executor.
+        """
+        index = await self._folder(target_folder, executor)
+        name, ext = os.path.splitext(basename)
+        count = index.get((name, ext), 0) + 1
+        index[(name, ext)] = count
+        return f'{name}_{count}{ext}'
+
+    def clear(self) -> None:
+        """
+        Forgets every folder, so they are scanned again on next use.
+        """
+        self._folders.clear()
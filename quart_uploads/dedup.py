@@ -0,0 +1,148 @@
+"""
+quart_uploads.dedup
+
+Provides the content-addressed blob store used by upload sets with the
+`deduplicate` setting, so byte-identical uploads share one copy on disk.
+"""
+from __future__ import annotations
+import contextlib
+import hashlib
+import os
+import shutil
+import uuid
+from concurrent.futures import Executor
+from typing import Any, Dict, IO, Optional, Tuple
+
+import aiofiles.os
+
+from .executor import run_blocking
+from .utils import make_temp
+from .writer import write_stream
+
+#: The folder, within the set's destination, that blobs are stored in.
+BLOB_FOLDER = '.blobs'
+
+
+def link_or_copy(source: str, target: str) -> None:
+    """
+    Hardlinks the source file to the target path, replacing anything that
+    is already there. If the filesystem doesn't support hardlinks, the file
+    is copied instead.
+
+    Arguments:
+        source: The path of the existing file.
+        target: The path to link it to.
+    """
+    folder, name = os.path.split(target)
+    temp = os.path.join(folder, f'.{name}.{uuid.uuid4().hex}.link')
+    try:
+        os.link(source, temp)
+    except OSError:
+        shutil.copyfile(source, temp)
+    try:
+        os.replace(temp, target)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp)
+        raise
+
+
+class BlobStore:
+    """
+    This stores files under their SHA-256 digest in a sharded folder, i.e.
+    ``ab/cd/abcd...``, and links the user facing names to the blobs. Saving
+    a file whose content is already stored costs one hash pass and no
+    second copy.
+
+    Arguments:
+        root: The absolute path of the folder to keep the blobs in.
+        executor: The executor to run the file operations in, or `None`
+                  for the event loop's default executor.
+    """
+    def __init__(
+        self, root: str, executor: Optional[Executor] = None
+    ) -> None:
+        self.root = root
+        self.executor = executor
+
+    def blob_path(self, digest: str) -> str:
+        """
+        Returns the path of the blob for a SHA-256 hex digest.
+
+        Arguments:
+            digest: The hex digest of the blob's content.
+        """
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    async def save(
+        self,
+        stream: IO[bytes],
+        target: str,
+        hashers: Optional[Dict[str, Any]] = None,
+        max_size: Optional[int] = None
+    ) -> Tuple[str, int]:
+        """
+        Streams the file into the blob store and links it to the target
+        path. Returns the SHA-256 hex digest and the number of bytes
+        written.
+
+        Arguments:
+            stream: The stream to read from.
+            target: The absolute path of the user facing file.
+            hashers: Additional `hashlib` objects to update, by name.
+            max_size: If given, `UploadTooLarge` is raised as soon as the
+                      file is larger than this.
+        """
+        hashers = dict(hashers or {})
+        sha256 = hashers.setdefault('sha256', hashlib.sha256())
+
+        executor = self.executor
+        await aiofiles.os.makedirs(
+            self.root, exist_ok=True, executor=executor
+        )
+        fd, temp = await run_blocking(
+            executor, make_temp, dir=self.root, suffix='.part'
+        )
+        os.close(fd)
+        try:
+            size = await write_stream(
+                stream,
+                temp,
+                hashers.values(),
+                max_size=max_size,
+                executor=executor
+            )
+            digest = sha256.hexdigest()
+            blob = self.blob_path(digest)
+            await run_blocking(executor, self._commit, temp, blob)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                await aiofiles.os.remove(temp, executor=executor)
+
+        await run_blocking(executor, link_or_copy, blob, target)
+        return digest, size
+
+    @staticmethod
+    def _commit(temp: str, blob: str) -> None:
+        if os.path.exists(blob):
+            return
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        # Identical content may be committed by two saves at once, either
+        # copy is correct.
+        os.replace(temp, blob)
+
+    def prune(self) -> int:
+        """
+        Removes the blobs that no upload links to any more, and returns
+        how many were removed. This blocks, so run it in a thread from
+        async code.
+        """
+        removed = 0
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(folder, name)
+                if name.endswith('.part') or os.stat(path).st_nlink > 1:
+                    continue
+                os.remove(path)
+                removed += 1
+        return removed
@@ -11,6 +11,30 @@ class UploadNotAllowed(Exception):
     """
 
 
+class UploadTooLarge(UploadNotAllowed):
+    """
+    This exception is raised if the upload is larger than the size limit
+    for its set or folder. As it is a kind of `UploadNotAllowed`, catching
+    that catches this too.
+    """
+
+
+class QuotaExceeded(UploadTooLarge):
+    """
+    This exception is raised if saving the upload would take its set or
+    folder over its storage quota. It is a kind of `UploadTooLarge`, and so
+    of `UploadNotAllowed`.
+    """
+
+
+class UploadTypeMismatch(UploadNotAllowed):
+    """
+    This exception is raised if a set sniffs content and the first bytes of
+    the upload don't match its extension, i.e. an executable named
+    ``photo.jpg``. It is a kind of `UploadNotAllowed`.
+    """
+
+
 class AllExcept(object):
     """
     This can be used to allow all file types except certain ones. For example,
@@ -0,0 +1,36 @@
+"""
+quart_uploads.executor
+
+Provides the helper used to run blocking file operations, so an upload set
+can be given a dedicated executor instead of sharing the event loop's
+default one with the rest of the app.
+"""
+from __future__ import annotations
+import asyncio
+import functools
+from concurrent.futures import Executor
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+def run_blocking(
+    executor: Optional[Executor],
+    func: Callable[..., T],
+    *args: Any,
+    **kwargs: Any
+) -> Awaitable[T]:
+    """
+    Runs a blocking function in the executor, or in the event loop's
+    default executor if that is `None`, like `asyncio.to_thread`.
+
+    Arguments:
+        executor: The executor to run the function in.
+        func: The function to run.
+        args: The positional arguments for the function.
+        kwargs: The keyword arguments for the function.
+    """
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(
+        executor, functools.partial(func, *args, **kwargs)
+    )
@@ -0,0 +1,361 @@
+"""
+quart_uploads.expiry
+
+Provides the scheduler that deletes an upload set's files once their time
+to live is up. It keeps the deadlines in a min-heap, so each cycle only
+looks at the files that are due, and deletes them in small batches with a
+pause between, so a backlog doesn't swamp the disk. `configure_uploads`
+starts a scheduler for each set when the app starts serving, and stops it
+when the app shuts down.
+"""
+from __future__ import annotations
+import asyncio
+import contextlib
+import heapq
+import logging
+import os
+import time
+from concurrent.futures import Executor
+from datetime import timedelta
+from typing import (
+    IO, Callable, Dict, Iterator, List, Optional, Tuple, Union, TYPE_CHECKING
+)
+
+from .executor import run_blocking
+from .usage import logical_folder
+
+try:
+    import fcntl
+except ImportError:  # i.e. on Windows
+    fcntl = None
+
+if TYPE_CHECKING:
+    from .set import UploadSet
+
+logger = logging.getLogger(__name__)
+
+#: The file, in the set's destination, that the deadline of each save is
+#: recorded in, so it survives a restart.
+EXPIRY_FILE = '.expiry.log'
+
+#: A time to live, in seconds or as a `datetime.timedelta`.
+TTL = Union[int, float, timedelta]
+
+
+def ttl_seconds(ttl: Optional[TTL]) -> Optional[float]:
+    """
+    Returns the time to live in seconds, or `None` if there is none.
+
+    Arguments:
+        ttl: The time to live, in seconds or as a `datetime.timedelta`.
+    """
+    if ttl is None:
+        return None
+    if isinstance(ttl, timedelta):
+        ttl = ttl.total_seconds()
+    if ttl <= 0:
+        raise ValueError("ttl must be positive")
+    return float(ttl)
+
+
+def scan_mtimes(root: str, depth: int) -> List[Tuple[str, float]]:
+    """
+    Returns the name, as returned by `UploadSet.save`, and age of every
+    file in the destination and its folders, skipping hidden files and
+    folders. The age is the modification time, except for hardlinked
+    files, such as deduplicated ones, whose modification time is that of
+    the first copy, so the later change time, which linking sets, is used.
+
+    Arguments:
+        root: The set's destination.
+        depth: The number of levels of shard folders.
+    """
+    files = []
+    for path, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        folder = logical_folder(os.path.relpath(path, root), depth)
+        for name in filenames:
+            if name.startswith('.'):
+                continue
+            try:
+                stat = os.stat(os.path.join(path, name))
+            except FileNotFoundError:
+                continue
+            mtime = stat.st_mtime
+            if stat.st_nlink > 1:
+                mtime = max(mtime, stat.st_ctime)
+            files.append((f'{folder}/{name}' if folder else name, mtime))
+    return files
+
+
+@contextlib.contextmanager
+def _locked(path: str, mode: str) -> Iterator[IO[str]]:
+    """
+    Opens the journal with an exclusive lock, so appends and rewrites from
+    other threads and processes don't interleave, reopening it if it was
+    replaced while waiting for the lock.
+    """
+    while True:
+        file_ = open(path, mode, encoding='utf-8')
+        if fcntl is None:
+            break
+        fcntl.flock(file_.fileno(), fcntl.LOCK_EX)
+        try:
+            if os.fstat(file_.fileno()).st_ino == os.stat(path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        file_.close()
+    with file_:
+        yield file_
+
+
+def read_journal(
+    path: str, locate: Callable[[str], str]
+) -> Dict[str, Tuple[float, int]]:
+    """
+    Reads the deadlines recorded for saves, with the modification time
+    each file had when it was saved, and rewrites the journal without the
+    entries for files that are gone or were replaced since.
+
+    Arguments:
+        path: The path of the journal.
+        locate: Returns the path of a file from its name.
+    """
+    try:
+        with _locked(path, 'r') as file_:
+            entries = _live_entries(file_, locate)
+            # Rewritten while locked, so no append is lost.
+            temp = path + '.tmp'
+            with open(temp, 'w', encoding='utf-8') as compacted:
+                compacted.writelines(
+                    f'{deadline!r}\t{mtime_ns}\t{name}\n'
+                    for name, (deadline, mtime_ns) in entries.items()
+                )
+            os.replace(temp, path)
+    except FileNotFoundError:
+        return {}
+    return entries
+
+
+def _live_entries(
+    file_: IO[str], locate: Callable[[str], str]
+) -> Dict[str, Tuple[float, int]]:
+    entries: Dict[str, Tuple[float, int]] = {}
+    for line in file_:
+        try:
+            deadline, mtime_ns, name = line.rstrip('\n').split('\t', 2)
+            entries[name] = (float(deadline), int(mtime_ns))
+        except ValueError:
+            # i.e. cut short by a crash while it was appended.
+            logger.warning("Skipping malformed expiry entry %r", line)
+    for name, (_, mtime_ns) in list(entries.items()):
+        try:
+            if os.stat(locate(name)).st_mtime_ns != mtime_ns:
+                del entries[name]
+        except FileNotFoundError:
+            del entries[name]
+    return entries
+
+
+def append_journal(path: str, name: str, deadline: float, target: str) -> None:
+    """
+    Records the deadline of a save in the journal.
+
+    Arguments:
+        path: The path of the journal.
+        name: The name of the file.
+        deadline: When the file expires, as a Unix timestamp.
+        target: The path of the file.
+    """
+    mtime_ns = os.stat(target).st_mtime_ns
+    with _locked(path, 'a') as file_:
+        file_.write(f'{deadline!r}\t{mtime_ns}\t{name}\n')
+
+
+class ExpiryScheduler:
+    """
+    This deletes an upload set's files when they expire. Each file's
+    deadline is the time it was saved plus the set's `ttl`, unless the save
+    gave its own. When it starts, the scheduler builds its heap from the
+    journal of the saves' deadlines, and from one scan of the destination,
+    if the set has a TTL, for the files saved some other way. From then
+    on, saves and deletes keep it up to date, and the folder isn't scanned
+    again. The journal is compacted as files expire.
+
+    Arguments:
+        uset: The upload set.
+        root: The set's destination.
+        ttl: The set's time to live in seconds, or `None`.
+        depth: The number of levels of shard folders.
+        executor: The executor to scan and write the journal in.
+    """
+
+    #: The most files deleted in one batch.
+    batch_size = 100
+    #: The pause, in seconds, between two batches.
+    batch_pause = 0.1
+    #: The longest the scheduler sleeps, in seconds, so a change of the
+    #: system clock is noticed.
+    max_sleep = 300.0
+    #: The number of files that expire before the journal is compacted.
+    compact_after = 1000
+
+    def __init__(
+        self,
+        uset: UploadSet,
+        root: str,
+        ttl: Optional[float] = None,
+        depth: int = 0,
+        executor: Optional[Executor] = None
+    ) -> None:
+        self.uset = uset
+        self.root = root
+        self.ttl = ttl
+        self.depth = depth
+        self.executor = executor
+        self.deadlines: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._wake = asyncio.Event()
+        self._loading: Optional[asyncio.Future[None]] = None
+        self._expired = 0
+        self._task: Optional[asyncio.Task[None]] = None
+
+    @property
+    def journal(self) -> str:
+        """
+        The path of the journal of the saves' deadlines.
+        """
+        return os.path.join(self.root, EXPIRY_FILE)
+
+    def _locate(self, name: str) -> str:
+        return self.uset._join(self.root, name)
+
+    async def load(self) -> None:
+        """
+        Builds the heap of deadlines, unless it is built already.
+        Concurrent calls share one load, and a load that failed is tried
+        again.
+        """
+        loading = self._loading
+        if loading is None or (loading.done() and (
+            loading.cancelled() or loading.exception() is not None
+        )):
+            loading = self._loading = asyncio.ensure_future(self._load())
+        await asyncio.shield(loading)
+
+    async def _load(self) -> None:
+        if self.ttl is not None:
+            for name, mtime in await run_blocking(
+                self.executor, scan_mtimes, self.root, self.depth
+            ):
+                self.schedule(name, mtime + self.ttl)
+        entries = await run_blocking(
+            self.executor, read_journal, self.journal, self._locate
+        )
+        for name, (deadline, _) in entries.items():
+            self.schedule(name, deadline)
+
+    def schedule(self, name: str, deadline: Optional[float]) -> None:
+        """
+        Sets when a file expires, replacing any earlier deadline, or stops
+        it expiring if the deadline is `None`.
+
+        Arguments:
+            name: The name of the file, as returned by `UploadSet.save`.
+            deadline: When the file expires, as a Unix timestamp.
+        """
+        if deadline is None:
+            # The heap entry is skipped when it comes up.
+            self.deadlines.pop(name, None)
+            return
+        self.deadlines[name] = deadline
+        heapq.heappush(self._heap, (deadline, name))
+        if self._heap[0] == (deadline, name):
+            self._wake.set()
+
+    def _next_deadline(self) -> Optional[float]:
+        heap = self._heap
+        while heap and self.deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    async def expire(self, now: Optional[float] = None) -> List[str]:
+        """
+        Deletes the files that are due, in batches, and returns their
+        names.
+
+        Arguments:
+            now: The current time, as a Unix timestamp.
+        """
+        await self.load()
+        expired: List[str] = []
+        while True:
+            batch: List[str] = []
+            when = time.time() if now is None else now
+            while len(batch) < self.batch_size:
+                deadline = self._next_deadline()
+                if deadline is None or deadline > when:
+                    break
+                _, name = heapq.heappop(self._heap)
+                del self.deadlines[name]
+                batch.append(name)
+            if not batch:
+                break
+
+            for name in batch:
+                try:
+                    await self.uset.delete(name)
+                except FileNotFoundError:
+                    continue
+                except OSError:
+                    logger.exception("Couldn't delete expired file %s", name)
+                    continue
+                expired.append(name)
+            if len(batch) == self.batch_size:
+                await asyncio.sleep(self.batch_pause)
+
+        self._expired += len(expired)
+        if self._expired >= self.compact_after:
+            self._expired = 0
+            await run_blocking(
+                self.executor, read_journal, self.journal, self._locate
+            )
+        return expired
+
+    async def run(self) -> None:
+        """
+        Deletes files as they expire, until cancelled. If a cycle fails, it
+        is logged and tried again after `max_sleep`, or sooner if a save
+        wakes the scheduler.
+        """
+        while True:
+            self._wake.clear()
+            delay = self.max_sleep
+            try:
+                await self.expire()
+            except Exception:
+                logger.exception("Couldn't expire files in %s", self.root)
+            else:
+                deadline = self._next_deadline()
+                if deadline is not None:
+                    delay = min(max(deadline - time.time(), 0), delay)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), delay)
+
+    def start(self) -> None:
+        """
+        Starts deleting files in a background task.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        """
+        Stops the background task.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
@@ -3,7 +3,10 @@ quart_uploads.file_ext
 """
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Any, Tuple
+from functools import cached_property
+from typing import Any, FrozenSet, Iterable, Tuple
+
+from .exceptions import AllExcept
 
 
 @dataclass(frozen=True)
@@ -83,12 +86,12 @@ class FileExtensions:
     # `AllExcept`.
     Executables = tuple('so exe dll'.split())
 
-    @property
+    @cached_property
     def Defaults(self) -> Tuple[str]:
         """
         Returns the default allowed file extensions.
         It is a combination of text, documents, and
-        images.
+        images. It is built once and then reused.
         """
         return self.Text + self.Documents + self.Images
 
@@ -108,3 +111,83 @@ class All:
 #: This "contains" all items. You can use it to allow all extensions to be
 #: uploaded.
 ALL = All()
+
+
+def _normalise(extensions: Iterable[str]) -> FrozenSet[str]:
+    return frozenset(ext.lower().lstrip('.') for ext in extensions)
+
+
+class ExtensionMatcher:
+    """
+    This holds an upload set's extensions and its configured allow and deny
+    lists compiled into frozensets, so checking an extension costs a few
+    set lookups however long the lists are. Matching ignores case, and
+    multi-part extensions such as ``tar.gz`` are supported.
+
+    Arguments:
+        extensions: The upload set's extensions, which may be `ALL` or an
+                    `AllExcept`.
+        allow: Extensions to allow even if they're not in `extensions`.
+        deny: Extensions to deny even if they are in `extensions`.
+    """
+    def __init__(
+        self,
+        extensions: Any,
+        allow: Iterable[str] = (),
+        deny: Iterable[str] = ()
+    ) -> None:
+        self.allow = _normalise(allow)
+        self.deny = _normalise(deny)
+        self.allow_all = isinstance(extensions, (All, AllExcept))
+        if isinstance(extensions, AllExcept):
+            self.excluded = _normalise(extensions.items)
+            self.extensions: FrozenSet[str] = frozenset()
+        elif isinstance(extensions, All):
+            self.excluded = frozenset()
+            self.extensions = frozenset()
+        else:
+            self.excluded = frozenset()
+            self.extensions = _normalise(extensions)
+
+        self.multipart = frozenset(
+            ext for ext in (
+                self.allow | self.deny | self.extensions | self.excluded
+            ) if '.' in ext
+        )
+        self.max_parts = max(
+            (ext.count('.') + 1 for ext in self.multipart), default=1
+        )
+
+    def allowed(self, ext: str) -> bool:
+        """
+        Returns whether the extension, without the leading dot, is allowed.
+
+        Arguments:
+            ext: The extension to check, i.e. ``jpg`` or ``tar.gz``.
+        """
+        ext = ext.lower()
+        if ext in self.allow:
+            return True
+        if ext in self.deny:
+            return False
+        if self.allow_all:
+            return ext not in self.excluded
+        return ext in self.extensions
+
+    def extension_for(self, basename: str) -> str | None:
+        """
+        Returns the longest multi-part extension of the basename that any
+        of the rules mention, i.e. ``tar.gz`` for ``backup.tar.gz`` if
+        ``tar.gz`` is allowed or denied, or `None` if there isn't one.
+
+        Arguments:
+            basename: The file's basename.
+        """
+        if not self.multipart:
+            return None
+        parts = basename.lower().split('.')
+        for count in range(min(self.max_parts, len(parts) - 1), 1, -1):
+            candidate = '.'.join(parts[-count:])
+            if candidate in self.multipart:
+                return candidate
+        return None
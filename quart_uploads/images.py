@@ -0,0 +1,180 @@
+"""
+quart_uploads.images
+
+Provides image variants, such as thumbnails, for upload sets of images.
+Each variant is rendered the first time it is asked for, in a process pool
+so resizing doesn't hold up the event loop, and cached on disk next to the
+original. Rendering needs Pillow, which is an optional dependency.
+"""
+from __future__ import annotations
+import asyncio
+import multiprocessing
+import os
+import posixpath
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from .executor import run_blocking
+from .utils import make_temp
+
+#: The folder, next to each original, that its variants are cached in.
+#: Uploaded names can't start with a dot, so it can't clash with them.
+VARIANTS_FOLDER = '.variants'
+
+
+@dataclass(frozen=True)
+class ImageVariant:
+    """
+    This describes a named variant of the images in an upload set. The
+    image is scaled down, keeping its aspect ratio, to fit within the
+    width and height. Images smaller than that are not scaled up.
+
+    Arguments:
+        width: The largest width of the variant, in pixels.
+        height: The largest height of the variant, in pixels.
+        format: The format to save the variant in, such as ``webp``, or
+        `None` to keep the original's format.
+        quality: The quality to save lossy formats with, or `None` for
+        Pillow's default.
+    """
+
+    width: int
+    height: int
+    format: Optional[str] = None
+    quality: Optional[int] = None
+
+
+def variant_name(name: str, variant: str, spec: ImageVariant) -> str:
+    """
+    Returns the name, relative to the set's destination, that a variant of
+    a stored file is cached under. If the variant changes the format, its
+    extension is added to the original name, so ``photo.jpg`` and
+    ``photo.png`` don't share a variant.
+
+    Arguments:
+        name: The stored name of the original, including any folders.
+        variant: The name of the variant.
+        spec: The variant's description.
+    """
+    folder, basename = posixpath.split(name)
+    if spec.format is not None:
+        basename = f'{basename}.{spec.format.lower()}'
+    return posixpath.join(folder, VARIANTS_FOLDER, variant, basename)
+
+
+def render_variant(source: str, target: str, spec: ImageVariant) -> None:
+    """
+    Renders a variant of the source image to the target path. This runs in
+    a worker process, so it is a plain function of picklable arguments.
+    The variant is written to a temporary file and moved into place, so a
+    partial variant is never served.
+
+    Arguments:
+        source: The absolute path of the original image.
+        target: The absolute path to write the variant to.
+        spec: The variant's description.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError as error:
+        raise RuntimeError("Image variants need Pillow") from error
+
+    folder = os.path.dirname(target)
+    os.makedirs(folder, exist_ok=True)
+    with Image.open(source) as original:
+        image_format = (spec.format or original.format or 'png').upper()
+        if image_format == 'JPG':
+            image_format = 'JPEG'
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((spec.width, spec.height))
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        options = {}
+        if spec.quality is not None:
+            options['quality'] = spec.quality
+        fd, temp = make_temp(dir=folder, prefix='.render-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                image.save(file, image_format, **options)
+            os.replace(temp, target)
+        except BaseException:
+            os.unlink(temp)
+            raise
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def default_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process pool that variants are rendered in when the set
+    has no `image_executor`, creating it the first time. The workers are
+    spawned rather than forked, as forking a process with running threads
+    isn't safe.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _pool
+
+
+class VariantCache:
+    """
+    This makes sure the variants of an upload set are rendered. A cached
+    variant is used as long as it is newer than its original, and
+    concurrent requests for the same missing variant share a single
+    render.
+    """
+
+    def __init__(self) -> None:
+        self._pending: Dict[str, asyncio.Future[None]] = {}
+
+    async def ensure(
+        self,
+        source: str,
+        target: str,
+        spec: ImageVariant,
+        executor: Optional[Executor] = None,
+        io_executor: Optional[Executor] = None
+    ) -> None:
+        """
+        Renders the variant at the target path, unless it is already
+        cached. It raises `FileNotFoundError` if the original is missing.
+
+        Arguments:
+            source: The absolute path of the original image.
+            target: The absolute path of the variant.
+            spec: The variant's description.
+            executor: The executor to render in, or `None` for the shared
+                      process pool.
+            io_executor: The executor for the file checks.
+        """
+        original = await run_blocking(io_executor, os.stat, source)
+        try:
+            cached = await run_blocking(io_executor, os.stat, target)
+        except FileNotFoundError:
+            pass
+        else:
+            if cached.st_mtime_ns >= original.st_mtime_ns:
+                return
+
+        future = self._pending.get(target)
+        if future is None:
+            future = asyncio.ensure_future(run_blocking(
+                executor or default_pool(),
+                render_variant,
+                source,
+                target,
+                spec
+            ))
+            self._pending[target] = future
+            future.add_done_callback(
+                lambda _: self._pending.pop(target, None)
+            )
+        # Shielded, so a request that goes away doesn't cancel the render
+        # for the others waiting on it.
+        await asyncio.shield(future)
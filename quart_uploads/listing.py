@@ -0,0 +1,126 @@
+"""
+quart_uploads.listing
+
+Provides the folder scan behind `UploadSet.iter_files`. Each page of a
+listing is picked in one `os.scandir` pass, keeping only the page's
+entries in memory, and pages resume after the last name of the one
+before, so a listing can be continued from a cursor in a later request.
+"""
+from __future__ import annotations
+import heapq
+import os
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+#: The names of the folders a sharded set spreads its files over.
+SHARD_RE = re.compile(r'^[0-9a-f]{2}$')
+
+#: A listed file's path relative to the scanned folder, size and mtime.
+Entry = Tuple[str, int, float]
+
+
+@dataclass
+class StoredFile:
+    """
+    This describes a file listed by `UploadSet.iter_files`.
+
+    Arguments:
+        name: The file's name, including the folder, as returned by
+        `UploadSet.save`. It is also the cursor to resume a listing after
+        this file.
+        size: The size of the file in bytes.
+        mtime: The time the file was last modified, as a Unix timestamp.
+    """
+
+    name: str
+    size: int
+    mtime: float
+
+
+def list_page(
+    folder: str,
+    depth: int,
+    limit: int,
+    after: Optional[str] = None,
+    prefix: Optional[str] = None
+) -> List[Entry]:
+    """
+    Returns up to `limit` files from the folder, in order of their path
+    relative to it, starting after the given path. The folder's
+    subfolders aren't listed, except for its shard folders if `depth` is
+    given, and hidden files, such as the set's own bookkeeping, are
+    skipped. A folder that doesn't exist has no files.
+
+    Arguments:
+        folder: The absolute path of the folder to list.
+        depth: The number of levels of shard folders.
+        limit: The most files to return.
+        after: The relative path, with shard folders, to start after.
+        prefix: Only list files whose names start with this.
+    """
+    page: List[Entry] = []
+    _list_folder(
+        folder, '', depth, after.split('/') if after else (), prefix,
+        limit, page
+    )
+    return page
+
+
+def _list_folder(
+    folder: str,
+    relative: str,
+    depth: int,
+    after: Sequence[str],
+    prefix: Optional[str],
+    limit: int,
+    page: List[Entry]
+) -> None:
+    try:
+        entries = os.scandir(folder)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+
+    with entries:
+        if depth > 0:
+            shards = sorted(
+                entry.name for entry in entries
+                if SHARD_RE.match(entry.name) and entry.is_dir()
+            )
+        else:
+            start = after[0] if after else None
+            wanted = heapq.nsmallest(
+                limit - len(page),
+                (
+                    entry for entry in entries
+                    if not entry.name.startswith('.') and
+                    (start is None or entry.name > start) and
+                    (prefix is None or entry.name.startswith(prefix)) and
+                    entry.is_file()
+                ),
+                key=lambda entry: entry.name
+            )
+
+    if depth == 0:
+        for entry in wanted:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            page.append((relative + entry.name, stat.st_size, stat.st_mtime))
+        return
+
+    for shard in shards:
+        if len(page) >= limit:
+            return
+        if after and shard < after[0]:
+            continue
+        _list_folder(
+            os.path.join(folder, shard),
+            relative + shard + '/',
+            depth - 1,
+            after[1:] if after and shard == after[0] else (),
+            prefix,
+            limit,
+            page
+        )
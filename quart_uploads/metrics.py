@@ -0,0 +1,236 @@
+"""
+quart_uploads.metrics
+
+Provides an optional in-process metrics registry, fed by the upload
+signals, with counters and histograms for each upload set. It renders them
+in the Prometheus text format for the ``/_uploads/metrics`` endpoint,
+which is enabled by the `UPLOADS_METRICS` setting.
+"""
+from __future__ import annotations
+import bisect
+import math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from quart import Quart, has_app_context
+
+from .signals import (
+    conflict_resolved,
+    file_served,
+    upload_rejected,
+    upload_saved
+)
+from .utils import current_app_object
+
+#: The `Content-Type` of the Prometheus text format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#: The histogram buckets for durations, in seconds.
+TIME_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0
+)
+
+#: The histogram buckets for file sizes, in bytes.
+SIZE_BUCKETS = tuple(float(1024 * 4 ** power) for power in range(11))
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return (
+        value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+    )
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """
+    A value per set of labels that only goes up.
+
+    Arguments:
+        name: The metric's name.
+        documentation: The metric's help text.
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Adds the amount to the value for the labels.
+        """
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, Labels, float]]:
+        for labels, value in self.values.items():
+            yield self.name, labels, value
+
+
+class Histogram:
+    """
+    Counts observed values per set of labels into cumulative buckets, with
+    their sum and count.
+
+    Arguments:
+        name: The metric's name.
+        documentation: The metric's help text.
+        buckets: The upper bounds of the buckets, in increasing order.
+    """
+    kind = 'histogram'
+
+    def __init__(
+        self, name: str, documentation: str, buckets: Iterable[float]
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Records a value for the labels.
+        """
+        key = tuple(sorted(labels.items()))
+        counts, total = self.values.setdefault(
+            key, ([0] * len(self.buckets), [0.0])
+        )
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def samples(self) -> Iterable[Tuple[str, Labels, float]]:
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (
+                    self.name + '_bucket',
+                    labels + (('le', _format_value(bound)),),
+                    cumulative
+                )
+            yield self.name + '_sum', labels, total[0]
+            yield self.name + '_count', labels, cumulative
+
+
+class MetricsRegistry:
+    """
+    This holds the upload metrics of an app. It connects to the upload
+    signals when created, and only counts events sent from the app's
+    context or from outside any app context, so two apps in one process
+    keep their own numbers.
+
+    Arguments:
+        app: The app to collect metrics for, or `None` for every app.
+    """
+    def __init__(self, app: Optional[Quart] = None) -> None:
+        self.app = app
+        self.saved = Counter(
+            'quart_uploads_saved_total', "Files saved."
+        )
+        self.bytes_written = Counter(
+            'quart_uploads_written_bytes_total', "Bytes written by saves."
+        )
+        self.rejected = Counter(
+            'quart_uploads_rejected_total', "Uploads that were not allowed."
+        )
+        self.conflict_probes = Counter(
+            'quart_uploads_conflict_probes_total',
+            "Names tried while resolving conflicts."
+        )
+        self.served = Counter(
+            'quart_uploads_served_total', "Requests for uploaded files."
+        )
+        self.save_seconds = Histogram(
+            'quart_uploads_save_seconds', "Time taken to save a file.",
+            TIME_BUCKETS
+        )
+        self.file_bytes = Histogram(
+            'quart_uploads_file_bytes', "Sizes of the saved files.",
+            SIZE_BUCKETS
+        )
+        self.serve_seconds = Histogram(
+            'quart_uploads_serve_seconds',
+            "Time taken to prepare the response for a file.",
+            TIME_BUCKETS
+        )
+        self.metrics = (
+            self.saved,
+            self.bytes_written,
+            self.rejected,
+            self.conflict_probes,
+            self.served,
+            self.save_seconds,
+            self.file_bytes,
+            self.serve_seconds
+        )
+
+        # Weak references, so the registry goes away with its app.
+        upload_saved.connect(self._on_saved)
+        upload_rejected.connect(self._on_rejected)
+        conflict_resolved.connect(self._on_conflict)
+        file_served.connect(self._on_served)
+
+    def _relevant(self) -> bool:
+        if self.app is None or not has_app_context():
+            return True
+        return current_app_object() is self.app
+
+    def _on_saved(
+        self,
+        uset: Any,
+        size: Optional[int],
+        duration: float,
+        **kwargs: Any
+    ) -> None:
+        if not self._relevant():
+            return
+        self.saved.inc(set=uset.name)
+        self.save_seconds.observe(duration, set=uset.name)
+        if size is not None:
+            self.bytes_written.inc(size, set=uset.name)
+            self.file_bytes.observe(size, set=uset.name)
+
+    def _on_rejected(self, uset: Any, error: Exception, **kwargs: Any) -> None:
+        if self._relevant():
+            self.rejected.inc(set=uset.name, reason=type(error).__name__)
+
+    def _on_conflict(self, uset: Any, probes: int, **kwargs: Any) -> None:
+        if self._relevant():
+            self.conflict_probes.inc(probes, set=uset.name)
+
+    def _on_served(
+        self, uset: Any, status: int, duration: float, **kwargs: Any
+    ) -> None:
+        if not self._relevant():
+            return
+        self.served.inc(set=uset.name, status=str(status))
+        self.serve_seconds.observe(duration, set=uset.name)
+
+    def render(self) -> str:
+        """
+        Returns the metrics in the Prometheus text format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(
+                    f'{name}{_format_labels(labels)} {_format_value(value)}'
+                )
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,29 @@
+"""
+quart_uploads.result
+
+Defines the result returned by `UploadSet.save_with_result`.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+
+@dataclass
+class UploadResult:
+    """
+    This holds the outcome of saving a single file with
+    `UploadSet.save_with_result`.
+
+    Arguments:
+        name: The name the file was saved as, including the folder.
+        size: The number of bytes written.
+        digests: The hex digest of the file for each requested hash
+        algorithm, keyed by the algorithm name.
+        content_type: The mimetype sniffed from the file's first bytes, if
+        the set sniffs content and the format was recognised.
+    """
+
+    name: str
+    size: int
+    digests: Dict[str, str] = field(default_factory=dict)
+    content_type: Optional[str] = None
@@ -0,0 +1,409 @@
+"""
+quart_uploads.resumable
+
+Provides an optional blueprint implementing a tus-style resumable upload
+protocol. A client creates an upload, sends its bytes in chunks with
+PATCH requests at the current offset, and can ask for the offset with a
+HEAD request to resume after a dropped connection. Once every byte has
+arrived the file is saved into the upload set, with the usual extension
+checks and conflict resolution. Partial uploads that go untouched for
+`UPLOADS_RESUMABLE_TTL` are removed.
+
+It is registered by `configure_uploads` when `UPLOADS_RESUMABLE` is set.
+"""
+from __future__ import annotations
+import base64
+import binascii
+import contextlib
+import json
+import os
+import re
+import time
+import uuid
+from concurrent.futures import Executor
+from typing import (
+    IO, Any, AsyncIterator, Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+)
+
+import aiofiles
+import aiofiles.os
+from quart import (
+    abort,
+    Blueprint,
+    current_app,
+    request,
+    Response,
+    url_for
+)
+from quart.datastructures import FileStorage
+
+from .exceptions import UploadNotAllowed, UploadTooLarge
+from .executor import run_blocking
+from .expiry import ttl_seconds
+
+try:
+    import fcntl
+except ImportError:  # i.e. on Windows
+    fcntl = None
+
+if TYPE_CHECKING:
+    from .config import Uploads, UploadConfig
+    from .set import UploadSet
+
+TUS_VERSION = '1.0.0'
+
+#: The folder, within the set's destination, partial uploads are kept in.
+RESUMABLE_FOLDER = '.resumable'
+
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+#: How long, in seconds, a partial upload may go without being written to
+#: before it is removed, unless `UPLOADS_RESUMABLE_TTL` is set.
+DEFAULT_RESUMABLE_TTL = 86400.0
+
+#: The least time, in seconds, between two sweeps of a folder for stale
+#: partial uploads.
+SWEEP_INTERVAL = 60.0
+
+resumable_mod = Blueprint(
+    '_uploads_resumable', __name__, url_prefix='/_uploads/resumable'
+)
+
+# The uploads a request is currently writing to in this process, which is
+# all that keeps requests apart where file locks aren't available.
+_active: Set[str] = set()
+
+# When each folder of partial uploads was last swept, by path.
+_swept: Dict[str, float] = {}
+
+
+@resumable_mod.after_request
+async def add_tus_headers(response: Response) -> Response:
+    """
+    Adds the protocol headers to every response.
+    """
+    response.headers['Tus-Resumable'] = TUS_VERSION
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def parse_metadata(value: str) -> Dict[str, str]:
+    """
+    Parses an `Upload-Metadata` header, a comma separated list of keys
+    each followed by a space and its base64 encoded value.
+
+    Arguments:
+        value: The value of the header.
+    """
+    metadata = {}
+    for item in value.split(','):
+        key, _, encoded = item.strip().partition(' ')
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(encoded, validate=True).decode()
+        except (binascii.Error, UnicodeDecodeError):
+            abort(400)
+    return metadata
+
+
+def _lookup(setname: str) -> Tuple[UploadSet, UploadConfig, str]:
+    """
+    Returns the upload set, its configuration and the folder its partial
+    uploads are kept in, or aborts with a 404.
+    """
+    uploads: Uploads = current_app.extensions['uploads']
+    uset = uploads.sets.get(setname)
+    config = uploads.get(setname)
+    if uset is None or config is None:
+        abort(404)
+    folder = current_app.config.get('UPLOADS_RESUMABLE_DEST')
+    if folder is None:
+        folder = os.path.join(config.destination, RESUMABLE_FOLDER)
+    else:
+        folder = os.path.join(folder, setname)
+    return uset, config, folder
+
+
+def _paths(folder: str, upload_id: str) -> Tuple[str, str]:
+    if not UPLOAD_ID_RE.match(upload_id):
+        abort(404)
+    base = os.path.join(folder, upload_id)
+    return base + '.part', base + '.json'
+
+
+async def _load(
+    info_path: str, executor: Optional[Executor] = None
+) -> Dict[str, Any]:
+    try:
+        async with aiofiles.open(info_path, 'r', executor=executor) as file_:
+            return json.loads(await file_.read())
+    except FileNotFoundError:
+        abort(404)
+
+
+async def _offset(
+    part_path: str, executor: Optional[Executor] = None
+) -> int:
+    try:
+        return (await aiofiles.os.stat(part_path, executor=executor)).st_size
+    except FileNotFoundError:
+        abort(404)
+
+
+async def _discard(
+    part_path: str, info_path: str, executor: Optional[Executor] = None
+) -> None:
+    for path in (part_path, info_path):
+        with contextlib.suppress(FileNotFoundError):
+            await aiofiles.os.remove(path, executor=executor)
+
+
+def remove_stale(
+    folder: str, max_age: float, now: Optional[float] = None
+) -> List[str]:
+    """
+    Removes the partial uploads in the folder that haven't been written to
+    for `max_age` seconds, and returns their ids. Uploads a request is
+    writing to are left alone. This blocks, so run it in a thread from
+    async code.
+
+    Arguments:
+        folder: The folder the partial uploads are kept in.
+        max_age: The age, in seconds, of the uploads to remove.
+        now: The current time, as a Unix timestamp.
+    """
+    now = time.time() if now is None else now
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return []
+    upload_ids = {
+        upload_id for upload_id, ext in map(os.path.splitext, names)
+        if ext in ('.part', '.json') and UPLOAD_ID_RE.match(upload_id)
+    }
+    removed = []
+    for upload_id in sorted(upload_ids - _active):
+        base = os.path.join(folder, upload_id)
+        paths = (base + '.part', base + '.json')
+        with contextlib.ExitStack() as stack:
+            try:
+                part = stack.enter_context(open(paths[0], 'rb'))
+            except FileNotFoundError:
+                # Left by a crash, with only its info.
+                part = None
+            if part is not None and fcntl is not None:
+                try:
+                    fcntl.flock(part.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+            mtimes = []
+            for path in paths:
+                with contextlib.suppress(FileNotFoundError):
+                    mtimes.append(os.stat(path).st_mtime)
+            if not mtimes or now - max(mtimes) < max_age:
+                continue
+            for path in paths:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            removed.append(upload_id)
+    return removed
+
+
+async def _sweep(folder: str, executor: Optional[Executor] = None) -> None:
+    """
+    Removes the stale partial uploads in the folder, at most once every
+    `SWEEP_INTERVAL`.
+    """
+    max_age = ttl_seconds(
+        current_app.config.get('UPLOADS_RESUMABLE_TTL', DEFAULT_RESUMABLE_TTL)
+    )
+    now = time.time()
+    if max_age is None or now - _swept.get(folder, 0) < SWEEP_INTERVAL:
+        return
+    _swept[folder] = now
+    await run_blocking(executor, remove_stale, folder, max_age, now)
+
+
+@contextlib.asynccontextmanager
+async def _locked(
+    part_path: str, upload_id: str, executor: Optional[Executor] = None
+) -> AsyncIterator[Any]:
+    """
+    Opens a partial upload to write to, holding an exclusive lock on it so
+    no other request, in this process or another, writes to or removes it
+    meanwhile. Aborts with a 423 if another request holds the lock, or a
+    404 if the upload is gone.
+    """
+    try:
+        file_ = await aiofiles.open(part_path, 'r+b', executor=executor)
+    except FileNotFoundError:
+        abort(404)
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(file_.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                abort(423)
+            # The request that held the lock may have finished the upload.
+            stat = await run_blocking(executor, os.fstat, file_.fileno())
+            if stat.st_nlink == 0:
+                abort(404)
+        elif upload_id in _active:
+            abort(423)
+        _active.add(upload_id)
+        try:
+            yield file_
+        finally:
+            _active.discard(upload_id)
+    finally:
+        await file_.close()
+
+
+@resumable_mod.route('/<setname>/', methods=['POST'])
+async def create_upload(setname: str) -> Response:
+    """
+    Creates an upload. The request gives the file's size in the
+    `Upload-Length` header and its name as ``filename`` in the
+    `Upload-Metadata` header. The response's `Location` is the URL to send
+    the file's bytes to.
+    """
+    uset, config, folder = _lookup(setname)
+    executor = config.executor
+
+    try:
+        length = int(request.headers['Upload-Length'])
+    except (KeyError, ValueError):
+        abort(400)
+    if length < 0:
+        abort(400)
+    max_size = current_app.config.get('UPLOADS_RESUMABLE_MAX_SIZE')
+    if max_size is not None and length > max_size:
+        abort(413)
+    max_size = uset.max_size_for()
+    if max_size is not None and length > max_size:
+        abort(413)
+    room = await uset.quota_remaining()
+    if room is not None and length > room:
+        abort(413)
+
+    metadata = parse_metadata(request.headers.get('Upload-Metadata', ''))
+    filename = metadata.get('filename')
+    if not filename:
+        abort(400)
+    if not uset.file_allowed(uset.get_basename(filename)):
+        abort(403)
+
+    upload_id = uuid.uuid4().hex
+    await aiofiles.os.makedirs(folder, exist_ok=True, executor=executor)
+    await _sweep(folder, executor)
+    part_path, info_path = _paths(folder, upload_id)
+    async with aiofiles.open(part_path, 'wb', executor=executor):
+        pass
+    async with aiofiles.open(info_path, 'w', executor=executor) as file_:
+        await file_.write(json.dumps({'length': length, 'filename': filename}))
+
+    response = Response('', status=201)
+    response.headers['Location'] = url_for(
+        '_uploads_resumable.upload', setname=setname, upload_id=upload_id
+    )
+    return response
+
+
+@resumable_mod.route('/<setname>/<upload_id>', methods=['HEAD'])
+async def upload_offset(setname: str, upload_id: str) -> Response:
+    """
+    Returns how many bytes of the upload have arrived in the
+    `Upload-Offset` header, so the client can resume from there.
+    """
+    _, config, folder = _lookup(setname)
+    part_path, info_path = _paths(folder, upload_id)
+    info = await _load(info_path, config.executor)
+
+    response = Response('', status=200)
+    response.headers['Upload-Offset'] = str(
+        await _offset(part_path, config.executor)
+    )
+    response.headers['Upload-Length'] = str(info['length'])
+    return response
+
+
+@resumable_mod.route('/<setname>/<upload_id>', methods=['PATCH'])
+async def upload(setname: str, upload_id: str) -> Response:
+    """
+    Appends the request body to the upload. The `Upload-Offset` header must
+    match the number of bytes already received. When the last byte
+    arrives, the file is saved into the upload set and its saved name is
+    returned in the `Upload-Name` header.
+    """
+    uset, config, folder = _lookup(setname)
+    executor = config.executor
+    part_path, info_path = _paths(folder, upload_id)
+
+    if request.mimetype != 'application/offset+octet-stream':
+        abort(415)
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        abort(400)
+
+    info = await _load(info_path, executor)
+    length = info['length']
+    async with _locked(part_path, upload_id, executor) as file_:
+        # Checked under the lock, so no other request has moved it on.
+        if offset != await file_.seek(0, os.SEEK_END):
+            abort(409)
+        async for data in request.body:
+            if offset + len(data) > length:
+                await file_.truncate(offset)
+                abort(400)
+            await file_.write(data)
+            offset += len(data)
+        await file_.flush()
+
+        response = Response('', status=204)
+        response.headers['Upload-Offset'] = str(offset)
+        if offset == length:
+            response.headers['Upload-Name'] = await _finish(
+                uset, part_path, info_path, info['filename'], executor
+            )
+        return response
+
+
+def _open_binary(path: str) -> IO[bytes]:
+    return open(path, 'rb')
+
+
+async def _finish(
+    uset: UploadSet,
+    part_path: str,
+    info_path: str,
+    filename: str,
+    executor: Optional[Executor] = None
+) -> str:
+    """
+    Saves a complete upload into the set and removes its partial state.
+    """
+    try:
+        stream = await run_blocking(executor, _open_binary, part_path)
+        with stream:
+            return await uset.save(FileStorage(stream, filename=filename))
+    except UploadTooLarge:
+        abort(413)
+    except UploadNotAllowed:
+        abort(403)
+    finally:
+        await _discard(part_path, info_path, executor)
+
+
+@resumable_mod.route('/<setname>/<upload_id>', methods=['DELETE'])
+async def delete_upload(setname: str, upload_id: str) -> Response:
+    """
+    Abandons an upload and removes what has been received.
+    """
+    _, config, folder = _lookup(setname)
+    part_path, info_path = _paths(folder, upload_id)
+    await _load(info_path, config.executor)
+    async with _locked(part_path, upload_id, config.executor):
+        await _discard(part_path, info_path, config.executor)
+    return Response('', status=204)
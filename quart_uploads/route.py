@@ -2,27 +2,177 @@
 quart_uploads.route
 
 Provides the quart route for the extension. The route is used to serve files.
+The blueprint also serves the upload metrics when `UPLOADS_METRICS` is on.
 """
 from __future__ import annotations
-from typing import TYPE_CHECKING
+import os
+import time
+from typing import Optional, TYPE_CHECKING
 
-from quart import abort, Blueprint, current_app, Response, send_from_directory
+from quart import abort, Blueprint, current_app, jsonify, request, Response
+from werkzeug.exceptions import HTTPException
+from werkzeug.security import safe_join
+
+from .metrics import CONTENT_TYPE
+from .serve import Offload, offloader, send_from_backend, send_upload
+from .signals import file_served, send
+from .utils import shard_path
 
 if TYPE_CHECKING:
-    from .config import Uploads
+    from .config import UploadConfig, Uploads
+
+#: The most files the listing endpoint returns in one response.
+MAX_LISTING_LIMIT = 1000
 
 
 uploads_mod = Blueprint('_uploads', __name__, url_prefix='/_uploads')
 
 
-@uploads_mod.route('/<setname>/<filename>')
+@uploads_mod.route('/<setname>/<path:filename>')
 async def uploaded_file(setname: str, filename: str) -> Response:
     """
     Extension route for serving files to the
-    frontend.
+    frontend. The filename may include the folder it was saved in. A
+    ``variant`` query argument serves that variant of an image, rendering
+    it on the first request. If the set's `UPLOADED_X_SENDFILE` setting is
+    on, the bytes are left to the front server.
     """
     uploads: Uploads = current_app.extensions['uploads']
     config = uploads.get(setname)
-    if config is None:
+    # The set's hidden bookkeeping files and folders aren't served.
+    if config is None or _hidden(filename):
+        abort(404)
+
+    start = time.perf_counter()
+    status, size = 500, None
+    stored = shard_path(filename, config.shard_depth)
+    variant = request.args.get('variant')
+    try:
+        if variant is not None:
+            response = await _send_variant(
+                uploads, setname, filename, variant
+            )
+        elif config.backend is not None:
+            response = await send_from_backend(
+                config.backend, stored, config.max_age
+            )
+        else:
+            response = await send_upload(
+                config.destination,
+                stored,
+                config.max_age,
+                config.etag,
+                config.executor,
+                config.compress,
+                _offload(config)
+            )
+        status, size = response.status_code, response.content_length
+        return response
+    except HTTPException as error:
+        status = error.code
+        raise
+    finally:
+        uset = uploads.sets.get(setname)
+        if uset is not None:
+            await send(
+                file_served,
+                uset,
+                filename=filename,
+                status=status,
+                size=size,
+                duration=time.perf_counter() - start
+            )
+
+
+async def _send_variant(
+    uploads: Uploads, setname: str, filename: str, variant: str
+) -> Response:
+    uset = uploads.sets.get(setname)
+    config = uploads[setname]
+    if uset is None or variant not in uset.variants or \
+            config.backend is not None:
+        abort(404)
+    try:
+        path = await uset.variant(filename, variant)
+    except OSError:
+        # The original is missing, or isn't an image Pillow can read.
+        abort(404)
+    return await send_upload(
+        os.path.dirname(path),
+        os.path.basename(path),
+        config.max_age,
+        config.etag,
+        config.executor,
+        offload=_offload(config)
+    )
+
+
+def _hidden(path: str) -> bool:
+    # Uploaded names never start with a dot, unlike the set's own files.
+    return any(part.startswith('.') for part in path.split('/'))
+
+
+def _offload(config: UploadConfig) -> Optional[Offload]:
+    if config.sendfile is None:
+        return None
+    return offloader(
+        config.sendfile, config.destination, config.sendfile_prefix
+    )
+
+
+@uploads_mod.route('/<setname>/')
+async def list_files(setname: str) -> Response:
+    """
+    Returns a page of the set's files as JSON, if the set's
+    `UPLOADED_X_LISTING` setting is on. The ``folder``, ``prefix`` and
+    ``cursor`` query arguments are passed to `UploadSet.iter_files`, and
+    ``limit`` is the size of the page. The response's ``cursor`` continues
+    the listing, and is `None` after the last page.
+    """
+    uploads: Uploads = current_app.extensions['uploads']
+    config = uploads.get(setname)
+    uset = uploads.sets.get(setname)
+    if config is None or uset is None or not config.listing or \
+            config.backend is not None:
+        abort(404)
+
+    folder = request.args.get('folder') or None
+    # Only the set's own, visible subfolders can be listed.
+    if folder is not None and (
+        safe_join(config.destination, folder) is None or _hidden(folder)
+    ):
+        abort(404)
+    limit = request.args.get('limit', 100, type=int)
+    limit = max(1, min(limit, MAX_LISTING_LIMIT))
+
+    files = []
+    async for stored in uset.iter_files(
+        folder,
+        request.args.get('prefix') or None,
+        page_size=limit,
+        cursor=request.args.get('cursor') or None
+    ):
+        files.append({
+            'name': stored.name,
+            'size': stored.size,
+            'mtime': stored.mtime,
+            'url': uset.url(stored.name)
+        })
+        if len(files) == limit:
+            break
+    return jsonify(
+        files=files,
+        cursor=files[-1]['name'] if len(files) == limit else None
+    )
+
+
+@uploads_mod.route('/metrics')
+async def metrics() -> Response:
+    """
+    Returns the upload metrics in the Prometheus text format, if the
+    `UPLOADS_METRICS` setting is on.
+    """
+    uploads: Uploads = current_app.extensions['uploads']
+    if uploads.metrics is None:
         abort(404)
-    return await send_from_directory(config.destination, filename)
+    return Response(uploads.metrics.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,476 @@
+"""
+quart_uploads.serve
+
+Provides the helpers the uploads route uses to serve files, with strong
+ETags, conditional requests, byte ranges and precompressed copies, or by
+handing the transfer to a front server with `X-Accel-Redirect` or
+`X-Sendfile`.
+"""
+from __future__ import annotations
+import mimetypes
+import os
+import uuid
+from concurrent.futures import Executor
+from stat import S_ISREG
+from datetime import datetime, timezone
+from typing import (
+    AsyncIterator, Callable, List, Optional, Sequence, Tuple, TYPE_CHECKING
+)
+from urllib.parse import quote
+
+import aiofiles
+import aiofiles.os
+from quart import abort, request, Response
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.security import safe_join
+
+from .compress import (
+    MIN_SIZE, compressed_path, compressible, ensure_compressed
+)
+from .executor import run_blocking
+from .utils import get_stored_digest
+
+if TYPE_CHECKING:
+    from .backends import StorageBackend
+
+#: Build ETags from the file's size and modification time.
+ETAG_STAT = 'stat'
+#: Build ETags from the SHA-256 digest stored when the file was saved.
+ETAG_HASH = 'hash'
+
+ETAG_MODES = (ETAG_STAT, ETAG_HASH)
+
+#: Hand files to nginx, which serves them from an internal location.
+SENDFILE_ACCEL = 'x-accel-redirect'
+#: Hand files to Apache's mod_xsendfile or lighttpd by their path.
+SENDFILE_PATH = 'x-sendfile'
+
+#: The response header for each way of handing files to the front server.
+SENDFILE_HEADERS = {
+    SENDFILE_ACCEL: 'X-Accel-Redirect',
+    SENDFILE_PATH: 'X-Sendfile',
+}
+
+#: Returns the header, and its value, that hand the file at a path to the
+#: front server.
+Offload = Callable[[str], Tuple[str, str]]
+
+#: Requests for more ranges than this, after merging, get the whole file.
+MAX_RANGES = 16
+
+DEFAULT_MIMETYPE = 'application/octet-stream'
+
+ByteRange = Tuple[int, int]
+
+
+def make_etag(size: int, mtime_ns: int, digest: Optional[str] = None) -> str:
+    """
+    Returns a strong ETag for a file, without the quotes. It is the content
+    digest if one is given, or else is built from the size and the
+    modification time in nanoseconds.
+
+    Arguments:
+        size: The size of the file in bytes.
+        mtime_ns: The modification time of the file in nanoseconds.
+        digest: The hex digest of the file's content.
+    """
+    if digest is not None:
+        return digest
+    return f'{size:x}-{mtime_ns:x}'
+
+
+def file_version(path: str, etag_mode: str = ETAG_STAT) -> Optional[str]:
+    """
+    Returns a short fingerprint of a file for cache-busting URLs, which
+    changes whenever its ETag does, or `None` if the file doesn't exist.
+
+    Arguments:
+        path: The path of the file.
+        etag_mode: How the set builds ETags, one of `ETAG_MODES`.
+    """
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    digest = get_stored_digest(path) if etag_mode == ETAG_HASH else None
+    if digest is not None:
+        return digest[:16]
+    return make_etag(stat.st_size, stat.st_mtime_ns)
+
+
+def not_modified(etag: str, last_modified: datetime) -> bool:
+    """
+    Returns whether the current request's `If-None-Match` or, if that
+    isn't given, `If-Modified-Since` header shows the client already has
+    this version of the file.
+
+    Arguments:
+        etag: The file's ETag.
+        last_modified: The file's modification time.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since is not None:
+        since = request.if_modified_since
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def parse_ranges(value: str) -> Optional[List[Tuple[int, Optional[int]]]]:
+    """
+    Parses a `Range` header into ``(begin, end)`` pairs, where `end` is
+    exclusive and `None` means the end of the file, and a suffix range
+    has a negative `begin`. Unlike `werkzeug.http.parse_range_header`,
+    overlapping and unordered ranges are accepted, so they can be merged.
+    Returns `None` if the header is malformed or not in bytes.
+
+    Arguments:
+        value: The value of the header, i.e. ``bytes=0-99,200-``.
+    """
+    units, _, spec = value.partition('=')
+    if units.strip().lower() != 'bytes':
+        return None
+
+    ranges: List[Tuple[int, Optional[int]]] = []
+    for item in spec.split(','):
+        first, sep, last = item.strip().partition('-')
+        if not sep:
+            return None
+        if first == '':
+            if not last.isdigit() or int(last) == 0:
+                return None
+            ranges.append((-int(last), None))
+        elif not first.isdigit() or (last and not last.isdigit()):
+            return None
+        elif last and int(last) < int(first):
+            return None
+        else:
+            ranges.append((int(first), int(last) + 1 if last else None))
+    return ranges or None
+
+
+def requested_ranges(
+    size: int, etag: str, last_modified: datetime
+) -> Optional[List[ByteRange]]:
+    """
+    Returns the byte ranges of the file the current request asks for, as
+    sorted, merged ``(begin, end)`` pairs, or `None` if the whole file
+    should be sent. A `Range` header that doesn't match the file raises
+    `RequestedRangeNotSatisfiable`.
+
+    Arguments:
+        size: The size of the file in bytes.
+        etag: The file's ETag.
+        last_modified: The file's modification time.
+    """
+    if 'Range' not in request.headers or size == 0:
+        return None
+
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and (
+        last_modified.replace(microsecond=0) != if_range.date
+    ):
+        return None
+
+    specs = parse_ranges(request.headers['Range'])
+    if specs is None:
+        # A malformed or unknown range is ignored, as RFC 9110 allows.
+        return None
+
+    ranges: List[ByteRange] = []
+    for begin, end in specs:
+        if begin < 0:
+            begin, end = max(size + begin, 0), size
+        elif end is None or end > size:
+            end = size
+        if begin < end:
+            ranges.append((begin, end))
+
+    if not ranges:
+        raise RequestedRangeNotSatisfiable(length=size)
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for begin, end in ranges[1:]:
+        if begin <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((begin, end))
+
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+async def read_range(
+    path: str,
+    begin: int,
+    end: int,
+    buffer_size: int = 65536,
+    executor: Optional[Executor] = None
+) -> AsyncIterator[bytes]:
+    """
+    Yields the bytes of the file from `begin` up to `end` in chunks.
+
+    Arguments:
+        path: The path of the file.
+        begin: The offset of the first byte.
+        end: The offset after the last byte.
+        buffer_size: The size of each chunk.
+        executor: The executor to read the file in.
+    """
+    async with aiofiles.open(path, 'rb', executor=executor) as file_:
+        await file_.seek(begin)
+        remaining = end - begin
+        while remaining > 0:
+            data = await file_.read(min(buffer_size, remaining))
+            if data == b"":
+                break
+            remaining -= len(data)
+            yield data
+
+
+async def read_multipart(
+    path: str,
+    ranges: List[ByteRange],
+    size: int,
+    mimetype: str,
+    boundary: str,
+    executor: Optional[Executor] = None
+) -> AsyncIterator[bytes]:
+    """
+    Yields a ``multipart/byteranges`` body with a part for each range.
+    """
+    for begin, end in ranges:
+        yield _part_header(begin, end, size, mimetype, boundary)
+        async for data in read_range(path, begin, end, executor=executor):
+            yield data
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+def _part_header(
+    begin: int, end: int, size: int, mimetype: str, boundary: str
+) -> bytes:
+    return (
+        f'\r\n--{boundary}\r\n'
+        f'Content-Type: {mimetype}\r\n'
+        f'Content-Range: bytes {begin}-{end - 1}/{size}\r\n\r\n'
+    ).encode()
+
+
+def _cache_headers(
+    response: Response,
+    etag: str,
+    last_modified: datetime,
+    max_age: Optional[int]
+) -> None:
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    if max_age is not None:
+        response.cache_control.max_age = max_age
+
+
+def _not_modified(
+    etag: str, last_modified: datetime, max_age: Optional[int]
+) -> Response:
+    response = Response(b"", status=304)
+    del response.content_length
+    _cache_headers(response, etag, last_modified, max_age)
+    return response
+
+
+def negotiate_encoding(encodings: Sequence[str]) -> Optional[str]:
+    """
+    Returns the encoding the current request's `Accept-Encoding` header
+    prefers out of the given encodings, or `None` if the file should be
+    sent as it is. Ties go to the earlier encoding.
+
+    Arguments:
+        encodings: The encodings available, in order of preference.
+    """
+    best = request.accept_encodings.best_match(
+        [*encodings, 'identity']
+    )
+    return None if best == 'identity' else best
+
+
+def offloader(mode: str, root: str, prefix: str) -> Offload:
+    """
+    Returns the `Offload` for files under the root folder. The header's
+    value is the file's path relative to the root, appended to the prefix,
+    which is the internal location for `SENDFILE_ACCEL` and the root's
+    path as the front server sees it for `SENDFILE_PATH`.
+
+    Arguments:
+        mode: One of the `SENDFILE_HEADERS`.
+        root: The folder the served files are in, i.e. the set's
+              destination.
+        prefix: The prefix the relative paths are appended to, ending
+                with a slash.
+    """
+    header = SENDFILE_HEADERS[mode]
+
+    def offload(path: str) -> Tuple[str, str]:
+        relative = os.path.relpath(path, root).replace(os.sep, '/')
+        location = prefix + relative
+        if mode == SENDFILE_ACCEL:
+            # nginx decodes the URI before matching the location.
+            location = quote(location)
+        return header, location
+
+    return offload
+
+
+async def send_upload(
+    directory: str,
+    filename: str,
+    max_age: Optional[int] = None,
+    etag_mode: str = ETAG_STAT,
+    executor: Optional[Executor] = None,
+    encodings: Sequence[str] = (),
+    offload: Optional[Offload] = None
+) -> Response:
+    """
+    Sends a file from the directory. The response has a strong ETag and
+    answers `If-None-Match` and `If-Modified-Since` with a 304 before the
+    file is opened. Single and multiple byte ranges are supported, the
+    latter as a ``multipart/byteranges`` response.
+
+    If encodings are given and the file is worth compressing, the
+    encoding the client prefers is negotiated from `Accept-Encoding`, and
+    the file's precompressed copy is sent, after making it if it is
+    missing or out of date. Ranges then apply to the compressed bytes.
+
+    If `offload` is given, the response has no body, and the header it
+    returns for the file, or its compressed copy, tells the front server
+    to send the bytes and answer ranges itself. The lookup and the
+    conditional requests are still handled here.
+
+    Arguments:
+        directory: The directory the file is in.
+        filename: The name of the file in the directory.
+        max_age: The `Cache-Control` max-age, in seconds.
+        etag_mode: How the ETag is built, one of `ETAG_MODES`.
+        executor: The executor to run the file operations in, or `None`
+                  for the event loop's default executor.
+        encodings: The encodings the file can be sent in, in order of
+                   preference.
+        offload: Hands the file to the front server, see `offloader`.
+    """
+    path = safe_join(os.fspath(directory), filename)
+    if path is None:
+        abort(404)
+    try:
+        stat = await aiofiles.os.stat(path, executor=executor)
+    except (FileNotFoundError, NotADirectoryError):
+        abort(404)
+    if not S_ISREG(stat.st_mode):
+        abort(404)
+
+    digest = None
+    if etag_mode == ETAG_HASH:
+        digest = await run_blocking(executor, get_stored_digest, path)
+    etag = make_etag(stat.st_size, stat.st_mtime_ns, digest)
+    last_modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+    mimetype = mimetypes.guess_type(filename)[0] or DEFAULT_MIMETYPE
+
+    negotiated = (
+        bool(encodings) and stat.st_size >= MIN_SIZE and
+        compressible(filename)
+    )
+    encoding = negotiate_encoding(encodings) if negotiated else None
+    if encoding is not None:
+        # Each encoding is a separate representation, with its own ETag.
+        etag = f'{etag}-{encoding}'
+
+    if not_modified(etag, last_modified):
+        response = _not_modified(etag, last_modified, max_age)
+        if negotiated:
+            response.vary.add('Accept-Encoding')
+        return response
+
+    if encoding is not None:
+        stat = await ensure_compressed(path, encoding, stat, executor)
+        path = compressed_path(path, encoding)
+
+    size = stat.st_size
+    ranges = None
+    if offload is None:
+        ranges = requested_ranges(size, etag, last_modified)
+
+    if offload is not None:
+        header, location = offload(path)
+        response = Response(b"", mimetype=mimetype)
+        del response.content_length
+        response.headers[header] = location
+    elif ranges is None:
+        response = Response(
+            read_range(path, 0, size, executor=executor), mimetype=mimetype
+        )
+        response.content_length = size
+    elif len(ranges) == 1:
+        begin, end = ranges[0]
+        response = Response(
+            read_range(path, begin, end, executor=executor),
+            status=206,
+            mimetype=mimetype
+        )
+        response.content_length = end - begin
+        response.headers['Content-Range'] = f'bytes {begin}-{end - 1}/{size}'
+    else:
+        boundary = uuid.uuid4().hex
+        response = Response(
+            read_multipart(
+                path, ranges, size, mimetype, boundary, executor
+            ),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}'
+        )
+        response.content_length = sum(
+            len(_part_header(begin, end, size, mimetype, boundary)) +
+            end - begin
+            for begin, end in ranges
+        ) + len(f'\r\n--{boundary}--\r\n')
+
+    response.headers['Accept-Ranges'] = 'bytes'
+    if encoding is not None:
+        response.content_encoding = encoding
+    if negotiated:
+        response.vary.add('Accept-Encoding')
+    _cache_headers(response, etag, last_modified, max_age)
+    return response
+
+
+async def send_from_backend(
+    backend: StorageBackend, key: str, max_age: Optional[int] = None
+) -> Response:
+    """
+    Streams a file from a storage backend, or aborts with a 404 if the
+    backend doesn't have it. Conditional requests are answered with a 304
+    from the file's metadata, but byte ranges aren't supported.
+
+    Arguments:
+        backend: The backend to read the file from.
+        key: The key of the file.
+        max_age: The `Cache-Control` max-age, in seconds.
+    """
+    try:
+        stat = await backend.stat(key)
+    except FileNotFoundError:
+        abort(404)
+
+    etag = make_etag(stat.size, int(stat.mtime * 1e9))
+    last_modified = datetime.fromtimestamp(stat.mtime, timezone.utc)
+
+    if not_modified(etag, last_modified):
+        return _not_modified(etag, last_modified, max_age)
+
+    mimetype = mimetypes.guess_type(key)[0] or DEFAULT_MIMETYPE
+    response = Response(backend.open(key), mimetype=mimetype)
+    response.content_length = stat.size
+    response.headers['Accept-Ranges'] = 'none'
+    _cache_headers(response, etag, last_modified, max_age)
+    return response
@@ -4,30 +4,120 @@ quart_uploads.set
 Defines the upload set class.
 """
 from __future__ import annotations
+import asyncio
+import contextlib
 import os
 import posixpath
+import time
+import weakref
+from urllib.parse import quote
 
 from typing import (
+    Any,
+    AsyncIterator,
     Callable,
+    Container,
+    Dict,
+    IO,
+    Iterable,
+    List,
     LiteralString,
     Optional,
+    Set,
     Tuple,
     Union,
     TYPE_CHECKING
 )
 
 import aiofiles.os
-from quart import Quart, current_app, url_for
+from quart import (
+    Quart,
+    has_request_context,
+    has_websocket_context,
+    request,
+    url_for,
+    websocket
+)
 from quart.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 
-from .exceptions import UploadNotAllowed
-from .file_ext import FILE_EXTENSIONS as FE, All
-from .utils import extension, lowercase_ext
+from .backends import LocalBackend, StorageBackend
+from .compress import (
+    ENCODINGS,
+    MIN_SIZE as COMPRESS_MIN_SIZE,
+    compressed_path,
+    compressible,
+    ensure_compressed
+)
+from .conflict import ConflictIndex
+from .dedup import BLOB_FOLDER, BlobStore
+from .exceptions import (
+    QuotaExceeded,
+    UploadNotAllowed,
+    UploadTooLarge,
+    UploadTypeMismatch
+)
+from .executor import run_blocking
+from .expiry import (
+    EXPIRY_FILE, TTL, ExpiryScheduler, append_journal, ttl_seconds
+)
+from .file_ext import FILE_EXTENSIONS as FE, All, ExtensionMatcher
+from .images import ImageVariant, VariantCache, variant_name
+from .listing import StoredFile, list_page
+from .result import UploadResult
+from .serve import ETAG_HASH, file_version, make_etag
+from .signals import (
+    conflict_resolved,
+    send,
+    upload_deleted,
+    upload_rejected,
+    upload_saved,
+    upload_started
+)
+from .sniff import Sniffer
+from .usage import Reservation, Usage, UsageTracker
+from .utils import (
+    create_exclusive,
+    current_app_object,
+    extension,
+    lowercase_ext,
+    set_stored_digest,
+    shard_path
+)
+from .zerocopy import move_stream
+from .writer import (
+    GroupCommit,
+    HashingReader,
+    new_hashers,
+    stream_size,
+    write_atomic,
+    write_stream
+)
 
 if TYPE_CHECKING:
     from .config import Uploads, UploadConfig
 
+#: The characters left unquoted in URL paths, as by Werkzeug's converters.
+URL_SAFE = "!$&'()*+,/:;=@"
+
+#: Stands in for the filename when the URL template of a set is built.
+URL_MARKER = 'quartuploadsfilename'
+
+#: The most URL templates a set keeps per app, one per request host and
+#: variant, before they are dropped.
+MAX_URL_TEMPLATES = 64
+
+
+def _size_hint(storage: FileStorage) -> Optional[int]:
+    """
+    Returns the size of the storage if it can be found before reading it.
+    A missing Content-Length reads as 0, so that means unknown.
+    """
+    size = stream_size(storage.stream)
+    if size is None:
+        size = storage.content_length or None
+    return size
+
 
 class UploadSet:
     """
@@ -49,13 +139,18 @@ class UploadSet:
         default_dest: If given, this should be a callable. If you call it
                       with the app, it should return the default upload
                       destination path for that app.
+        variants: Named `ImageVariant` sizes and formats of the set's
+                  images, such as thumbnails, which are rendered the first
+                  time they are requested. This is meant for sets of
+                  `IMAGES`, and needs Pillow.
     """
 
     def __init__(
         self,
         name: str = 'files',
         extensions: Union[Tuple[str], Tuple[LiteralString], All] = FE.Defaults,
-        default_dest: Optional[Union[str, Callable[[Quart], str]]] = None
+        default_dest: Optional[Union[str, Callable[[Quart], str]]] = None,
+        variants: Optional[Dict[str, ImageVariant]] = None
     ) -> None:
         if not name.isalnum():
             raise ValueError("Name must be alphanumeric (no underscores)")
@@ -63,8 +158,26 @@ class UploadSet:
         self.name = name
         self.extensions = extensions
         self.default_dest = default_dest
+        self.variants = dict(variants or {})
 
         self._config: UploadConfig | None = None
+        self._configs: weakref.WeakKeyDictionary[Quart, UploadConfig] = (
+            weakref.WeakKeyDictionary()
+        )
+        self._matchers: Dict[int, Tuple[Any, Any, ExtensionMatcher]] = {}
+        self._conflicts = ConflictIndex()
+        # For sets whose files can't be found with a cheap folder scan.
+        self._unscanned_conflicts = ConflictIndex(scan=None)
+        self._group_commit = GroupCommit()
+        self._variant_cache = VariantCache()
+        self._usage: Dict[str, UsageTracker] = {}
+        self._expiry: Dict[str, ExpiryScheduler] = {}
+        self._url_templates: weakref.WeakKeyDictionary[
+            Quart, Dict[Tuple[Optional[str], Optional[str]], Tuple[str, str]]
+        ] = weakref.WeakKeyDictionary()
+        self._write_limits: Dict[
+            int, Tuple[UploadConfig, asyncio.Semaphore]
+        ] = {}
 
     @property
     def config(self) -> UploadConfig:
@@ -75,32 +188,244 @@ class UploadSet:
         otherwise outside of a request context, set the `_config` attribute to
         an `UploadConfiguration` instance, then set it back to `None` when
         you're done.
+
+        The configuration is cached per application, keyed weakly so apps
+        that are gone are dropped, and `configure_uploads` refreshes the
+        cache when it reconfigures the set. A set shared by several apps
+        therefore always uses the configuration of the current app.
         """
-        if self._config is None:
-            uploads: Uploads = current_app.extensions['uploads']
-            self._config = uploads.get(self.name)
+        if self._config is not None:
+            return self._config
 
-        return self._config
+        app = current_app_object()
+        config = self._configs.get(app)
+        if config is None:
+            uploads: Uploads = app.extensions['uploads']
+            config = uploads.get(self.name)
+            if config is not None:
+                self._configs[app] = config
+        return config
 
-    def url(self, filename: str) -> str:
+    def _configure(self, app: Quart, config: UploadConfig) -> None:
+        """
+        Caches the configuration for the app. This is called by
+        `configure_uploads` whenever it configures the set.
+
+        Arguments:
+            app: The app the configuration is for.
+            config: The set's configuration for the app.
+        """
+        self._configs[app] = config
+
+    @property
+    def matcher(self) -> ExtensionMatcher:
+        """
+        The `ExtensionMatcher` for this set's extensions and the current
+        configuration's allow and deny lists. It is compiled once for each
+        configuration, and again only if the extensions change.
+        """
+        config = self.config
+        cached = self._matchers.get(id(config))
+        if (cached is None or cached[0] is not config or
+                cached[1] is not self.extensions):
+            if len(self._matchers) >= 64:
+                self._matchers.clear()
+            matcher = ExtensionMatcher(
+                self.extensions, config.allow, config.deny
+            )
+            # The config is kept with its matcher, so its id isn't reused.
+            cached = self._matchers[id(config)] = (
+                config, self.extensions, matcher
+            )
+        return cached[2]
+
+    @property
+    def backend(self) -> StorageBackend:
+        """
+        The storage backend files in this set are kept in. This is the
+        backend given with the `UPLOADED_X_BACKEND` setting, or else a
+        `LocalBackend` for the set's destination.
+        """
+        if self.config.backend is not None:
+            return self.config.backend
+        return LocalBackend(self.config.destination, self.config.executor)
+
+    @property
+    def blobs(self) -> BlobStore:
+        """
+        The content-addressed store that files are kept in when the set's
+        `deduplicate` setting is on. It lives in a hidden folder in the
+        set's destination.
+        """
+        return BlobStore(
+            os.path.join(self.config.destination, BLOB_FOLDER),
+            self.config.executor
+        )
+
+    def url(self, filename: str, variant: Optional[str] = None) -> str:
         """
         This function gets the URL a file uploaded to this set would be
         accessed at. It doesn't check whether said file exists.
 
+        If a variant is given, the URL is for that variant of the image,
+        which Quart-Uploads renders when it is first requested. If the set
+        has a `base_url`, the files are served elsewhere, so the variant
+        must have been rendered already with `variant`.
+
         Arguments:
             filename: The filename to return the URL for.
+            variant: The name of one of the set's `variants`.
         """
-        base = self.config.base_url
-        if base is None:
-            return url_for('_uploads.uploaded_file', setname=self.name,
-                           filename=filename, _external=True)
+        return self.urls((filename,), variant)[0]
+
+    def urls(
+        self, filenames: Iterable[str], variant: Optional[str] = None
+    ) -> List[str]:
+        """
+        This gets the URLs of several files at once, as `url` would, such
+        as for a gallery page. If Quart-Uploads serves the set, the URL up
+        to the filename is built with `url_for` once per request host and
+        cached, and each file's URL is then a string join.
+
+        Arguments:
+            filenames: The filenames to return the URLs for.
+            variant: The name of one of the set's `variants`.
+        """
+        spec = None if variant is None else self._variant_spec(variant)
+        config = self.config
+        if config.base_url is None:
+            prefix, suffix = self._url_template(variant)
+            return [
+                prefix + quote(filename, safe=URL_SAFE) + suffix
+                for filename in filenames
+            ]
+
+        urls = []
+        for filename in filenames:
+            stored = shard_path(filename, config.shard_depth)
+            if variant is not None:
+                stored = variant_name(stored, variant, spec)
+            urls.append(config.base_url + quote(stored, safe=URL_SAFE))
+        return urls
+
+    async def versioned_urls(
+        self,
+        filenames: Iterable[str],
+        variant: Optional[str] = None,
+        param: str = 'v'
+    ) -> List[str]:
+        """
+        This gets the URLs of several files like `urls`, with a query
+        argument that changes whenever a file does, so they can be cached
+        for a long time by browsers and CDNs. The version is the file's
+        stored SHA-256 digest if the set's `etag` setting is ``hash``, or
+        else is built from its size and modification time. The files are
+        looked up in one job in the set's executor, and a file that
+        doesn't exist gets no version.
+
+        Arguments:
+            filenames: The filenames to return the URLs for.
+            variant: The name of one of the set's `variants`. The version
+                     is that of the original image.
+            param: The name of the query argument.
+        """
+        filenames = list(filenames)
+        urls = self.urls(filenames, variant)
+        config = self.config
+        if config.backend is None:
+            versions = await run_blocking(
+                config.executor,
+                lambda: [
+                    file_version(self.path(filename), config.etag)
+                    for filename in filenames
+                ]
+            )
         else:
-            return base + filename
+            versions = await asyncio.gather(*(
+                self._backend_version(filename) for filename in filenames
+            ))
+        return [
+            url if version is None else
+            f"{url}{'&' if '?' in url else '?'}{param}={quote(version)}"
+            for url, version in zip(urls, versions)
+        ]
+
+    async def _backend_version(self, filename: str) -> Optional[str]:
+        key = shard_path(filename, self.config.shard_depth)
+        try:
+            stat = await self.backend.stat(key)
+        except FileNotFoundError:
+            return None
+        return make_etag(stat.size, int(stat.mtime * 1e9))
+
+    def _url_template(self, variant: Optional[str]) -> Tuple[str, str]:
+        """
+        Returns the parts of the set's URLs before and after the filename,
+        for the current app and request host.
+        """
+        app = current_app_object()
+        templates = self._url_templates.get(app)
+        if templates is None:
+            templates = self._url_templates[app] = {}
+        host = None
+        if has_request_context():
+            host = request.host_url
+        elif has_websocket_context():
+            host = websocket.host_url
+        template = templates.get((host, variant))
+        if template is None:
+            if len(templates) >= MAX_URL_TEMPLATES:
+                templates.clear()
+            extra = {} if variant is None else {'variant': variant}
+            url = url_for('_uploads.uploaded_file', setname=self.name,
+                          filename=URL_MARKER, _external=True, **extra)
+            prefix, _, suffix = url.partition(URL_MARKER)
+            template = templates[(host, variant)] = (prefix, suffix)
+        return template
+
+    def _variant_spec(self, variant: str) -> ImageVariant:
+        try:
+            return self.variants[variant]
+        except KeyError:
+            raise ValueError(
+                f"set {self.name} has no variant {variant!r}"
+            ) from None
+
+    async def variant(self, filename: str, variant: str) -> str:
+        """
+        This returns the absolute path of a variant of an image in this
+        set, rendering it first unless an up to date copy is cached. The
+        rendering runs in the set's `image_executor`, or a shared process
+        pool, and concurrent calls for the same variant share one render.
+        It raises `FileNotFoundError` if the original doesn't exist.
+
+        Arguments:
+            filename: The filename of the original image.
+            variant: The name of one of the set's `variants`.
+        """
+        spec = self._variant_spec(variant)
+        if self.config.backend is not None:
+            raise RuntimeError("image variants need a local destination")
+        stored = variant_name(
+            shard_path(filename, self.config.shard_depth), variant, spec
+        )
+        target = os.path.join(self.config.destination, *stored.split('/'))
+        await self._variant_cache.ensure(
+            self.path(filename),
+            target,
+            spec,
+            self.config.image_executor,
+            self.config.executor
+        )
+        return target
 
     def path(self, filename: str, folder: Optional[str] = None) -> str:
         """
         This returns the absolute path of a file uploaded to this set. It
-        doesn't actually check whether said file exists.
+        doesn't actually check whether said file exists. For a set using a
+        storage backend other than the local filesystem, this is the path
+        under the set's destination, which the backend doesn't use. If the
+        set is sharded, the path includes the shard folders.
 
         Arguments:
             filename: The filename to return the path for.
@@ -112,32 +437,357 @@ class UploadSet:
             target_folder = os.path.join(self.config.destination, folder)
         else:
             target_folder = self.config.destination
-        return os.path.join(target_folder, filename)
+        sharded = shard_path(filename, self.config.shard_depth)
+        return os.path.join(target_folder, *sharded.split('/'))
+
+    async def iter_files(
+        self,
+        folder: Optional[str] = None,
+        prefix: Optional[str] = None,
+        page_size: int = 1000,
+        cursor: Optional[str] = None
+    ) -> AsyncIterator[StoredFile]:
+        """
+        This lists the files in the set, or in one of its subfolders, as
+        `StoredFile` entries with their name, size and modification time.
+        The folder is read in pages of `page_size` files, each with one
+        `os.scandir` pass in the set's executor, so a large folder neither
+        blocks the event loop nor is loaded into memory at once.
+
+        Files are listed by name, or in a sharded set by shard folder and
+        then name, so the name of the last file seen can be passed as the
+        `cursor` of a later call to carry on after it. Subfolders and the
+        set's hidden bookkeeping files aren't listed.
+
+        Arguments:
+            folder: The subfolder within the upload set to list.
+            prefix: Only list files whose names start with this.
+            page_size: The number of files read from the folder at a time.
+            cursor: The name of the file to carry on after.
+        """
+        if page_size < 1:
+            raise ValueError("Page size must be at least 1")
+        if self.config.backend is not None:
+            raise RuntimeError("listing files needs a local destination")
+
+        root = self._target_folder(folder)
+        depth = self.config.shard_depth
+        after = None
+        if cursor is not None:
+            after = shard_path(posixpath.basename(cursor), depth)
+        while True:
+            page = await run_blocking(
+                self.config.executor,
+                list_page,
+                root,
+                depth,
+                page_size,
+                after,
+                prefix
+            )
+            for relative, size, mtime in page:
+                basename = posixpath.basename(relative)
+                yield StoredFile(
+                    posixpath.join(folder, basename) if folder else basename,
+                    size,
+                    mtime
+                )
+            if len(page) < page_size:
+                return
+            after = page[-1][0]
 
     def file_allowed(self, basename: str) -> bool:
         """
         This tells whether a file is allowed. It should return `True` if the
         given `werkzeug.FileStorage` object can be saved with the given
         basename, and `False` if it can't. The default implementation just
-        checks the extension, so you can override this if you want.
+        checks the extension, so you can override this if you want. A
+        multi-part extension, such as ``tar.gz``, is checked instead of the
+        last part if the set or its configuration mentions it.
 
         Arguments:
             storage: The `werkzeug.FileStorage` to check.
             basename: The basename it will be saved under.
         """
-        return self.extension_allowed(extension(basename))
+        ext = self.matcher.extension_for(basename)
+        if ext is None:
+            ext = extension(basename)
+        return self.extension_allowed(ext)
 
     def extension_allowed(self, ext: str) -> bool:
         """
         This determines whether a specific extension is allowed. It is called
         by `file_allowed`, so if you override that but still want to check
-        extensions, call back into this.
+        extensions, call back into this. The check ignores case and uses
+        the set's compiled `matcher`, so it takes constant time.
 
         Arguments:
             ext: The extension to check, without the dot.
         """
-        return ((ext in self.config.allow) or
-                (ext in self.extensions and ext not in self.config.deny))
+        return self.matcher.allowed(ext)
+
+    def max_size_for(self, folder: Optional[str] = None) -> Optional[int]:
+        """
+        Returns the largest size, in bytes, a file saved to the folder may
+        have, or `None` if there is no limit. This is the folder's entry in
+        the `UPLOADED_X_FOLDER_MAX_SIZES` setting if it has one, or else
+        the `UPLOADED_X_MAX_SIZE` setting.
+
+        Arguments:
+            folder: The subfolder within the upload set.
+        """
+        config = self.config
+        if folder and folder in config.folder_max_sizes:
+            return config.folder_max_sizes[folder]
+        return config.max_size
+
+    def _expiry_scheduler(self) -> ExpiryScheduler:
+        """
+        Returns the expiry scheduler of the set's destination, creating it
+        the first time.
+        """
+        config = self.config
+        if config.backend is not None:
+            raise RuntimeError("expiry needs a local destination")
+        scheduler = self._expiry.get(config.destination)
+        if scheduler is None:
+            scheduler = self._expiry[config.destination] = ExpiryScheduler(
+                self,
+                config.destination,
+                config.ttl,
+                config.shard_depth,
+                config.executor
+            )
+        return scheduler
+
+    async def start_expiry(self) -> None:
+        """
+        This starts deleting the set's files in the background as they
+        expire. `configure_uploads` calls it when the app starts serving.
+        """
+        self._expiry_scheduler().start()
+
+    async def stop_expiry(self) -> None:
+        """
+        This stops deleting expired files in the background.
+        `configure_uploads` calls it when the app shuts down.
+        """
+        scheduler = self._expiry.get(self.config.destination)
+        if scheduler is not None:
+            await scheduler.stop()
+
+    async def expire(self, now: Optional[float] = None) -> List[str]:
+        """
+        This deletes the set's expired files now, i.e. from a scheduled
+        command when the app doesn't run the background task, and returns
+        their names.
+
+        Arguments:
+            now: The time to expire files at, as a Unix timestamp,
+                 instead of the current time.
+        """
+        return await self._expiry_scheduler().expire(now)
+
+    def _check_ttl(self, ttl: Optional[TTL]) -> None:
+        """
+        Raises `ValueError` if a save can't be given the time to live.
+        """
+        if ttl is not None:
+            ttl_seconds(ttl)
+            if self.config.backend is not None:
+                raise ValueError("ttl needs a local destination")
+
+    async def _schedule_expiry(
+        self, folder: Optional[str], target: str, ttl: Optional[TTL]
+    ) -> None:
+        """
+        Records when a file that has just been saved expires, after the
+        `ttl` given to the save or else the set's `ttl`, in the expiry
+        journal.
+        """
+        config = self.config
+        if config.backend is not None:
+            return
+        seconds = ttl_seconds(ttl) if ttl is not None else config.ttl
+        basename = os.path.basename(target)
+        name = posixpath.join(folder, basename) if folder else basename
+        scheduler = self._expiry.get(config.destination)
+        if seconds is None:
+            if scheduler is not None:
+                scheduler.schedule(name, None)
+            return
+
+        deadline = time.time() + seconds
+        # Recorded rather than left to the file's age, as a hardlinked
+        # file keeps the modification time of its first copy.
+        await run_blocking(
+            config.executor,
+            append_journal,
+            os.path.join(config.destination, EXPIRY_FILE),
+            name,
+            deadline,
+            target
+        )
+        if scheduler is not None:
+            scheduler.schedule(name, deadline)
+
+    async def _usage_tracker(
+        self, create: bool = False
+    ) -> Optional[UsageTracker]:
+        """
+        Returns the loaded usage counters of the set's destination. They
+        are only kept once something needs them, which is the set's
+        quotas or a call to `usage`, so otherwise this returns `None`
+        unless `create` is given.
+        """
+        config = self.config
+        if config.backend is not None:
+            return None
+        tracker = self._usage.get(config.destination)
+        if tracker is None:
+            if not (create or config.quota is not None or
+                    config.folder_quota is not None):
+                return None
+            tracker = self._usage[config.destination] = UsageTracker(
+                config.destination, config.shard_depth, config.executor
+            )
+        await tracker.load()
+        return tracker
+
+    async def usage(self, folder: Optional[str] = None) -> Usage:
+        """
+        This returns the storage used by the set, or by one of its
+        folders, as a `Usage` with the number of bytes and files. The
+        counters are built with one scan of the destination the first time
+        they are needed, or read from the snapshot a previous run left,
+        and are then kept up to date by `save` and `delete`.
+
+        Arguments:
+            folder: The subfolder within the upload set, or `None` for the
+                    whole set.
+        """
+        tracker = await self._usage_tracker(create=True)
+        if tracker is None:
+            raise RuntimeError("usage accounting needs a local destination")
+        return tracker.get(folder)
+
+    async def rebuild_usage(self) -> None:
+        """
+        This counts the set's files again with a scan of the destination,
+        i.e. after files were added or removed other than through this
+        set, such as by another process.
+        """
+        tracker = await self._usage_tracker(create=True)
+        if tracker is None:
+            raise RuntimeError("usage accounting needs a local destination")
+        await tracker.rebuild()
+
+    async def close_usage(self) -> None:
+        """
+        This writes the set's usage counters to their snapshot, marked as
+        closed so the next start loads them instead of scanning the
+        destination. `configure_uploads` calls it when the app shuts down.
+        """
+        for tracker in self._usage.values():
+            await tracker.close()
+
+    async def quota_remaining(
+        self, folder: Optional[str] = None
+    ) -> Optional[int]:
+        """
+        This returns how many more bytes can be saved to the folder before
+        the set's `quota` or `folder_quota` is reached, or `None` if the
+        set has no quota.
+
+        Arguments:
+            folder: The subfolder within the upload set.
+        """
+        tracker = await self._usage_tracker()
+        if tracker is None:
+            return None
+        return self._room(tracker, folder)
+
+    def _room(
+        self, tracker: UsageTracker, folder: Optional[str]
+    ) -> Optional[int]:
+        """
+        Returns the room left under the set's quotas, less what saves in
+        progress have reserved. It doesn't wait, so a save can reserve the
+        room it finds before another save looks.
+        """
+        config = self.config
+        rooms = []
+        if config.quota is not None:
+            rooms.append(config.quota - tracker.used())
+        if config.folder_quota is not None:
+            rooms.append(config.folder_quota - tracker.used(folder or ''))
+        return max(min(rooms), 0) if rooms else None
+
+    async def _check_quota(
+        self, storage: FileStorage, folder: Optional[str]
+    ) -> None:
+        """
+        Raises `QuotaExceeded` if the storage's size is already known and
+        is more than the folder has room for, before anything is written.
+        """
+        room = await self.quota_remaining(folder)
+        if room is not None:
+            size = _size_hint(storage)
+            if size is not None and size > room:
+                raise QuotaExceeded()
+
+    async def delete(self, name: str) -> None:
+        """
+        This deletes a file from the set, along with its image variants
+        and compressed copies, and takes it off the set's usage. It raises
+        `FileNotFoundError` if the file doesn't exist.
+
+        Arguments:
+            name: The name of the file, including the folder, as returned
+                  by `save`.
+        """
+        folder, basename = posixpath.split(name)
+        target = self._join(self._target_folder(folder or None), basename)
+        config = self.config
+        scheduler = self._expiry.get(config.destination)
+        if scheduler is not None:
+            scheduler.schedule(name, None)
+        if config.backend is not None:
+            await config.backend.delete(target)
+            await send(upload_deleted, self, name=name, size=None)
+            return
+
+        executor = config.executor
+        tracker = await self._usage_tracker()
+        size = None
+        if tracker is not None:
+            size = (await run_blocking(executor, os.stat, target)).st_size
+        await aiofiles.os.remove(target, executor=executor)
+        if tracker is not None and size is not None:
+            tracker.add(folder, -size, -1)
+
+        derived = [compressed_path(target, encoding) for encoding in ENCODINGS]
+        stored = shard_path(name, config.shard_depth)
+        derived.extend(
+            os.path.join(
+                config.destination,
+                *variant_name(stored, variant, spec).split('/')
+            )
+            for variant, spec in self.variants.items()
+        )
+        for path in derived:
+            with contextlib.suppress(FileNotFoundError):
+                await aiofiles.os.remove(path, executor=executor)
+        await send(upload_deleted, self, name=name, size=size)
+
+    def _sniffer(self, basename: str) -> Optional[Sniffer]:
+        """
+        Returns a `Sniffer` for a file being saved under the basename, or
+        `None` if the set doesn't sniff content.
+        """
+        if not self.config.sniff:
+            return None
+        return Sniffer(extension(basename))
 
     def get_basename(self, filename: str) -> str:
         """
@@ -145,11 +795,129 @@ class UploadSet:
         """
         return lowercase_ext(secure_filename(filename))
 
-    async def save(
+    def _target_folder(self, folder: Optional[str] = None) -> str:
+        """
+        Returns the absolute path of the folder files are saved to, or the
+        key prefix when the set uses a storage backend.
+
+        Arguments:
+            folder: The subfolder within the upload set.
+        """
+        if self.config.backend is not None:
+            return folder or ''
+        if folder:
+            return os.path.join(self.config.destination, folder)
+        return self.config.destination
+
+    def _target_basename(
+        self,
+        storage: FileStorage,
+        name: Optional[str] = None,
+        folder: Optional[str] = None
+    ) -> str:
+        """
+        Checks that the storage can be saved in this set and returns the
+        basename it should be saved under, before any conflict resolution.
+        If the file's size is already known, it is checked against the
+        folder's size limit here, before anything is written.
+
+        Arguments:
+            storage: The uploaded file to save.
+            name: The name to save the file as.
+            folder: The subfolder within the upload set to save to.
+        """
+        if not isinstance(storage, FileStorage):
+            raise TypeError("Storage must be a werkzeug.FileStorage")
+
+        basename = self.get_basename(storage.filename)
+
+        if not self.file_allowed(basename):
+            raise UploadNotAllowed()
+
+        limit = self.max_size_for(folder)
+        if limit is not None:
+            size = stream_size(storage.stream) or storage.content_length
+            if size is not None and size > limit:
+                raise UploadTooLarge()
+
+        if name:
+            if name.endswith('.'):
+                basename = name + extension(basename)
+            else:
+                basename = name
+
+        return basename
+
+    async def _claim_name(
+        self,
+        target_folder: str,
+        basename: str,
+        reserved: Optional[Set[str]] = None
+    ) -> str:
+        """
+        Returns the name the file will be saved under in the target folder,
+        resolving any conflict with existing files.
+
+        Arguments:
+            target_folder: The absolute path to the target.
+            basename: The file's basename.
+            reserved: Names already picked for other files in the batch.
+        """
+        if self.config.reserve and self.config.backend is None:
+            return await self.reserve_name(target_folder, basename)
+        if (reserved and basename in reserved) or (
+            await self._exists(self._join(target_folder, basename))
+        ):
+            if type(self).resolve_conflict is UploadSet.resolve_conflict:
+                return await self._resolve_conflict(
+                    target_folder, basename, reserved
+                )
+            newname = await self.resolve_conflict(target_folder, basename)
+            if reserved and newname in reserved:
+                # An override doesn't know the names picked for the batch.
+                return await self._resolve_conflict(
+                    target_folder, newname, reserved
+                )
+            return newname
+        return basename
+
+    async def _prepare(
         self,
         storage: FileStorage,
         folder: Optional[str] = None,
         name: Optional[str] = None
+    ) -> Tuple[Optional[str], str, str]:
+        """
+        Validates the storage, creates the target folder and picks the
+        name to save under. Returns the folder, the absolute target folder
+        and the basename.
+
+        Arguments:
+            storage: The uploaded file to save.
+            folder: The subfolder within the upload set to save to.
+            name: The name to save the file as.
+        """
+        if folder is None and name is not None and "/" in name:
+            folder, name = os.path.split(name)
+
+        basename = self._target_basename(storage, name, folder)
+        await self._check_quota(storage, folder)
+        target_folder = self._target_folder(folder)
+
+        if self.config.backend is None:
+            await aiofiles.os.makedirs(
+                target_folder, exist_ok=True, executor=self.config.executor
+            )
+        basename = await self._claim_name(target_folder, basename)
+
+        return folder, target_folder, basename
+
+    async def save(
+        self,
+        storage: FileStorage,
+        folder: Optional[str] = None,
+        name: Optional[str] = None,
+        ttl: Optional[TTL] = None
     ) -> str:
         """
         This coroutine saves a `werkzeug.FileStorage` into this upload set.
@@ -165,46 +933,553 @@ class UploadSet:
                 are using `name`, you can include the folder in the
                 `name` instead of explicitly using `folder`, i.e.
                 ``uset.save(file, name="someguy/photo_123.")``
+            ttl: How long the file is kept, in seconds or as a
+                 `datetime.timedelta`, instead of the set's `ttl`.
         """
+        self._check_ttl(ttl)
+        async with self._observe(storage, folder) as outcome:
+            folder, target_folder, basename = await self._prepare(
+                storage, folder, name
+            )
 
-        if not isinstance(storage, FileStorage):
-            raise TypeError("Storage must be a werkzeug.FileStorage")
+            size = await self._save_file(
+                storage,
+                folder,
+                self._join(target_folder, basename),
+                sniffer=self._sniffer(basename),
+                ttl=ttl
+            )
 
-        if folder is None and name is not None and "/" in name:
-            folder, name = os.path.split(name)
+            if folder:
+                outcome['name'] = posixpath.join(folder, basename)
+            else:
+                outcome['name'] = basename
+            outcome['size'] = size
+        return outcome['name']
 
-        basename = self.get_basename(storage.filename)
+    async def save_with_result(
+        self,
+        storage: FileStorage,
+        folder: Optional[str] = None,
+        name: Optional[str] = None,
+        hashes: Iterable[str] = ('sha256',),
+        ttl: Optional[TTL] = None
+    ) -> UploadResult:
+        """
+        This coroutine saves a `werkzeug.FileStorage` like `save`, but
+        hashes the file as it is written and returns an `UploadResult` with
+        the saved name, the number of bytes written and the hex digests,
+        so the file doesn't have to be read back to hash it. If the set
+        sniffs content, the sniffed mimetype is returned too.
 
-        if not self.file_allowed(basename):
-            raise UploadNotAllowed()
+        Arguments:
+            storage: The uploaded file to save.
+            folder: The subfolder within the upload set to save to.
+            name: The name to save the file as, as for `save`.
+            hashes: The names of the `hashlib` algorithms to compute, for
+                    example ``('sha256', 'md5', 'blake2b')``.
+            ttl: How long the file is kept, in seconds or as a
+                 `datetime.timedelta`, instead of the set's `ttl`.
+        """
+        self._check_ttl(ttl)
+        hashers = new_hashers(hashes)
 
-        if name:
-            if name.endswith('.'):
-                basename = name + extension(basename)
-            else:
-                basename = name
+        async with self._observe(storage, folder) as outcome:
+            folder, target_folder, basename = await self._prepare(
+                storage, folder, name
+            )
 
-        if folder:
-            target_folder = os.path.join(self.config.destination, folder)
-        else:
-            target_folder = self.config.destination
+            target = self._join(target_folder, basename)
+            sniffer = self._sniffer(basename)
+            size = await self._save_file(
+                storage, folder, target, hashers, sniffer, ttl
+            )
 
-        if not await aiofiles.os.path.exists(target_folder):
-            await aiofiles.os.makedirs(target_folder)
+            if (self.config.backend is None and
+                    self.config.etag == ETAG_HASH and 'sha256' in hashers):
+                await run_blocking(
+                    self.config.executor,
+                    set_stored_digest,
+                    target,
+                    hashers['sha256'].hexdigest()
+                )
 
-        if await aiofiles.os.path.exists(
-            os.path.join(target_folder, basename)
-        ):
-            basename = await self.resolve_conflict(target_folder, basename)
+            outcome['name'] = (
+                posixpath.join(folder, basename) if folder else basename
+            )
+            outcome['size'] = size
+
+        return UploadResult(
+            outcome['name'],
+            size,
+            {algorithm: h.hexdigest() for algorithm, h in hashers.items()},
+            sniffer.content_type if sniffer is not None else None
+        )
 
-        target = os.path.join(target_folder, basename)
+    async def save_many(
+        self,
+        storages: Iterable[FileStorage],
+        folder: Optional[str] = None,
+        concurrency: int = 4,
+        ttl: Optional[TTL] = None
+    ) -> List[Union[str, UploadNotAllowed]]:
+        """
+        This coroutine saves several `werkzeug.FileStorage` objects into
+        this upload set at once. Every file is validated before anything is
+        written, the target folder is created once, and the files are then
+        written concurrently, with at most `concurrency` writes in flight.
 
-        await storage.save(target)
+        The results are returned in the same order as `storages`. Each
+        result is either the saved name (including the folder), or the
+        `UploadNotAllowed` error for a file that was not allowed, such as
+        an `UploadTooLarge` error for a file over the size limit, so one
+        bad file doesn't stop the rest of the batch.
+
+        Arguments:
+            storages: The uploaded files to save.
+            folder: The subfolder within the upload set to save to.
+            concurrency: The maximum number of files written at a time.
+            ttl: How long the files are kept, in seconds or as a
+                 `datetime.timedelta`, instead of the set's `ttl`.
+        """
+        if concurrency < 1:
+            raise ValueError("Concurrency must be at least 1")
+        self._check_ttl(ttl)
+
+        storages = list(storages)
+        results: List[Union[str, UploadNotAllowed]] = []
+        for storage in storages:
+            try:
+                basename = self._target_basename(storage, folder=folder)
+                await self._check_quota(storage, folder)
+                results.append(basename)
+            except UploadNotAllowed as error:
+                results.append(error)
+                await send(
+                    upload_rejected,
+                    self,
+                    filename=storage.filename,
+                    folder=folder,
+                    error=error,
+                    duration=0.0
+                )
+
+        target_folder = self._target_folder(folder)
+        if self.config.backend is None:
+            await aiofiles.os.makedirs(
+                target_folder, exist_ok=True, executor=self.config.executor
+            )
+
+        # Names are picked in input order, so duplicates within the batch
+        # are resolved the same way as they would be by sequential saves.
+        reserved: Set[str] = set()
+        for index, basename in enumerate(results):
+            if isinstance(basename, UploadNotAllowed):
+                continue
+            basename = await self._claim_name(
+                target_folder, basename, reserved
+            )
+            reserved.add(basename)
+            results[index] = basename
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _save_one(index: int, basename: str) -> None:
+            async with semaphore:
+                try:
+                    async with self._observe(
+                        storages[index], folder
+                    ) as outcome:
+                        outcome['size'] = await self._save_file(
+                            storages[index],
+                            folder,
+                            self._join(target_folder, basename),
+                            sniffer=self._sniffer(basename),
+                            ttl=ttl
+                        )
+                        outcome['name'] = (
+                            posixpath.join(folder, basename) if folder
+                            else basename
+                        )
+                except UploadNotAllowed as error:
+                    results[index] = error
+
+        await asyncio.gather(*(
+            _save_one(index, basename)
+            for index, basename in enumerate(results)
+            if not isinstance(basename, UploadNotAllowed)
+        ))
 
         if folder:
-            return posixpath.join(folder, basename)
+            return [
+                result if isinstance(result, UploadNotAllowed)
+                else posixpath.join(folder, result)
+                for result in results
+            ]
+        return results
+
+    @contextlib.asynccontextmanager
+    async def _observe(
+        self, storage: FileStorage, folder: Optional[str]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Sends the lifecycle signals around a save. The body sets the
+        ``name`` and ``size`` of the saved file in the yielded dictionary,
+        which are sent with `upload_saved`. An `UploadNotAllowed` error is
+        sent with `upload_rejected` and raised again.
+        """
+        filename = getattr(storage, 'filename', None)
+        await send(upload_started, self, filename=filename, folder=folder)
+        start = time.perf_counter()
+        outcome: Dict[str, Any] = {}
+        try:
+            yield outcome
+        except UploadNotAllowed as error:
+            await send(
+                upload_rejected,
+                self,
+                filename=filename,
+                folder=folder,
+                error=error,
+                duration=time.perf_counter() - start
+            )
+            raise
+        size = outcome.get('size')
+        await send(
+            upload_saved,
+            self,
+            name=outcome['name'],
+            size=size if size is not None and size >= 0 else None,
+            folder=folder,
+            duration=time.perf_counter() - start
+        )
+
+    async def _save_file(
+        self,
+        storage: FileStorage,
+        folder: Optional[str],
+        target: str,
+        hashers: Optional[Dict[str, Any]] = None,
+        sniffer: Optional[Sniffer] = None,
+        ttl: Optional[TTL] = None
+    ) -> int:
+        """
+        Writes the storage to the target with `_write`, limited to the
+        folder's size limit and the room left under the set's quotas,
+        counts the saved file in the set's usage and schedules its expiry.
+        Returns the number of bytes written.
+
+        Under a quota, the storage's size is reserved until the file is
+        counted, so concurrent saves can't together write more than the
+        quota. If its size isn't known, room is reserved as its bytes are
+        read instead.
+
+        Arguments:
+            storage: The uploaded file to save.
+            folder: The subfolder within the upload set.
+            target: The absolute path or key to save the file to.
+            hashers: The `hashlib` objects to update, by algorithm name.
+            sniffer: The `Sniffer` to check the file's content with.
+            ttl: The file's time to live, instead of the set's `ttl`.
+        """
+        limit = self.max_size_for(folder)
+        tracker = await self._usage_tracker()
+        room = None if tracker is None else self._room(tracker, folder)
+        reserved = 0
+        reservation = None
+        quota_bound = False
+        if tracker is not None and room is not None:
+            size = _size_hint(storage)
+            if size is not None and size > room:
+                raise QuotaExceeded()
+            if size is None:
+                reservation = Reservation(
+                    tracker, folder, lambda: self._room(tracker, folder)
+                )
+                size = room
+            else:
+                reserved = size
+            if limit is not None:
+                size = min(size, limit)
+            quota_bound = limit is None or size < limit
+            limit = size
+            tracker.reserve(folder, reserved)
+        try:
+            size = await self._write(
+                storage, target, hashers, limit, sniffer, reservation
+            )
+            if tracker is not None and size < 0:
+                size = (await run_blocking(
+                    self.config.executor, os.stat, target
+                )).st_size
+        except UploadTooLarge as error:
+            if quota_bound and not isinstance(error, QuotaExceeded):
+                raise QuotaExceeded() from error
+            raise
+        finally:
+            if reserved:
+                tracker.reserve(folder, -reserved)
+            if reservation is not None:
+                reservation.release()
+
+        if tracker is not None:
+            tracker.add(folder, size)
+        await self._schedule_expiry(folder, target, ttl)
+        return size
+
+    async def _write(
+        self,
+        storage: FileStorage,
+        target: str,
+        hashers: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        sniffer: Optional[Sniffer] = None,
+        reservation: Optional[Reservation] = None
+    ) -> int:
+        """
+        Writes the storage to the target path and returns the number of
+        bytes written. When `hashers` or a size `limit` are given, the file
+        is streamed here, so each chunk can be hashed on its way to disk
+        and the write stops with `UploadTooLarge` as soon as the limit is
+        crossed. A `sniffer` is likewise fed the first bytes of the file,
+        and stops the write with `UploadTypeMismatch` if the content
+        doesn't match the extension. Otherwise the storage saves itself
+        and the size is not counted. If the set deduplicates, the file is
+        stored in `blobs` and linked to the target. With the `atomic`
+        setting, the file is written to a temporary file and moved into
+        place. If the write fails, a partially written or reserved file is
+        removed. If the set uses a storage backend, `target` is the key and
+        the backend stores the file. With the `max_writes` setting, the
+        write waits for one of the set's write slots first. With the
+        `compress_on_save` setting, the file's compressed copies are made
+        once it is written.
+
+        Arguments:
+            storage: The uploaded file to save.
+            target: The absolute path or key to save the file to.
+            hashers: The `hashlib` objects to update, by algorithm name.
+            limit: The largest size, in bytes, the file may have.
+            sniffer: The `Sniffer` to check the file's content with.
+            reservation: The `Reservation` to reserve quota room with as
+                         the file is read.
+        """
+        slots = self._write_slots()
+        if slots is None:
+            size = await self._write_unlimited(
+                storage, target, hashers, limit, sniffer, reservation
+            )
         else:
-            return basename
+            async with slots:
+                size = await self._write_unlimited(
+                    storage, target, hashers, limit, sniffer, reservation
+                )
+        if self.config.compress_on_save:
+            await self._precompress(target)
+        return size
+
+    async def _precompress(self, target: str) -> None:
+        """
+        Makes the compressed copies of a saved file, in each of the set's
+        `compress` encodings, if the file is worth compressing.
+        """
+        config = self.config
+        if config.backend is not None or not compressible(target):
+            return
+        stat = await run_blocking(config.executor, os.stat, target)
+        if stat.st_size < COMPRESS_MIN_SIZE:
+            return
+        for encoding in config.compress:
+            await ensure_compressed(target, encoding, stat, config.executor)
+
+    def _write_slots(self) -> Optional[asyncio.Semaphore]:
+        """
+        Returns the semaphore capping the set's writes in flight, or `None`
+        if the `max_writes` setting isn't given.
+        """
+        config = self.config
+        if config.max_writes is None:
+            return None
+        cached = self._write_limits.get(id(config))
+        if cached is None or cached[0] is not config:
+            if len(self._write_limits) >= 64:
+                self._write_limits.clear()
+            cached = self._write_limits[id(config)] = (
+                config, asyncio.Semaphore(config.max_writes)
+            )
+        return cached[1]
+
+    async def _write_unlimited(
+        self,
+        storage: FileStorage,
+        target: str,
+        hashers: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        sniffer: Optional[Sniffer] = None,
+        reservation: Optional[Reservation] = None
+    ) -> int:
+        stream = storage.stream
+        watchers = [
+            watcher for watcher in (sniffer, reservation)
+            if watcher is not None
+        ]
+        if watchers:
+            stream = HashingReader(stream, watchers)
+        executor = self.config.executor
+
+        if self.config.backend is None and self.config.shard_depth:
+            await aiofiles.os.makedirs(
+                os.path.dirname(target), exist_ok=True, executor=executor
+            )
+
+        if self.config.backend is not None:
+            reader = HashingReader(
+                stream, hashers.values() if hashers else (), limit
+            )
+            size = await self.config.backend.save(target, reader)
+            if sniffer is not None:
+                try:
+                    sniffer.finish()
+                except UploadTypeMismatch:
+                    await self.config.backend.delete(target)
+                    raise
+            return size
+
+        try:
+            if self.config.atomic and not self.config.deduplicate:
+                return await write_atomic(
+                    lambda path: self._write_file(
+                        storage, stream, path, hashers, limit, sniffer
+                    ),
+                    target,
+                    self.config.fsync,
+                    self._group_commit,
+                    executor
+                )
+            return await self._write_file(
+                storage, stream, target, hashers, limit, sniffer
+            )
+        except BaseException:
+            # Atomic and deduplicated writes never leave a partial target,
+            # only a reserved name or a file streamed in place needs to go.
+            streamed = (
+                hashers is not None or limit is not None or
+                sniffer is not None
+            )
+            if self.config.reserve or (
+                streamed and not self.config.atomic and
+                not self.config.deduplicate
+            ):
+                with contextlib.suppress(FileNotFoundError):
+                    await aiofiles.os.remove(target, executor=executor)
+            raise
+
+    async def _write_file(
+        self,
+        storage: FileStorage,
+        stream: IO[bytes],
+        path: str,
+        hashers: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        sniffer: Optional[Sniffer] = None
+    ) -> int:
+        """
+        Writes the stream to a local path, see `_write`. If the upload was
+        spooled to disk and doesn't need hashing or sniffing, it is moved
+        into place with `move_stream` instead of being copied through
+        Python.
+        """
+        executor = self.config.executor
+        if self.config.deduplicate:
+            digest, size = await self.blobs.save(
+                stream, path, hashers, limit
+            )
+            if sniffer is not None:
+                try:
+                    sniffer.finish()
+                except UploadTypeMismatch:
+                    await aiofiles.os.remove(path, executor=executor)
+                    raise
+            if self.config.etag == ETAG_HASH:
+                await run_blocking(executor, set_stored_digest, path, digest)
+            return size
+        if sniffer is not None:
+            size = await write_stream(
+                stream,
+                path,
+                (hashers or {}).values(),
+                max_size=limit,
+                executor=executor
+            )
+            sniffer.finish()
+            return size
+        if hashers is None:
+            # Only for storages that save themselves the standard way, so
+            # custom save methods are still called.
+            standard = type(storage).save is FileStorage.save
+            if standard:
+                size = await run_blocking(
+                    executor, move_stream, storage.stream, path
+                )
+                if size is not None:
+                    if limit is not None and size > limit:
+                        raise UploadTooLarge()
+                    return size
+            # `FileStorage.save` writes in the default executor, so the
+            # stream is written here instead if the set has its own.
+            if limit is None and not (standard and executor is not None):
+                size = stream_size(storage.stream)
+                await storage.save(path)
+                return size if size is not None else -1
+        return await write_stream(
+            stream,
+            path,
+            (hashers or {}).values(),
+            max_size=limit,
+            executor=executor
+        )
+
+    async def reserve_name(self, target_folder: str, basename: str) -> str:
+        """
+        This claims a name in the target folder by creating an empty file
+        with an exclusive create (``O_CREAT | O_EXCL``), and returns the
+        name that was claimed. If the name is taken, the next name from the
+        conflict index is tried, until one can be created. It is used
+        instead of `resolve_conflict` when the set's `reserve` setting is
+        on, and as the create itself is atomic, two requests or worker
+        processes saving to the same folder can never pick the same name.
+
+        Arguments:
+            target_folder: The absolute path to the target.
+            basename: The file's original basename.
+        """
+        newname = basename
+        probes = 0
+        executor = self.config.executor
+        while True:
+            target = self._join(target_folder, newname)
+            try:
+                if self.config.shard_depth:
+                    await aiofiles.os.makedirs(
+                        os.path.dirname(target),
+                        exist_ok=True,
+                        executor=executor
+                    )
+                await run_blocking(executor, create_exclusive, target)
+            except FileExistsError:
+                newname = await self._conflict_index.next_name(
+                    target_folder, basename, executor
+                )
+                probes += 1
+            else:
+                if probes:
+                    await send(
+                        conflict_resolved,
+                        self,
+                        basename=basename,
+                        name=newname,
+                        probes=probes
+                    )
+                return newname
 
     async def resolve_conflict(self, target_folder: str, basename: str) -> str:
         """
@@ -213,19 +1488,76 @@ class UploadSet:
         basename for the file.
 
         The default implementation splits the name and extension and adds a
-        suffix to the name consisting of an underscore and a number, and tries
-        that until it finds one that doesn't exist.
+        suffix to the name consisting of an underscore and a number. The
+        number is taken from a per-folder index of the highest suffix in
+        use, which is built from a single scan of the folder the first time
+        it is needed, so only the returned name has to be checked against
+        the disk.
 
         Arguments:
             target_folder: The absolute path to the target.
             basename: The file's original basename.
         """
-        name, ext = os.path.splitext(basename)
-        count = 0
+        return await self._resolve_conflict(target_folder, basename)
+
+    async def _resolve_conflict(
+        self,
+        target_folder: str,
+        basename: str,
+        reserved: Optional[Container[str]] = None
+    ) -> str:
+        """
+        Resolves a conflict as `resolve_conflict` does, also treating the
+        reserved names as taken even though they don't exist yet, such as
+        names already picked for other files in the same `save_many` batch.
+        """
+        conflicts = self._conflict_index
+        probes = 0
         while True:
-            count = count + 1
-            newname = f'{name}_{count}{ext}'
-            if not await aiofiles.os.path.exists(
-                os.path.join(target_folder, newname)
-            ):
+            newname = await conflicts.next_name(
+                target_folder, basename, self.config.executor
+            )
+            probes += 1
+            if reserved is not None and newname in reserved:
+                continue
+            if not await self._exists(self._join(target_folder, newname)):
+                await send(
+                    conflict_resolved,
+                    self,
+                    basename=basename,
+                    name=newname,
+                    probes=probes
+                )
                 return newname
+
+    @property
+    def _conflict_index(self) -> ConflictIndex:
+        """
+        The conflict index for the set. A sharded set's numbered duplicates
+        are spread over many folders, and a backend can't be scanned
+        cheaply, so those start from an empty index and probe each name.
+        """
+        if self.config.backend is not None or self.config.shard_depth:
+            return self._unscanned_conflicts
+        return self._conflicts
+
+    def _join(self, target_folder: str, basename: str) -> str:
+        """
+        Joins a basename to the target folder, giving the absolute path of
+        the file, or its key when the set uses a storage backend. If the set
+        is sharded, the shard folders go between the two.
+        """
+        sharded = shard_path(basename, self.config.shard_depth)
+        if self.config.backend is not None:
+            return posixpath.join(target_folder, sharded)
+        return os.path.join(target_folder, *sharded.split('/'))
+
+    async def _exists(self, target: str) -> bool:
+        """
+        Returns whether a file exists at the target path or key.
+        """
+        if self.config.backend is not None:
+            return await self.config.backend.exists(target)
+        return await aiofiles.os.path.exists(
+            target, executor=self.config.executor
+        )
@@ -0,0 +1,70 @@
+"""
+quart_uploads.signals
+
+Provides the signals sent as files are saved and served, so an app can
+record timings and sizes. They are `blinker` signals, like Quart's own,
+and the sender is always the `UploadSet`.
+
+Receivers may be coroutines. Plain functions are called directly in the
+event loop, so they should be quick, i.e. updating a counter.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Coroutine
+
+from blinker import Namespace, Signal
+
+_signals = Namespace()
+
+#: Sent when a save begins, with the ``filename`` the client gave and the
+#: ``folder`` being saved to.
+upload_started = _signals.signal('upload-started')
+
+#: Sent when a file has been saved, with the ``name`` it was saved as, its
+#: ``size`` in bytes (or `None` if it wasn't counted), the ``folder`` and
+#: the ``duration`` of the save in seconds.
+upload_saved = _signals.signal('upload-saved')
+
+#: Sent when a file isn't saved because of an `UploadNotAllowed` error,
+#: with the ``filename``, the ``folder``, the ``error`` and the
+#: ``duration`` in seconds.
+upload_rejected = _signals.signal('upload-rejected')
+
+#: Sent when a conflicting name has been resolved, with the ``basename``
+#: that was taken, the ``name`` picked instead and the number of names
+#: that were tried, as ``probes``.
+conflict_resolved = _signals.signal('conflict-resolved')
+
+#: Sent when a file has been deleted with `UploadSet.delete`, with the
+#: ``name`` of the file and its ``size`` in bytes (or `None` if it wasn't
+#: looked up).
+upload_deleted = _signals.signal('upload-deleted')
+
+#: Sent by the uploads route when it has answered a request for a file,
+#: with the ``filename``, the response ``status``, the ``size`` of the
+#: body (or `None` if it isn't known) and the ``duration`` in seconds. The
+#: duration covers preparing the response, not sending the body.
+file_served = _signals.signal('file-served')
+
+
+def _sync_wrapper(
+    func: Callable[..., Any]
+) -> Callable[..., Coroutine[Any, Any, Any]]:
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return func(*args, **kwargs)
+    return wrapper
+
+
+async def send(signal: Signal, sender: Any, **kwargs: Any) -> None:
+    """
+    Sends the signal to its receivers, if it has any, so an app that
+    doesn't listen pays almost nothing.
+
+    Arguments:
+        signal: The signal to send.
+        sender: The `UploadSet` the signal is about.
+        kwargs: The values passed to the receivers.
+    """
+    if signal.receivers:
+        await signal.send_async(
+            sender, _sync_wrapper=_sync_wrapper, **kwargs
+        )
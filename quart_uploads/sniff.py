@@ -0,0 +1,179 @@
+"""
+quart_uploads.sniff
+
+Provides content sniffing for uploads. The first bytes of a file are
+matched against a table of magic-byte signatures for the formats in the
+`FileExtensions` presets, compiled into a single regular expression, so
+an upload whose content doesn't match its extension can be rejected as it
+is written. Signatures are long enough not to be mistaken for text, and a
+file of a text format whose first bytes only look like a signature because
+they are text is never rejected.
+"""
+from __future__ import annotations
+import re
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from .exceptions import UploadTypeMismatch
+from .file_ext import FileExtensions
+
+#: The number of bytes read from the start of a file to sniff its type,
+#: enough for the ``ustar`` marker of a tar archive at offset 257, and for
+#: the PE header of nearly all Windows executables.
+SNIFF_SIZE = 512
+
+#: The signatures, as ``(mimetype, patterns, extensions)``. Each pattern is
+#: a regular expression matched at the start of the file, and the
+#: extensions are those whose content should have this type. Earlier
+#: entries win, so more specific signatures come first.
+SIGNATURES: Tuple[Tuple[str, Tuple[bytes, ...], Tuple[str, ...]], ...] = (
+    ('image/png', (rb'\x89PNG\r\n\x1a\n',), ('png',)),
+    ('image/jpeg', (rb'\xff\xd8\xff',), ('jpg', 'jpe', 'jpeg')),
+    ('image/gif', (rb'GIF8[79]a',), ('gif',)),
+    ('image/webp', (rb'RIFF.{4}WEBP',), ('webp',)),
+    ('image/bmp', (rb'BM.{4}\x00{4}',), ('bmp',)),
+    ('audio/wav', (rb'RIFF.{4}WAVE',), ('wav',)),
+    # The STREAMINFO block always comes first.
+    ('audio/flac', (rb'fLaC[\x00\x80]\x00\x00\x22',), ('flac',)),
+    ('audio/ogg', (rb'OggS\x00[\x00-\x07]',), ('ogg', 'oga')),
+    ('audio/aac', (rb'\xff[\xf1\xf9]',), ('aac',)),
+    (
+        'audio/mpeg',
+        (rb'ID3[\x02-\x04]\x00', rb'\xff[\xe2\xe3\xf2\xf3\xfa\xfb]'),
+        ('mp3',)
+    ),
+    ('application/pdf', (rb'%PDF-',), ('pdf',)),
+    ('application/rtf', (rb'\{\\rtf',), ('rtf',)),
+    (
+        'application/x-ole-storage',
+        (rb'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',),
+        ('doc', 'xls')
+    ),
+    (
+        'application/zip',
+        (rb'PK\x03\x04', rb'PK\x05\x06'),
+        ('zip', 'docx', 'xlsx', 'odf', 'ods')
+    ),
+    ('application/gzip', (rb'\x1f\x8b',), ('gz', 'tgz', 'gnumeric')),
+    # A first block, or the end of an empty stream.
+    (
+        'application/x-bzip2',
+        (rb'BZh[1-9](?:1AY&SY|\x17rE8P\x90)',),
+        ('bz2',)
+    ),
+    ('application/x-xz', (rb'\xfd7zXZ\x00',), ('txz',)),
+    ('application/x-7z-compressed', (rb"7z\xbc\xaf'\x1c",), ('7z',)),
+    ('application/x-tar', (rb'.{257}ustar',), ('tar',)),
+    ('application/x-bplist', (rb'bplist0',), ('plist',)),
+    # The PE header the DOS header points to is checked by `sniff`.
+    ('application/x-msdownload', (rb'MZ.{58}',), ('exe', 'dll')),
+    ('application/x-elf', (rb'\x7fELF',), ('so',)),
+)
+
+#: Extensions whose files may also have no recognisable signature, as the
+#: format has a plain text form.
+TEXT_FORMS = frozenset(('plist', 'gnumeric'))
+
+MSDOWNLOAD = 'application/x-msdownload'
+
+_TEXT = re.compile(rb'[\t\n\r\x20-\x7e]*')
+
+_PATTERN = re.compile(
+    b'|'.join(
+        b'(?P<t%d>%s)' % (index, b'|'.join(patterns))
+        for index, (_, patterns, _) in enumerate(SIGNATURES)
+    ),
+    re.DOTALL
+)
+
+
+def _expected_types() -> Dict[str, FrozenSet[Optional[str]]]:
+    expected: Dict[str, set] = {}
+    for mimetype, _, extensions in SIGNATURES:
+        for ext in extensions:
+            expected.setdefault(ext, set()).add(mimetype)
+    for ext in TEXT_FORMS:
+        expected[ext].add(None)
+    # The other preset extensions are text formats, which shouldn't look
+    # like any of the binary formats above.
+    for preset in vars(FileExtensions).values():
+        if isinstance(preset, tuple):
+            for ext in preset:
+                expected.setdefault(ext, {None})
+    return {ext: frozenset(types) for ext, types in expected.items()}
+
+
+#: The types a file's content may be sniffed as, by extension. `None`
+#: stands for content with no recognisable signature.
+EXPECTED_TYPES = _expected_types()
+
+
+def sniff(head: bytes) -> Optional[str]:
+    """
+    Returns the mimetype of the content the bytes start, or `None` if they
+    don't match any of the signatures.
+
+    Arguments:
+        head: The first `SNIFF_SIZE` bytes of the file, or all of it if it
+              is shorter.
+    """
+    match = _match(head)
+    return None if match is None else _type(match)
+
+
+def _match(head: bytes) -> Optional[re.Match]:
+    match = _PATTERN.match(head)
+    if match is not None and _type(match) == MSDOWNLOAD:
+        offset = int.from_bytes(head[0x3c:0x40], 'little')
+        if head[offset:offset + 4] != b'PE\x00\x00':
+            return None
+    return match
+
+
+def _type(match: re.Match) -> str:
+    return SIGNATURES[int(match.lastgroup[1:])][0]
+
+
+class Sniffer:
+    """
+    This collects the first bytes of a file as it is written and checks
+    that its content matches its extension. It is updated with each chunk
+    like a `hashlib` object, and raises `UploadTypeMismatch` as soon as it
+    has seen enough of the file, so a mismatched upload is stopped before
+    the rest of it is written. Files with an extension that isn't in the
+    `FileExtensions` presets are sniffed but never rejected.
+
+    Arguments:
+        ext: The file's extension, without the leading dot.
+    """
+    def __init__(self, ext: str) -> None:
+        self.expected = EXPECTED_TYPES.get(ext.lower())
+        self.head = b""
+        self.checked = False
+        self.content_type: Optional[str] = None
+
+    def update(self, data: bytes) -> None:
+        if self.checked:
+            return
+        self.head += data[:SNIFF_SIZE - len(self.head)]
+        if len(self.head) >= SNIFF_SIZE:
+            self.finish()
+
+    def finish(self) -> Optional[str]:
+        """
+        Checks the content seen so far, if that hasn't been done yet, and
+        returns its mimetype. Call it once the whole file has been written,
+        to check files shorter than `SNIFF_SIZE`.
+        """
+        if not self.checked:
+            self.checked = True
+            match = _match(self.head)
+            self.head = b""
+            if match is not None and None in (self.expected or ()) and \
+                    _TEXT.fullmatch(match.group()):
+                # Text that happens to start like a signature.
+                match = None
+            self.content_type = None if match is None else _type(match)
+            if (self.expected is not None and
+                    self.content_type not in self.expected):
+                raise UploadTypeMismatch()
+        return self.content_type
@@ -0,0 +1,354 @@
+"""
+quart_uploads.usage
+
+Provides the storage usage counters of an upload set, per folder, which
+the set's quotas are checked against. The counters are built from a
+single scan of the destination the first time they are needed, kept up to
+date as files are saved and deleted, and written to a small snapshot file
+so the next start doesn't have to scan again, unless the last one didn't
+shut down cleanly.
+"""
+from __future__ import annotations
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from .exceptions import QuotaExceeded
+from .executor import run_blocking
+from .listing import SHARD_RE
+
+logger = logging.getLogger(__name__)
+
+#: The file, in the set's destination, the counters are persisted in.
+USAGE_FILE = '.usage.json'
+
+#: The version of the format of the usage file.
+USAGE_FORMAT = 1
+
+
+@dataclass
+class Usage:
+    """
+    This holds the storage used by an upload set or one of its folders.
+
+    Arguments:
+        bytes: The total size of the files, in bytes.
+        files: The number of files.
+    """
+
+    bytes: int = 0
+    files: int = 0
+
+
+def logical_folder(relative: str, depth: int) -> str:
+    """
+    Returns the folder files were saved to, as passed to `UploadSet.save`,
+    from the folder they are stored in, by dropping the shard folders.
+    """
+    parts = [] if relative == os.curdir else relative.split(os.sep)
+    if depth and len(parts) >= depth and all(
+        SHARD_RE.match(part) for part in parts[-depth:]
+    ):
+        parts = parts[:-depth]
+    return '/'.join(parts)
+
+
+def scan_usage(root: str, depth: int) -> Dict[str, Usage]:
+    """
+    Counts the files in the destination and its folders, per folder, with
+    one walk of the tree. Hidden files and folders, such as the set's own
+    bookkeeping, aren't counted.
+
+    Arguments:
+        root: The set's destination.
+        depth: The number of levels of shard folders.
+    """
+    folders: Dict[str, Usage] = {}
+    for path, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        usage = None
+        for name in filenames:
+            if name.startswith('.'):
+                continue
+            try:
+                size = os.stat(os.path.join(path, name)).st_size
+            except FileNotFoundError:
+                continue
+            if usage is None:
+                folder = logical_folder(os.path.relpath(path, root), depth)
+                usage = folders.setdefault(folder, Usage())
+            usage.bytes += size
+            usage.files += 1
+    return folders
+
+
+def _read_snapshot(path: str) -> Optional[Dict[str, Usage]]:
+    try:
+        with open(path, encoding='utf-8') as file_:
+            data = json.load(file_)
+    except (FileNotFoundError, ValueError):
+        return None
+    # A snapshot that wasn't closed may have missed the last changes.
+    if data.get('format') != USAGE_FORMAT or not data.get('closed'):
+        return None
+    return {
+        folder: Usage(*counts) for folder, counts in data['folders'].items()
+    }
+
+
+def _write_snapshot(
+    path: str, folders: Dict[str, list], closed: bool = False
+) -> None:
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=folder, prefix='.usage-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file_:
+            json.dump(
+                {'format': USAGE_FORMAT, 'closed': closed, 'folders': folders},
+                file_
+            )
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+class UsageTracker:
+    """
+    This keeps the usage counters of a set's destination. The counters are
+    loaded from the snapshot file the first time `load` is called, if
+    `close` wrote it as the last process shut down, or else from a scan.
+    Changes are written back to the snapshot in the background, with the
+    changes made while a write is running coalesced into the next one.
+    Until it is closed again the snapshot is marked as open, so a crash
+    before a change was written is caught by a scan at the next start.
+
+    Saves in progress reserve the bytes they may write with `reserve`, so
+    concurrent saves can't all fit in the same room under a quota.
+
+    The counters only see the saves and deletes of this process, so when
+    several processes share a destination, call `rebuild` now and then, or
+    give each its own folders.
+
+    Arguments:
+        root: The set's destination.
+        depth: The number of levels of shard folders.
+        executor: The executor to scan and write the snapshot in.
+    """
+    def __init__(
+        self, root: str, depth: int = 0, executor: Optional[Executor] = None
+    ) -> None:
+        self.root = root
+        self.depth = depth
+        self.executor = executor
+        self.folders: Dict[str, Usage] = {}
+        self.total = Usage()
+        self.pending: Dict[str, int] = {}
+        self.pending_total = 0
+        self._loading: Optional[asyncio.Future[None]] = None
+        self._writer: Optional[asyncio.Future[None]] = None
+        self._dirty = False
+
+    @property
+    def path(self) -> str:
+        """
+        The path of the snapshot file.
+        """
+        return os.path.join(self.root, USAGE_FILE)
+
+    async def load(self) -> None:
+        """
+        Loads the counters, unless they are loaded already. Concurrent
+        calls share one load, and a load that failed is tried again.
+        """
+        loading = self._loading
+        if loading is None or (loading.done() and (
+            loading.cancelled() or loading.exception() is not None
+        )):
+            loading = self._loading = asyncio.ensure_future(self._load())
+        await asyncio.shield(loading)
+
+    async def _load(self) -> None:
+        folders = await run_blocking(self.executor, _read_snapshot, self.path)
+        if folders is None:
+            await self._scan()
+        else:
+            self._set(folders)
+            # Marks the snapshot as open.
+            self._changed()
+
+    async def rebuild(self) -> None:
+        """
+        Counts the files again with a scan of the destination, replacing
+        the counters and the snapshot.
+        """
+        loading = self._loading = asyncio.ensure_future(self._scan())
+        await asyncio.shield(loading)
+
+    async def _scan(self) -> None:
+        self._set(await run_blocking(
+            self.executor, scan_usage, self.root, self.depth
+        ))
+        self._changed()
+
+    def _set(self, folders: Dict[str, Usage]) -> None:
+        self.folders = folders
+        self.total = Usage(
+            sum(usage.bytes for usage in folders.values()),
+            sum(usage.files for usage in folders.values())
+        )
+
+    def get(self, folder: Optional[str] = None) -> Usage:
+        """
+        Returns the usage of a folder, or of the whole set if it is `None`.
+
+        Arguments:
+            folder: The folder, as passed to `UploadSet.save`.
+        """
+        if folder is None:
+            return Usage(self.total.bytes, self.total.files)
+        usage = self.folders.get(folder.strip('/'), Usage())
+        return Usage(usage.bytes, usage.files)
+
+    def add(self, folder: Optional[str], size: int, files: int = 1) -> None:
+        """
+        Counts a file saved to the folder. Negative values count a
+        deleted file.
+
+        Arguments:
+            folder: The folder, as passed to `UploadSet.save`.
+            size: The size of the file, in bytes.
+            files: The number of files.
+        """
+        usage = self.folders.setdefault((folder or '').strip('/'), Usage())
+        usage.bytes += size
+        usage.files += files
+        self.total.bytes += size
+        self.total.files += files
+        self._changed()
+
+    def used(self, folder: Optional[str] = None) -> int:
+        """
+        Returns the bytes a folder, or the whole set if it is `None`, holds
+        and has reserved for saves in progress.
+
+        Arguments:
+            folder: The folder, as passed to `UploadSet.save`.
+        """
+        if folder is None:
+            return self.total.bytes + self.pending_total
+        folder = folder.strip('/')
+        return self.get(folder).bytes + self.pending.get(folder, 0)
+
+    def reserve(self, folder: Optional[str], size: int) -> None:
+        """
+        Reserves room for a save in progress, until it is released with a
+        negative size once the file is counted or the save failed.
+
+        Arguments:
+            folder: The folder, as passed to `UploadSet.save`.
+            size: The number of bytes to reserve.
+        """
+        folder = (folder or '').strip('/')
+        pending = self.pending.get(folder, 0) + size
+        if pending:
+            self.pending[folder] = pending
+        else:
+            self.pending.pop(folder, None)
+        self.pending_total += size
+
+    def _changed(self) -> None:
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.ensure_future(self._write())
+            self._writer.add_done_callback(self._written)
+        else:
+            self._dirty = True
+
+    def _written(self, writer: asyncio.Future[None]) -> None:
+        if not writer.cancelled() and writer.exception() is not None:
+            logger.error(
+                "Couldn't write the usage snapshot %s",
+                self.path,
+                exc_info=writer.exception()
+            )
+
+    async def _write(self, closed: bool = False) -> None:
+        while True:
+            self._dirty = False
+            folders = {
+                folder: [usage.bytes, usage.files]
+                for folder, usage in self.folders.items() if usage.files
+            }
+            await run_blocking(
+                self.executor, _write_snapshot, self.path, folders, closed
+            )
+            if not self._dirty:
+                return
+
+    async def flush(self) -> None:
+        """
+        Waits for the changes so far to be written to the snapshot.
+        """
+        if self._writer is not None:
+            await self._writer
+
+    async def close(self) -> None:
+        """
+        Writes the counters to the snapshot marked as closed, so the next
+        start can load them instead of scanning. Call it once nothing is
+        saved or deleted any more, i.e. as the app shuts down.
+        """
+        loading = self._loading
+        if loading is None or not loading.done() or loading.cancelled() or \
+                loading.exception() is not None:
+            return
+        with contextlib.suppress(Exception):
+            # Already logged, and written again below.
+            await self.flush()
+        await self._write(closed=True)
+
+
+class Reservation:
+    """
+    This reserves room for a save whose size isn't known up front as its
+    bytes are read, so it only holds the room it has used. It is updated
+    with each chunk like a `hashlib` object, and raises `QuotaExceeded` as
+    soon as a chunk doesn't fit in the room left.
+
+    Arguments:
+        tracker: The set's usage counters.
+        folder: The folder, as passed to `UploadSet.save`.
+        room: Returns the room left under the set's quotas, or `None` if
+              there is no quota.
+    """
+    def __init__(
+        self,
+        tracker: UsageTracker,
+        folder: Optional[str],
+        room: Callable[[], Optional[int]]
+    ) -> None:
+        self.tracker = tracker
+        self.folder = folder
+        self.room = room
+        self.size = 0
+
+    def update(self, data: bytes) -> None:
+        room = self.room()
+        if room is not None and len(data) > room:
+            raise QuotaExceeded()
+        self.tracker.reserve(self.folder, len(data))
+        self.size += len(data)
+
+    def release(self) -> None:
+        """
+        Releases the room reserved so far.
+        """
+        self.tracker.reserve(self.folder, -self.size)
+        self.size = 0
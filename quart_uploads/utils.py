@@ -1,12 +1,29 @@
 """
 quart_uploads.utils
 """
+from __future__ import annotations
 import asyncio
+import contextlib
+import functools
+import hashlib
 import os
-from typing import Any, IO
+import posixpath
+import tempfile
+import uuid
+from typing import Any, IO, Tuple, cast
 
+from quart import Quart, current_app
 from quart.datastructures import FileStorage
 from werkzeug.datastructures import Headers
+from werkzeug.local import LocalProxy
+
+
+def current_app_object() -> Quart:
+    """
+    Returns the app `current_app` stands for, rather than the proxy, so it
+    can key a cache or be compared with another app.
+    """
+    return cast(LocalProxy, current_app)._get_current_object()
 
 
 def extension(filename: str) -> str:
@@ -56,6 +73,122 @@ def addslash(url: str) -> str:
     return url + '/'
 
 
+def create_exclusive(path: str) -> None:
+    """
+    Creates an empty file at the path, failing with `FileExistsError` if
+    anything already exists there. The check and the create happen in a
+    single ``O_CREAT | O_EXCL`` open, so it is atomic across processes.
+
+    Arguments:
+        path: The path of the file to create.
+    """
+    fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+    os.close(fd)
+
+
+def _read_umask() -> int:
+    try:
+        with open('/proc/self/status', encoding='ascii') as status:
+            for line in status:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    # Without procfs, let the kernel apply the umask to a probe file, as
+    # setting the umask to read it would race with other threads.
+    probe = os.path.join(tempfile.gettempdir(), f'.umask-{uuid.uuid4().hex}')
+    fd = os.open(probe, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o777)
+    try:
+        return 0o777 & ~os.fstat(fd).st_mode
+    finally:
+        os.close(fd)
+        os.remove(probe)
+
+
+@functools.lru_cache(maxsize=None)
+def file_mode() -> int:
+    """
+    Returns the mode a file created normally gets under the process's
+    umask, i.e. ``0o644``. Files made with `tempfile.mkstemp` are private,
+    so they are given this mode before they are moved into place, where a
+    front server running as another user may have to read them.
+    """
+    return 0o666 & ~_read_umask()
+
+
+def make_temp(**kwargs: Any) -> Tuple[int, str]:
+    """
+    Creates a temporary file like `tempfile.mkstemp`, which takes the same
+    arguments, but gives it the mode of a normally created file, see
+    `file_mode`, so it can be moved into place as it is. Returns the open
+    descriptor and the path.
+    """
+    fd, temp = tempfile.mkstemp(**kwargs)
+    try:
+        os.fchmod(fd, file_mode())
+    except BaseException:
+        os.close(fd)
+        os.remove(temp)
+        raise
+    return fd, temp
+
+
+def shard_path(filename: str, depth: int) -> str:
+    """
+    Returns the filename with `depth` levels of folders inserted before
+    its basename, each named with two hex characters of a hash of the
+    basename, i.e. ``photos/3f/a2/cat.jpg`` for ``photos/cat.jpg`` with a
+    depth of 2. As the folders only depend on the name, the path of a file
+    can always be found again from its name. A depth of 0 returns the
+    filename unchanged.
+
+    Arguments:
+        filename: The name of the file, optionally with a folder.
+        depth: The number of folder levels.
+    """
+    if depth <= 0:
+        return filename
+    folder, name = posixpath.split(filename)
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    shards = [digest[level * 2:level * 2 + 2] for level in range(depth)]
+    return posixpath.join(folder, *shards, name)
+
+
+#: The extended attribute the SHA-256 digest of a saved file is kept in.
+DIGEST_XATTR = 'user.quart_uploads.sha256'
+
+
+def set_stored_digest(path: str, digest: str) -> None:
+    """
+    Stores the SHA-256 hex digest of a file in an extended attribute on
+    it, where the filesystem supports that. It is used for content based
+    ETags.
+
+    Arguments:
+        path: The path of the file.
+        digest: The hex digest of the file's content.
+    """
+    if hasattr(os, 'setxattr'):
+        with contextlib.suppress(OSError):
+            os.setxattr(path, DIGEST_XATTR, digest.encode())
+
+
+def get_stored_digest(path: str) -> str | None:
+    """
+    Returns the SHA-256 hex digest stored on a file by `set_stored_digest`,
+    or `None` if there isn't one.
+
+    Arguments:
+        path: The path of the file.
+    """
+    if not hasattr(os, 'getxattr'):
+        return None
+    try:
+        return os.getxattr(path, DIGEST_XATTR).decode()
+    except OSError:
+        return None
+
+
 class TestingFileStorage(FileStorage):
     """
     This is a helper for testing upload behavior in your application. You
@@ -0,0 +1,314 @@
+"""
+quart_uploads.writer
+
+Provides the helpers used to stream an uploaded file to disk.
+"""
+from __future__ import annotations
+import asyncio
+import contextlib
+import hashlib
+import io
+import os
+import tempfile
+from concurrent.futures import Executor
+from typing import (
+    Any,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Dict,
+    IO,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple
+)
+
+import aiofiles
+import aiofiles.os
+
+from .exceptions import UploadTooLarge
+from .executor import run_blocking
+from .utils import make_temp
+from .zerocopy import disk_file
+
+#: Never fsync, leave flushing to the operating system.
+FSYNC_NEVER = 'never'
+#: Fsync every file, and its folder, before the save returns.
+FSYNC_FILE = 'file'
+#: Fsync files from concurrent saves together in one group commit.
+FSYNC_BATCH = 'batch'
+
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_FILE, FSYNC_BATCH)
+
+
+def new_hashers(algorithms: Iterable[str]) -> Dict[str, Any]:
+    """
+    Returns a new `hashlib` object for each algorithm, keyed by name. An
+    unknown algorithm raises a `ValueError` before anything is written.
+
+    Arguments:
+        algorithms: The names of the hash algorithms, i.e. ``sha256``.
+    """
+    return {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+
+
+def stream_size(stream: IO[bytes]) -> Optional[int]:
+    """
+    Returns the number of bytes left in the stream if that can be found
+    without reading it, i.e. for an in-memory or disk-backed stream, or
+    `None` otherwise.
+
+    Arguments:
+        stream: The stream to measure.
+    """
+    if isinstance(stream, tempfile.SpooledTemporaryFile):
+        # Until it rolls over to disk, its bytes are in a `BytesIO`.
+        stream = stream._file
+    if isinstance(stream, io.BytesIO):
+        return stream.getbuffer().nbytes - stream.tell()
+    found = disk_file(stream)
+    if found is None:
+        return None
+    return os.fstat(found[1]).st_size - stream.tell()
+
+
+class HashingReader(io.RawIOBase, BinaryIO):
+    """
+    This wraps a stream and updates each hasher with every chunk read from
+    it, counting the bytes as they pass. It is used to hash a file that is
+    handed to code that reads the stream itself, such as a storage backend,
+    so it is a readable binary stream itself.
+
+    Arguments:
+        stream: The stream to read from.
+        hashers: The `hashlib` objects to update.
+        max_size: If given, reading more bytes than this raises
+                  `UploadTooLarge`.
+    """
+    def __init__(
+        self,
+        stream: IO[bytes],
+        hashers: Iterable[Any] = (),
+        max_size: Optional[int] = None
+    ) -> None:
+        super().__init__()
+        self.stream = stream
+        self.hashers = tuple(hashers)
+        self.max_size = max_size
+        self.size = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        data = self.stream.read(-1 if size is None else size)
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise UploadTooLarge()
+        for hasher in self.hashers:
+            hasher.update(data)
+        return data
+
+
+async def write_stream(
+    stream: IO[bytes],
+    target: str,
+    hashers: Iterable[Any] = (),
+    buffer_size: int = 16384,
+    max_size: Optional[int] = None,
+    executor: Optional[Executor] = None
+) -> int:
+    """
+    Copies the stream to the target file in chunks, updating each hasher
+    with every chunk as it is written, and returns the number of bytes
+    written.
+
+    Arguments:
+        stream: The stream to read from.
+        target: The path of the file to write to.
+        hashers: The `hashlib` objects to update.
+        buffer_size: The size of each chunk.
+        max_size: If given, `UploadTooLarge` is raised as soon as more
+                  bytes than this have been read, leaving the partial
+                  file for the caller to remove.
+        executor: The executor to run the file operations in, or `None`
+                  for the event loop's default executor.
+    """
+    hashers = tuple(hashers)
+    size = 0
+    async with aiofiles.open(target, 'wb', executor=executor) as file_:
+        data = stream.read(buffer_size)
+        while data != b"":
+            size += len(data)
+            if max_size is not None and size > max_size:
+                raise UploadTooLarge()
+            for hasher in hashers:
+                hasher.update(data)
+            await file_.write(data)
+            data = stream.read(buffer_size)
+    return size
+
+
+def fsync_path(path: str) -> None:
+    """
+    Flushes a file, or a folder's entries, to disk. Folders can't be
+    opened for syncing on every platform, so errors doing that are
+    ignored.
+
+    Arguments:
+        path: The path of the file or folder.
+    """
+    if os.path.isdir(path):
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        with contextlib.suppress(OSError):
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def commit_files(
+    pairs: Sequence[Tuple[str, str]], fsync: bool = False
+) -> List[Optional[BaseException]]:
+    """
+    Moves each temporary file onto its target with `os.replace`. With
+    `fsync`, all the files are synced first and each folder is synced once
+    after the moves, so the new names are durable too. Returns the error
+    for each pair, or `None` if it was committed.
+
+    Arguments:
+        pairs: The ``(temp, target)`` paths to commit.
+        fsync: Whether to sync the files and folders to disk.
+    """
+    errors: List[Optional[BaseException]] = [None] * len(pairs)
+    folders: Set[str] = set()
+    for index, (temp, target) in enumerate(pairs):
+        try:
+            if fsync:
+                fsync_path(temp)
+            os.replace(temp, target)
+            folders.add(os.path.dirname(target))
+        except OSError as error:
+            errors[index] = error
+    if fsync:
+        for folder in folders:
+            fsync_path(folder)
+    return errors
+
+
+class GroupCommit:
+    """
+    This collects the files finished by concurrent saves and commits them
+    together in a single worker thread call, syncing each folder once for
+    the whole group rather than once per file.
+
+    Arguments:
+        delay: How long, in seconds, to wait for more files to join a group
+               after the first one arrives.
+    """
+    def __init__(self, delay: float = 0.002) -> None:
+        self.delay = delay
+        self._pending: List[Tuple[str, str, asyncio.Future]] = []
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def commit(
+        self,
+        temp: str,
+        target: str,
+        executor: Optional[Executor] = None
+    ) -> None:
+        """
+        Waits until the temporary file has been synced and moved onto the
+        target with the rest of its group.
+
+        Arguments:
+            temp: The path of the finished temporary file.
+            target: The path to move it to.
+            executor: The executor to commit the group in, taken from the
+                      file that starts the group.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((temp, target, future))
+        if len(self._pending) == 1:
+            task = asyncio.create_task(self._flush(executor))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        await future
+
+    async def _flush(self, executor: Optional[Executor]) -> None:
+        await asyncio.sleep(self.delay)
+        group, self._pending = self._pending, []
+        try:
+            errors = await run_blocking(
+                executor,
+                commit_files,
+                [(temp, target) for temp, target, _ in group],
+                True
+            )
+        except BaseException as error:
+            errors = [error] * len(group)
+        for (_, _, future), error in zip(group, errors):
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+
+async def write_atomic(
+    write: Callable[[str], Awaitable[int]],
+    target: str,
+    fsync: str = FSYNC_NEVER,
+    group: Optional[GroupCommit] = None,
+    executor: Optional[Executor] = None
+) -> int:
+    """
+    Writes a file to a temporary file in the target's folder with `write`,
+    then moves it onto the target with `os.replace`, so readers only ever
+    see the complete file. If the write fails or is cancelled, the
+    temporary file is removed and the target is left alone. Returns what
+    `write` returned.
+
+    Arguments:
+        write: A coroutine function writing the file to the path given.
+        target: The path of the file.
+        fsync: The fsync policy, one of `FSYNC_POLICIES`.
+        group: The `GroupCommit` to use for the ``batch`` policy.
+        executor: The executor to run the file operations in.
+    """
+    folder, name = os.path.split(target)
+    fd, temp = await run_blocking(
+        executor,
+        make_temp,
+        dir=folder,
+        prefix=f'.{name}.',
+        suffix='.part'
+    )
+    os.close(fd)
+    try:
+        size = await write(temp)
+        if fsync == FSYNC_BATCH and group is not None:
+            await group.commit(temp, target, executor)
+        else:
+            error = (await run_blocking(
+                executor, commit_files, [(temp, target)], fsync != FSYNC_NEVER
+            ))[0]
+            if error is not None:
+                raise error
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            await aiofiles.os.remove(temp, executor=executor)
+        raise
+    return size
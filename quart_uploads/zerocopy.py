@@ -0,0 +1,148 @@
+"""
+quart_uploads.zerocopy
+
+Provides the helpers used to move an upload that has already been spooled
+to a file on disk into its destination without passing the bytes through
+Python buffers.
+"""
+from __future__ import annotations
+import contextlib
+import io
+import os
+import tempfile
+import uuid
+from typing import Any, IO, Optional, Tuple
+
+from .utils import file_mode
+
+
+def disk_file(stream: IO[bytes]) -> Optional[Tuple[Any, int]]:
+    """
+    Returns the underlying file object and its descriptor if the stream is
+    backed by a file on disk, or `None` if it is held in memory.
+
+    Arguments:
+        stream: The upload's stream.
+    """
+    if isinstance(stream, tempfile.SpooledTemporaryFile):
+        # Until it rolls over to disk, its bytes are in a `BytesIO`.
+        if isinstance(stream._file, io.BytesIO):
+            return None
+        stream = stream._file
+    try:
+        fd = stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    if not isinstance(fd, int):
+        return None
+    return stream, fd
+
+
+def owned_file(stream: IO[bytes]) -> Optional[Tuple[Any, int]]:
+    """
+    Returns the underlying file object and its descriptor if the stream is
+    a temporary file the upload owns, i.e. a `SpooledTemporaryFile` that
+    was rolled over to disk or a `NamedTemporaryFile`, which can be linked
+    into place. Any other file may be someone else's, so it is only copied.
+
+    Arguments:
+        stream: The upload's stream.
+    """
+    if isinstance(stream, tempfile.SpooledTemporaryFile):
+        return disk_file(stream)
+    if isinstance(stream, tempfile._TemporaryFileWrapper):
+        return disk_file(stream.file)
+    return None
+
+
+def _link(source: str, target: str) -> None:
+    """
+    Hardlinks the source to the target, replacing the target if it exists.
+    """
+    folder, name = os.path.split(target)
+    temp = os.path.join(folder, f'.{name}.{uuid.uuid4().hex}.link')
+    os.link(source, temp)
+    try:
+        os.replace(temp, target)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp)
+        raise
+
+
+def _copy_range(src: int, dst: int, offset: int, count: int) -> None:
+    """
+    Copies `count` bytes from `offset` in `src` to `dst` in the kernel,
+    with `os.copy_file_range` where the filesystems support it and
+    `os.sendfile` otherwise.
+    """
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    while count > 0:
+        if copy_file_range is not None:
+            try:
+                copied = copy_file_range(src, dst, count, offset)
+            except OSError:
+                # i.e. EXDEV on older kernels, or an unsupported filesystem.
+                copy_file_range = None
+                continue
+        else:
+            copied = os.sendfile(dst, src, offset, count)
+        if copied == 0:
+            raise OSError("Unexpected end of file while copying")
+        offset += copied
+        count -= copied
+
+
+def move_stream(stream: IO[bytes], target: str) -> Optional[int]:
+    """
+    Moves a disk-backed upload to the target path without reading it into
+    Python, and returns the number of bytes moved. A temporary file the
+    upload owns, see `owned_file`, is hardlinked if it is on the same
+    filesystem, named or anonymous (``O_TMPFILE``) on Linux, after giving
+    it the usual mode. Anything else on disk is copied with
+    `os.copy_file_range` or `os.sendfile`. If the stream is held in memory
+    or none of these work, `None` is returned, at most an empty file is
+    left at the target and the stream is untouched, so it can be saved
+    normally. This blocks, so run it in a thread from async code.
+
+    Arguments:
+        stream: The upload's stream.
+        target: The path to move the file to.
+    """
+    found = disk_file(stream)
+    if found is None:
+        return None
+    file_, fd = found
+
+    offset = stream.tell()
+    size = os.fstat(fd).st_size - offset
+
+    if offset == 0 and owned_file(stream) is not None:
+        name = getattr(file_, 'name', None)
+        sources = [f'/proc/self/fd/{fd}']
+        if isinstance(name, str) and os.path.isfile(name):
+            sources.insert(0, name)
+        # Temporary files are private, give the upload the usual mode. The
+        # inode is only the upload's, so nobody else's file changes.
+        os.fchmod(fd, file_mode())
+        for source in sources:
+            try:
+                _link(source, target)
+            except OSError:
+                continue
+            stream.seek(0, os.SEEK_END)
+            return size
+
+    if not hasattr(os, 'sendfile'):
+        return None
+
+    dst = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        _copy_range(fd, dst, offset, size)
+    except OSError:
+        os.ftruncate(dst, 0)
+        return None
+    finally:
+        os.close(dst)
+    stream.seek(0, os.SEEK_END)
+    return size
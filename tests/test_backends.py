@@ -0,0 +1,140 @@
+"""
+tests.test_backends
+"""
+import io
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict
+import pytest
+from quart import Quart
+from quart.datastructures import FileStorage
+from quart_uploads import (
+    LocalBackend,
+    MemoryBackend,
+    S3Backend,
+    UploadConfig,
+    UploadSet,
+    configure_uploads
+)
+
+
+class MissingKey(Exception):
+    """
+    The error the stand-in S3 client raises for a missing key.
+    """
+    response = {'Error': {'Code': 'NoSuchKey'}}
+
+
+class StandInS3Client:
+    """
+    A local stand-in for a ``boto3`` S3 client.
+    """
+    def __init__(self) -> None:
+        self.objects: Dict[str, bytes] = {}
+
+    def upload_fileobj(self, fileobj: Any, bucket: str, key: str) -> None:
+        self.objects[f'{bucket}/{key}'] = fileobj.read()
+
+    def get_object(self, Bucket: str, Key: str) -> Dict[str, Any]:
+        return {'Body': io.BytesIO(self._get(Bucket, Key))}
+
+    def head_object(self, Bucket: str, Key: str) -> Dict[str, Any]:
+        return {
+            'ContentLength': len(self._get(Bucket, Key)),
+            'LastModified': datetime(2024, 1, 1, tzinfo=timezone.utc)
+        }
+
+    def delete_object(self, Bucket: str, Key: str) -> None:
+        self.objects.pop(f'{Bucket}/{Key}', None)
+
+    def _get(self, bucket: str, key: str) -> bytes:
+        try:
+            return self.objects[f'{bucket}/{key}']
+        except KeyError:
+            raise MissingKey() from None
+
+
+@pytest.mark.parametrize('make_backend', [
+    lambda tmp_path: LocalBackend(str(tmp_path)),
+    lambda tmp_path: MemoryBackend(),
+    lambda tmp_path: S3Backend('bucket', StandInS3Client(), prefix='files/'),
+])
+@pytest.mark.asyncio
+async def test_backend(tmp_path: Path, make_backend: Any) -> None:
+    """
+    Tests the operations of each backend.
+    """
+    backend = make_backend(tmp_path)
+    data = b"Some foo text." * 2000
+
+    assert await backend.save('someguy/foo.txt', io.BytesIO(data)) == len(data)
+    assert await backend.exists('someguy/foo.txt')
+    assert not await backend.exists('someguy/bar.txt')
+    assert (await backend.stat('someguy/foo.txt')).size == len(data)
+    assert b"".join(
+        [chunk async for chunk in backend.open('someguy/foo.txt', 4096)]
+    ) == data
+
+    with pytest.raises(FileNotFoundError):
+        await backend.stat('someguy/bar.txt')
+
+    await backend.delete('someguy/foo.txt')
+    assert not await backend.exists('someguy/foo.txt')
+
+
+@pytest.mark.asyncio
+async def test_save_to_backend() -> None:
+    """
+    Tests saving files to a set using a backend.
+    """
+    backend = MemoryBackend()
+    uset = UploadSet('files')
+    uset._config = UploadConfig('', backend=backend)
+
+    data = b"Some foo text."
+    res1 = await uset.save(
+        FileStorage(io.BytesIO(data), filename='foo.txt'), folder='someguy'
+    )
+    res2 = await uset.save_with_result(
+        FileStorage(io.BytesIO(data), filename='foo.txt'), folder='someguy'
+    )
+
+    assert res1 == 'someguy/foo.txt'
+    assert res2.name == 'someguy/foo_1.txt'
+    assert res2.size == len(data)
+    assert backend.files['someguy/foo_1.txt'][0] == data
+    assert uset.backend is backend
+
+
+@pytest.mark.asyncio
+async def test_serve_from_backend() -> None:
+    """
+    Tests serving files from a backend with the uploads route.
+    """
+    backend = MemoryBackend()
+    app = Quart(__name__)
+    app.config.update(UPLOADED_FILES_BACKEND=backend)
+
+    uset = UploadSet('files')
+    configure_uploads(app, uset)
+    await backend.save('foo.txt', io.BytesIO(b"Some foo text."))
+
+    client = app.test_client()
+    response = await client.get('/_uploads/files/foo.txt')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert await response.get_data() == b"Some foo text."
+
+    response = await client.get('/_uploads/files/bar.txt')
+    assert response.status_code == 404
+
+
+def test_backend_config() -> None:
+    """
+    Tests that the backend setting must be a backend.
+    """
+    app = Quart(__name__)
+    app.config.update(UPLOADED_FILES_BACKEND='s3')
+
+    with pytest.raises(TypeError):
+        configure_uploads(app, UploadSet('files'))
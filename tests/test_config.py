@@ -1,7 +1,9 @@
 """
 tests.test_config
 """
+import gc
 import os
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 from quart import Quart
 from quart_uploads import configure_uploads, UploadConfig, UploadSet, Uploads
@@ -163,3 +165,116 @@ def test_default_dest_callables(app: Quart) -> None:
     assert photos_conf == UploadConfig(
         '/mnt/photos/', 'http://localhost:6002/'
         )
+
+
+def test_reserve(app: Quart) -> None:
+    """
+    Tests the reserve setting.
+    """
+    files = UploadSet('files')
+
+    set_config = configure(
+        app,
+        files,
+        UPLOADED_FILES_DEST='/var/files',
+        UPLOADED_FILES_RESERVE=True
+    )
+
+    assert set_config['files'] == UploadConfig('/var/files', reserve=True)
+    assert set_config['files'] != UploadConfig('/var/files')
+
+
+def test_fsync(app: Quart) -> None:
+    """
+    Tests the atomic and fsync settings.
+    """
+    files = UploadSet('files')
+
+    set_config = configure(
+        app,
+        files,
+        UPLOADED_FILES_DEST='/var/files',
+        UPLOADED_FILES_ATOMIC=True,
+        UPLOADED_FILES_FSYNC='batch'
+    )
+    assert set_config['files'] == UploadConfig(
+        '/var/files', atomic=True, fsync='batch'
+    )
+
+    app.config['UPLOADED_FILES_FSYNC'] = 'sometimes'
+    with pytest.raises(ValueError):
+        configure_uploads(app, files)
+
+
+@pytest.mark.asyncio
+async def test_multiple_apps() -> None:
+    """
+    Tests a set shared by several apps uses each app's configuration.
+    """
+    files = UploadSet('files')
+    app1, app2 = Quart(__name__), Quart(__name__)
+    configure(app1, files, UPLOADED_FILES_DEST='/var/one')
+    configure(app2, files, UPLOADED_FILES_DEST='/var/two')
+
+    async with app1.app_context():
+        assert files.config.destination == '/var/one'
+    async with app2.app_context():
+        assert files.config.destination == '/var/two'
+    async with app1.app_context():
+        assert files.config.destination == '/var/one'
+
+    configure(app1, files, UPLOADED_FILES_DEST='/var/three')
+    async with app1.app_context():
+        assert files.config.destination == '/var/three'
+
+    del app2
+    gc.collect()
+    assert len(files._configs) == 1
+
+
+def test_executor(app: Quart) -> None:
+    """
+    Tests the shared and per-set executors.
+    """
+    shared, own = ThreadPoolExecutor(1), ThreadPoolExecutor(1)
+    files, photos = UploadSet('files'), UploadSet('photos')
+    app.config.update(
+        UPLOADS_DEFAULT_DEST='/var/uploads',
+        UPLOADED_PHOTOS_EXECUTOR=own,
+        UPLOADED_PHOTOS_MAX_WRITES=2
+    )
+    configure_uploads(app, (files, photos), executor=shared)
+    uploads = app.extensions['uploads']
+    assert uploads['files'].executor is shared
+    assert uploads['files'].max_writes is None
+    assert uploads['photos'].executor is own
+    assert uploads['photos'].max_writes == 2
+
+    app.config['UPLOADED_FILES_EXECUTOR'] = 4
+    with pytest.raises(TypeError):
+        configure_uploads(app, files)
+    app.config['UPLOADED_FILES_EXECUTOR'] = None
+    app.config['UPLOADED_FILES_MAX_WRITES'] = 0
+    with pytest.raises(ValueError):
+        configure_uploads(app, files)
+
+    shared.shutdown()
+    own.shutdown()
+
+
+def test_compress(app: Quart) -> None:
+    """
+    Tests the precompression settings.
+    """
+    files = UploadSet('files')
+    app.config.update(
+        UPLOADED_FILES_DEST='/var/files', UPLOADED_FILES_COMPRESS=['gzip']
+    )
+    configure_uploads(app, files)
+    config = app.extensions['uploads']['files']
+    assert config.compress == ('gzip',)
+    assert not config.compress_on_save
+
+    app.config['UPLOADED_FILES_COMPRESS'] = ['deflate']
+    with pytest.raises(ValueError):
+        configure_uploads(app, files)
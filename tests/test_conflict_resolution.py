@@ -1,8 +1,11 @@
 """
 tests.test_conflict_resolution
 """
+import asyncio
 import os
 from pathlib import Path
+from typing import Any
+import aiofiles.os
 import pytest
 from quart_uploads import UploadConfig, UploadSet, TestingFileStorage, ALL
 
@@ -80,3 +83,127 @@ async def test_conflict_without_extension(tmp_path) -> None:
     res = await uset.save(tfs)
 
     assert res == 'foo_1'
+
+
+@pytest.mark.asyncio
+async def test_conflict_index(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Tests that conflicts are resolved without probing every duplicate.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+    (directory / "foo.txt").write_text("Some foo text.")
+    for n in range(1, 51):
+        (directory / f"foo_{n}.txt").write_text("Some foo text.")
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(directory.absolute().as_posix())
+
+    probes = []
+    exists = aiofiles.os.path.exists
+
+    async def counting_exists(path: str, **kwargs: Any) -> bool:
+        probes.append(path)
+        return await exists(path, **kwargs)
+
+    monkeypatch.setattr(aiofiles.os.path, 'exists', counting_exists)
+
+    res = await uset.resolve_conflict(str(directory), 'foo.txt')
+    assert res == 'foo_51.txt'
+    assert len(probes) == 1
+
+    (directory / "foo_51.txt").write_text("Some foo text.")
+    res = await uset.resolve_conflict(str(directory), 'foo.txt')
+    assert res == 'foo_52.txt'
+    assert len(probes) == 2
+
+
+@pytest.mark.asyncio
+async def test_conflict_index_external_file(tmp_path: Path) -> None:
+    """
+    Tests that names taken after the folder was indexed are skipped.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+    (directory / "foo.txt").write_text("Some foo text.")
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(directory.absolute().as_posix())
+
+    res = await uset.resolve_conflict(str(directory), 'foo.txt')
+    assert res == 'foo_1.txt'
+    (directory / "foo_2.txt").write_text("Some foo text.")
+    res = await uset.resolve_conflict(str(directory), 'foo.txt')
+    assert res == 'foo_3.txt'
+
+
+@pytest.mark.asyncio
+async def test_reserve(tmp_path: Path) -> None:
+    """
+    Tests claiming names with an exclusive create.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+    (directory / "foo.txt").write_text("Some foo text.")
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(directory.absolute().as_posix(), reserve=True)
+
+    results = await asyncio.gather(*(
+        uset.save(TestingFileStorage(filename='foo.txt')) for _ in range(3)
+    ))
+    assert sorted(results) == ['foo_1.txt', 'foo_2.txt', 'foo_3.txt']
+    assert (directory / "foo.txt").read_text() == "Some foo text."
+    for name in results:
+        assert (directory / name).exists()
+
+
+@pytest.mark.asyncio
+async def test_reserve_failed_save(tmp_path: Path) -> None:
+    """
+    Tests that a reservation is removed if the save fails.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+
+    class FailingFileStorage(TestingFileStorage):
+        async def save(self, destination, buffer_size=16384) -> None:
+            raise OSError("disk full")
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(directory.absolute().as_posix(), reserve=True)
+
+    with pytest.raises(OSError):
+        await uset.save(FailingFileStorage(filename='foo.txt'))
+    assert not (directory / "foo.txt").exists()
+
+
+class CustomUploadSet(UploadSet):
+    """
+    An upload set overriding `resolve_conflict` as the docs show.
+    """
+    async def resolve_conflict(self, target_folder: str, basename: str) -> str:
+        return f'custom_{basename}'
+
+
+@pytest.mark.asyncio
+async def test_custom_resolve_conflict(tmp_path: Path) -> None:
+    """
+    Tests that an override of `resolve_conflict` is still called with the
+    folder and basename, including in a batch.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+    (directory / "a.txt").write_text("Some foo text.")
+
+    uset = CustomUploadSet('files')
+    uset._config = UploadConfig(directory.absolute().as_posix())
+    res = await uset.save(TestingFileStorage(filename='a.txt'))
+    assert res == 'custom_a.txt'
+
+    res = await uset.save_many(
+        [TestingFileStorage(filename='a.txt') for _ in range(2)]
+    )
+    assert res == ['custom_a.txt', 'custom_a_1.txt']
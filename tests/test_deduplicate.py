@@ -0,0 +1,67 @@
+"""
+tests.test_deduplicate
+"""
+import io
+import os
+from pathlib import Path
+import pytest
+from quart.datastructures import FileStorage
+from quart_uploads import UploadConfig, UploadSet
+from quart_uploads.utils import file_mode
+
+
+@pytest.mark.asyncio
+async def test_deduplicate(tmp_path: Path) -> None:
+    """
+    Tests that identical uploads share one stored copy.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(
+        directory.absolute().as_posix(), deduplicate=True
+    )
+
+    data = b"Some foo text."
+    res1 = await uset.save(FileStorage(io.BytesIO(data), filename='foo.txt'))
+    res2 = await uset.save(FileStorage(io.BytesIO(data), filename='foo.txt'))
+    res3 = await uset.save(FileStorage(io.BytesIO(b"bar"), filename='bar.txt'))
+
+    assert (res1, res2, res3) == ('foo.txt', 'foo_1.txt', 'bar.txt')
+    assert (directory / res2).read_bytes() == data
+    assert os.path.samefile(directory / res1, directory / res2)
+    assert not os.path.samefile(directory / res1, directory / res3)
+    assert (directory / res1).stat().st_mode & 0o777 == file_mode()
+
+    blobs = [
+        name for _, _, files in os.walk(uset.blobs.root) for name in files
+    ]
+    assert len(blobs) == 2
+
+
+@pytest.mark.asyncio
+async def test_deduplicate_result_and_prune(tmp_path: Path) -> None:
+    """
+    Tests the save result of a deduplicated file and pruning its blob.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(
+        directory.absolute().as_posix(), deduplicate=True
+    )
+
+    storage = FileStorage(io.BytesIO(b"Some foo text."), filename='foo.txt')
+    res = await uset.save_with_result(storage, hashes=('sha256', 'md5'))
+    blob = uset.blobs.blob_path(res.digests['sha256'])
+
+    assert res.size == 14
+    assert set(res.digests) == {'sha256', 'md5'}
+    assert os.path.samefile(blob, directory / 'foo.txt')
+
+    assert uset.blobs.prune() == 0
+    os.remove(directory / 'foo.txt')
+    assert uset.blobs.prune() == 1
+    assert not os.path.exists(blob)
@@ -0,0 +1,252 @@
+"""
+tests.test_expiry
+"""
+import asyncio
+import io
+import logging
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+import pytest
+from quart import Quart
+from quart.datastructures import FileStorage
+from quart_uploads import (
+    MemoryBackend, UploadConfig, UploadSet, Usage, configure_uploads
+)
+from quart_uploads import expiry
+from quart_uploads.utils import shard_path
+
+
+def storage(data: bytes = b"12345", filename: str = 'foo.txt') -> FileStorage:
+    """
+    Returns a storage for the data.
+    """
+    return FileStorage(io.BytesIO(data), filename=filename)
+
+
+@pytest.mark.asyncio
+async def test_set_ttl(tmp_path: Path) -> None:
+    """
+    Tests expiring files by their age, including the files that were there
+    before the scheduler started.
+    """
+    old = tmp_path / shard_path('old.txt', 1)
+    old.parent.mkdir()
+    old.write_bytes(b"old")
+    os.utime(old, (time.time() - 120, time.time() - 120))
+    (tmp_path / '.blobs').mkdir()
+    (tmp_path / '.blobs' / 'blob').write_bytes(b"blob")
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path), ttl=60, shard_depth=1)
+    assert await uset.usage() == Usage(3, 1)
+
+    name = await uset.save(storage(), folder='someguy')
+    assert await uset.expire() == ['old.txt']
+    assert not old.exists()
+    assert await uset.usage() == Usage(5, 1)
+
+    assert await uset.expire(time.time() + 61) == [name]
+    assert await uset.usage() == Usage(0, 0)
+    assert (tmp_path / '.blobs' / 'blob').exists()
+
+
+@pytest.mark.asyncio
+async def test_hardlinked_ttl(tmp_path: Path) -> None:
+    """
+    Tests that a hardlinked file isn't expired by the age of the copy it
+    is linked to when the scheduler restarts.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path), ttl=3600, deduplicate=True)
+    await uset.save(storage(b"same"), name='a.txt')
+    old = time.time() - 7200
+    os.utime(tmp_path / 'a.txt', (old, old))
+    await uset.save(storage(b"same"), name='b.txt')
+    assert os.path.samefile(tmp_path / 'a.txt', tmp_path / 'b.txt')
+
+    other = UploadSet('files')
+    other._config = UploadConfig(str(tmp_path), ttl=3600, deduplicate=True)
+    assert await other.expire() == []
+    assert (tmp_path / 'b.txt').exists()
+
+    # files saved some other way are aged by when they were linked.
+    (tmp_path / 'c.txt').write_bytes(b"c")
+    os.utime(tmp_path / 'c.txt', (old, old))
+    os.link(tmp_path / 'c.txt', tmp_path / 'd.txt')
+    (tmp_path / 'e.txt').write_bytes(b"e")
+    os.utime(tmp_path / 'e.txt', (old, old))
+    third = UploadSet('files')
+    third._config = UploadConfig(str(tmp_path), ttl=3600)
+    assert await third.expire() == ['e.txt']
+
+
+@pytest.mark.asyncio
+async def test_save_ttl(tmp_path: Path) -> None:
+    """
+    Tests giving a save its own time to live, which survives a restart,
+    unless the file is replaced.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path))
+    await uset.save(storage(), ttl=timedelta(minutes=1))
+    await uset.save(storage(filename='bar.txt'), ttl=60)
+    await uset.save(storage(filename='kept.txt'))
+    assert (tmp_path / '.expiry.log').exists()
+
+    # bar.txt is replaced by a file that doesn't expire.
+    (tmp_path / 'bar.txt').write_bytes(b"replaced")
+    os.utime(tmp_path / 'bar.txt', (1, 1))
+
+    other = UploadSet('files')
+    other._config = UploadConfig(str(tmp_path))
+    assert await other.expire() == []
+    assert await other.expire(time.time() + 61) == ['foo.txt']
+    assert sorted(os.listdir(tmp_path)) == [
+        '.expiry.log', 'bar.txt', 'kept.txt'
+    ]
+
+    with pytest.raises(ValueError):
+        await uset.save(storage(), ttl=0)
+    backend = UploadSet('files')
+    backend._config = UploadConfig('', backend=MemoryBackend())
+    with pytest.raises(ValueError):
+        await backend.save(storage(), ttl=60)
+
+
+@pytest.mark.asyncio
+async def test_delete_unschedules(tmp_path: Path) -> None:
+    """
+    Tests that a deleted file, or one saved again without a TTL, isn't
+    expired.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path))
+    assert await uset.expire() == []
+    name = await uset.save(storage(), ttl=60)
+    await uset.delete(name)
+    (tmp_path / name).write_bytes(b"again")
+    assert await uset.expire(time.time() + 61) == []
+    assert (tmp_path / name).exists()
+
+
+@pytest.mark.asyncio
+async def test_expiry_batches(tmp_path: Path) -> None:
+    """
+    Tests that a backlog is deleted in batches.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path), ttl=1)
+    for number in range(5):
+        (tmp_path / f'{number}.txt').write_bytes(b"x")
+    scheduler = uset._expiry_scheduler()
+    scheduler.batch_size = 2
+    scheduler.batch_pause = 0
+    expired = await scheduler.expire(time.time() + 2)
+    assert sorted(expired) == [f'{number}.txt' for number in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_journal_compaction(tmp_path: Path) -> None:
+    """
+    Tests that the journal drops the files that expired.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path), ttl=60)
+    await uset.save(storage(), name='a.txt')
+    await uset.save(storage(), name='b.txt', ttl=3600)
+    journal = tmp_path / '.expiry.log'
+    assert len(journal.read_text().splitlines()) == 2
+
+    scheduler = uset._expiry_scheduler()
+    scheduler.compact_after = 1
+    assert await scheduler.expire(time.time() + 61) == ['a.txt']
+    lines = journal.read_text().splitlines()
+    assert [line.split('\t')[2] for line in lines] == ['b.txt']
+
+
+@pytest.mark.asyncio
+async def test_malformed_journal(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture
+) -> None:
+    """
+    Tests that a line cut short in the journal is skipped, and that a load
+    that failed is logged and tried again.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path))
+    name = await uset.save(storage(), ttl=60)
+    journal = tmp_path / '.expiry.log'
+    with journal.open('a') as file_:
+        file_.write('123.0\t5\n')
+
+    other = UploadSet('files')
+    other._config = UploadConfig(str(tmp_path))
+    scheduler = other._expiry_scheduler()
+    read_journal = expiry.read_journal
+    calls = []
+
+    def failing_read(*args: object) -> object:
+        calls.append(args)
+        if len(calls) == 1:
+            raise OSError("journal unreadable")
+        return read_journal(*args)
+
+    monkeypatch.setattr(expiry, 'read_journal', failing_read)
+    scheduler.max_sleep = 0.01
+    with caplog.at_level(logging.WARNING, 'quart_uploads.expiry'):
+        scheduler.start()
+        for _ in range(100):
+            if len(calls) > 1:
+                break
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+    assert "Couldn't expire files" in caplog.text
+    assert "malformed expiry entry" in caplog.text
+    assert scheduler.deadlines.keys() == {name}
+    assert len(journal.read_text().splitlines()) == 1
+
+
+@pytest.mark.asyncio
+async def test_expiry_lifecycle(tmp_path: Path) -> None:
+    """
+    Tests that the app deletes expired files while it is serving.
+    """
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path),
+        UPLOADED_FILES_TTL=timedelta(hours=1)
+    )
+    files = UploadSet('files')
+    configure_uploads(app, files)
+    assert app.extensions['uploads']['files'].ttl == 3600
+
+    async with app.test_app():
+        async with app.app_context():
+            name = await files.save(storage(), ttl=0.05)
+        scheduler = files._expiry[str(tmp_path)]
+        assert scheduler._task is not None
+        for _ in range(100):
+            if not (tmp_path / name).exists():
+                break
+            await asyncio.sleep(0.01)
+        assert not (tmp_path / name).exists()
+    assert scheduler._task is None
+
+
+def test_ttl_config(tmp_path: Path) -> None:
+    """
+    Tests the TTL setting.
+    """
+    app = Quart(__name__)
+    app.config.update(UPLOADED_FILES_DEST=str(tmp_path), UPLOADED_FILES_TTL=0)
+    with pytest.raises(ValueError):
+        configure_uploads(app, UploadSet('files'))
+
+    app.config.update(
+        UPLOADED_FILES_TTL=60, UPLOADED_FILES_BACKEND=MemoryBackend()
+    )
+    with pytest.raises(ValueError):
+        configure_uploads(app, UploadSet('files'))
@@ -0,0 +1,173 @@
+"""
+tests.test_images
+"""
+import asyncio
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterator, List
+import pytest
+from quart import Quart
+from quart_uploads import (
+    FE, ImageVariant, UploadConfig, UploadSet, configure_uploads
+)
+from quart_uploads import images
+from quart_uploads.utils import file_mode
+
+VARIANTS = {'thumb': ImageVariant(64, 64, 'webp')}
+
+
+@pytest.fixture
+def renders(monkeypatch: pytest.MonkeyPatch) -> List[str]:
+    """
+    Replaces the renderer with one that records its targets, so the tests
+    don't need Pillow.
+    """
+    calls: List[str] = []
+
+    def fake_render(source: str, target: str, spec: ImageVariant) -> None:
+        calls.append(target)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            dst.write(b'thumb:' + src.read())
+
+    monkeypatch.setattr(images, 'render_variant', fake_render)
+    return calls
+
+
+@pytest.fixture
+def pool() -> Iterator[ThreadPoolExecutor]:
+    """
+    A thread pool to render in, in place of the shared process pool.
+    """
+    with ThreadPoolExecutor(2) as executor:
+        yield executor
+
+
+@pytest.mark.asyncio
+async def test_variant(
+    tmp_path: Path, renders: List[str], pool: ThreadPoolExecutor
+) -> None:
+    """
+    Tests that a variant is rendered once and then cached next to the
+    original.
+    """
+    (tmp_path / 'photo.jpg').write_bytes(b'jpeg')
+    uset = UploadSet('photos', FE.Images, variants=VARIANTS)
+    uset._config = UploadConfig(str(tmp_path), image_executor=pool)
+
+    paths = await asyncio.gather(
+        *(uset.variant('photo.jpg', 'thumb') for _ in range(5))
+    )
+    expected = str(tmp_path / '.variants' / 'thumb' / 'photo.jpg.webp')
+    assert set(paths) == {expected}
+    assert renders == [expected]
+    assert Path(expected).read_bytes() == b'thumb:jpeg'
+
+    await uset.variant('photo.jpg', 'thumb')
+    assert len(renders) == 1
+
+    # a newer original makes the cached variant stale.
+    stat = os.stat(expected)
+    os.utime(
+        tmp_path / 'photo.jpg',
+        ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000)
+    )
+    await uset.variant('photo.jpg', 'thumb')
+    assert len(renders) == 2
+
+    with pytest.raises(FileNotFoundError):
+        await uset.variant('missing.jpg', 'thumb')
+    with pytest.raises(ValueError):
+        await uset.variant('photo.jpg', 'huge')
+
+
+@pytest.mark.asyncio
+async def test_variant_sharded(
+    tmp_path: Path, renders: List[str], pool: ThreadPoolExecutor
+) -> None:
+    """
+    Tests that a sharded set's variants sit in the original's shard.
+    """
+    uset = UploadSet('photos', FE.Images, variants=VARIANTS)
+    uset._config = UploadConfig(
+        str(tmp_path), shard_depth=1, image_executor=pool
+    )
+    original = Path(uset.path('photo.jpg'))
+    original.parent.mkdir()
+    original.write_bytes(b'jpeg')
+
+    path = await uset.variant('photo.jpg', 'thumb')
+    assert path == str(
+        original.parent / '.variants' / 'thumb' / 'photo.jpg.webp'
+    )
+
+
+@pytest.mark.asyncio
+async def test_variant_route(
+    tmp_path: Path, renders: List[str], pool: ThreadPoolExecutor
+) -> None:
+    """
+    Tests serving variants through the uploads route.
+    """
+    (tmp_path / 'photo.jpg').write_bytes(b'jpeg')
+    app = Quart(__name__)
+    app.config['UPLOADED_PHOTOS_DEST'] = str(tmp_path)
+    uset = UploadSet('photos', FE.Images, variants=VARIANTS)
+    configure_uploads(app, uset, image_executor=pool)
+
+    async with app.test_request_context('/'):
+        url = uset.url('photo.jpg', variant='thumb')
+        with pytest.raises(ValueError):
+            uset.url('photo.jpg', variant='huge')
+    assert url.endswith('/_uploads/photos/photo.jpg?variant=thumb')
+
+    client = app.test_client()
+    response = await client.get('/_uploads/photos/photo.jpg?variant=thumb')
+    assert response.status_code == 200
+    assert await response.get_data() == b'thumb:jpeg'
+
+    for path in (
+        '/_uploads/photos/photo.jpg?variant=huge',
+        '/_uploads/photos/missing.jpg?variant=thumb',
+        '/_uploads/photos/.variants?variant=thumb'
+    ):
+        response = await client.get(path)
+        assert response.status_code == 404
+    assert len(renders) == 1
+
+
+def test_variant_url_base_url() -> None:
+    """
+    Tests variant URLs for a set served from elsewhere.
+    """
+    uset = UploadSet('photos', FE.Images, variants=VARIANTS)
+    uset._config = UploadConfig('/uploads', 'https://cdn.example/photos/')
+    assert uset.url('photo.jpg', variant='thumb') == (
+        'https://cdn.example/photos/.variants/thumb/photo.jpg.webp'
+    )
+
+
+def test_render_variant(tmp_path: Path) -> None:
+    """
+    Tests rendering a variant with Pillow.
+    """
+    image_module: Any = pytest.importorskip('PIL.Image')
+    buffer = io.BytesIO()
+    image_module.new('RGBA', (400, 200), (255, 0, 0, 128)).save(
+        buffer, 'PNG'
+    )
+    (tmp_path / 'photo.png').write_bytes(buffer.getvalue())
+    target = tmp_path / '.variants' / 'small' / 'photo.png.jpeg'
+
+    images.render_variant(
+        str(tmp_path / 'photo.png'),
+        str(target),
+        ImageVariant(100, 100, 'jpeg')
+    )
+    with image_module.open(target) as rendered:
+        assert rendered.format == 'JPEG'
+        assert rendered.size == (100, 50)
+    assert os.listdir(target.parent) == ['photo.png.jpeg']
+    assert target.stat().st_mode & 0o777 == file_mode()
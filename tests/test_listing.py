@@ -0,0 +1,148 @@
+"""
+tests.test_listing
+"""
+import io
+from pathlib import Path
+from typing import List
+import pytest
+from quart import Quart
+from quart.datastructures import FileStorage
+from quart_uploads import (
+    MemoryBackend, StoredFile, UploadConfig, UploadSet, configure_uploads
+)
+
+NAMES = [f'file{number:02}.txt' for number in range(25)]
+
+
+async def collect(uset: UploadSet, **kwargs: object) -> List[StoredFile]:
+    """
+    Returns the files listed by `UploadSet.iter_files`.
+    """
+    return [stored async for stored in uset.iter_files(**kwargs)]
+
+
+@pytest.fixture
+def flat(tmp_path: Path) -> UploadSet:
+    """
+    Creates a set with some files, hidden files and a subfolder.
+    """
+    for name in NAMES:
+        (tmp_path / name).write_bytes(name.encode())
+    (tmp_path / '.blobs').mkdir()
+    (tmp_path / '.foo.txt.abc.part').write_bytes(b"partial")
+    (tmp_path / 'someguy').mkdir()
+    (tmp_path / 'someguy' / 'photo.jpg').write_bytes(b"photo")
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path))
+    return uset
+
+
+@pytest.mark.asyncio
+async def test_iter_files(flat: UploadSet, tmp_path: Path) -> None:
+    """
+    Tests listing a folder in pages.
+    """
+    files = await collect(flat, page_size=10)
+    assert [stored.name for stored in files] == NAMES
+    assert files[0].size == len(NAMES[0])
+    assert files[0].mtime == (tmp_path / NAMES[0]).stat().st_mtime
+
+    files = await collect(flat, page_size=7, cursor='file10.txt')
+    assert [stored.name for stored in files] == NAMES[11:]
+
+    files = await collect(flat, prefix='file1')
+    assert [stored.name for stored in files] == NAMES[10:20]
+
+    files = await collect(flat, folder='someguy')
+    assert [stored.name for stored in files] == ['someguy/photo.jpg']
+    assert await collect(flat, folder='nobody') == []
+
+    with pytest.raises(ValueError):
+        await collect(flat, page_size=0)
+
+
+@pytest.mark.asyncio
+async def test_iter_files_sharded(tmp_path: Path) -> None:
+    """
+    Tests that a sharded set is listed by name, without shard folders,
+    and can be resumed from any file.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path), shard_depth=2)
+    for name in NAMES:
+        await uset.save(FileStorage(io.BytesIO(b"x"), filename=name))
+
+    files = await collect(uset, page_size=4)
+    names = [stored.name for stored in files]
+    assert sorted(names) == NAMES
+
+    for index in (0, 11, 24):
+        rest = await collect(uset, page_size=3, cursor=names[index])
+        assert [stored.name for stored in rest] == names[index + 1:]
+
+
+@pytest.mark.asyncio
+async def test_iter_files_backend() -> None:
+    """
+    Tests that backend sets can't be listed.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig('', backend=MemoryBackend())
+    with pytest.raises(RuntimeError):
+        await collect(uset)
+
+
+@pytest.mark.asyncio
+async def test_listing_endpoint(flat: UploadSet, tmp_path: Path) -> None:
+    """
+    Tests paging through the JSON listing.
+    """
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path), UPLOADED_FILES_LISTING=True
+    )
+    configure_uploads(app, flat)
+    client = app.test_client()
+
+    names = []
+    cursor = ''
+    while cursor is not None:
+        response = await client.get(
+            '/_uploads/files/', query_string={'limit': 10, 'cursor': cursor}
+        )
+        assert response.status_code == 200
+        data = await response.get_json()
+        names.extend(item['name'] for item in data['files'])
+        cursor = data['cursor']
+    assert names == NAMES
+
+    response = await client.get(
+        '/_uploads/files/', query_string={'folder': 'someguy'}
+    )
+    data = await response.get_json()
+    assert data['files'][0]['name'] == 'someguy/photo.jpg'
+    assert data['files'][0]['url'].endswith(
+        '/_uploads/files/someguy/photo.jpg'
+    )
+    assert data['cursor'] is None
+    response = await client.get('/_uploads/files/someguy/photo.jpg')
+    assert response.status_code == 200
+    assert await response.get_data() == b"photo"
+
+    for folder in ('..', '.blobs'):
+        response = await client.get(
+            '/_uploads/files/', query_string={'folder': folder}
+        )
+        assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_listing_disabled(tmp_path: Path) -> None:
+    """
+    Tests that the listing is off by default.
+    """
+    app = Quart(__name__)
+    app.config['UPLOADED_FILES_DEST'] = str(tmp_path)
+    configure_uploads(app, UploadSet('files'))
+    response = await app.test_client().get('/_uploads/files/')
+    assert response.status_code == 404
@@ -1,9 +1,14 @@
 """
 test.tests_path_url
 """
+import io
+from pathlib import Path
 import pytest
 from quart import Quart, url_for
-from quart_uploads import UploadConfig, UploadSet, configure_uploads
+from quart_uploads import (
+    ImageVariant, MemoryBackend, UploadConfig, UploadSet, configure_uploads
+)
+from quart_uploads.utils import shard_path
 
 
 def test_path() -> None:
@@ -60,3 +65,92 @@ async def test_url_base() -> None:
         assert url == 'http://localhost:5001/foo.txt'
 
     assert '_uploads' not in app.blueprints
+
+
+def test_sharded_path_url() -> None:
+    """
+    Tests the paths and URLs of a sharded set.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(
+        '/uploads', 'http://localhost:5001/', shard_depth=2
+    )
+    shards = shard_path('foo.txt', 2)
+    assert shards.count('/') == 2 and shards.endswith('/foo.txt')
+
+    assert uset.path('foo.txt') == '/uploads/' + shards
+    assert (uset.path('foo.txt', folder='someguy') ==
+            '/uploads/someguy/' + shards)
+    assert (uset.path('someguy/foo.txt') ==
+            '/uploads/someguy/' + shards)
+    assert uset.url('foo.txt') == 'http://localhost:5001/' + shards
+
+
+@pytest.mark.asyncio
+async def test_urls() -> None:
+    """
+    Tests building many URLs at once from the cached URL prefix.
+    """
+    app = Quart(__name__)
+    app.config.update(UPLOADED_FILES_DEST='/uploads')
+    uset = UploadSet('files', variants={'thumb': ImageVariant(64, 64)})
+    configure_uploads(app, uset)
+    names = ['foo.txt', 'someguy/my photo.jpg', 'a&b+c.txt', 'naïve.txt']
+
+    async with app.test_request_context("/", headers={'Host': 'example.com'}):
+        urls = uset.urls(names)
+        assert urls == [
+            url_for('_uploads.uploaded_file', setname='files',
+                    filename=name, _external=True)
+            for name in names
+        ]
+        assert urls[1] == (
+            'http://example.com/_uploads/files/someguy/my%20photo.jpg'
+        )
+        assert uset.urls(['foo.jpg'], variant='thumb') == [
+            url_for('_uploads.uploaded_file', setname='files',
+                    filename='foo.jpg', variant='thumb', _external=True)
+        ]
+
+    async with app.test_request_context("/", headers={'Host': 'other.org'}):
+        assert uset.url('foo.txt') == 'http://other.org/_uploads/files/foo.txt'
+
+    with pytest.raises(ValueError):
+        uset.urls(names, variant='large')
+
+
+def test_urls_base() -> None:
+    """
+    Tests building many URLs for a set served elsewhere.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig('/uploads', 'http://localhost:5001/')
+    assert uset.urls(['foo.txt', 'my photo.jpg']) == [
+        'http://localhost:5001/foo.txt', 'http://localhost:5001/my%20photo.jpg'
+    ]
+
+
+@pytest.mark.asyncio
+async def test_versioned_urls(tmp_path: Path) -> None:
+    """
+    Tests the cache-busting versions of URLs.
+    """
+    (tmp_path / 'foo.txt').write_bytes(b"foo")
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path), 'http://localhost:5001/')
+
+    foo, missing = await uset.versioned_urls(['foo.txt', 'bar.txt'])
+    assert foo.startswith('http://localhost:5001/foo.txt?v=')
+    assert missing == 'http://localhost:5001/bar.txt'
+
+    (tmp_path / 'foo.txt').write_bytes(b"changed")
+    assert (await uset.versioned_urls(['foo.txt']))[0] != foo
+
+    backend = MemoryBackend()
+    await backend.save('foo.txt', io.BytesIO(b"foo"))
+    uset._config = UploadConfig('', 'http://cdn/', backend=backend)
+    url, missing = await uset.versioned_urls(
+        ['foo.txt', 'bar.txt'], param='h'
+    )
+    assert url.startswith('http://cdn/foo.txt?h=')
+    assert missing == 'http://cdn/bar.txt'
@@ -3,7 +3,9 @@ tests.test_preconditions
 """
 from pathlib import Path
 import pytest
-from quart_uploads import UploadConfig, UploadSet, TestingFileStorage
+from quart_uploads import (
+    AllExcept, FE, UploadConfig, UploadSet, TestingFileStorage
+)
 
 
 def test_filenames() -> None:
@@ -53,3 +55,36 @@ def test_default_extensions() -> None:
 
     for ext, result in ext_pairs:
         assert uset.extension_allowed(ext) is result
+
+
+def test_extension_matcher() -> None:
+    """
+    Tests case-insensitive and multi-part extension matching.
+    """
+    uset = UploadSet('files', extensions=('txt', 'tar.gz'))
+    uset._config = UploadConfig('/uploads', allow=('CSV',), deny=('txt',))
+
+    assert uset.extension_allowed('TAR.GZ') is True
+    assert uset.extension_allowed('csv') is True
+    assert uset.extension_allowed('txt') is False
+    assert uset.file_allowed('backup.tar.gz') is True
+    assert uset.file_allowed('backup.gz') is False
+    assert uset.file_allowed('notes.txt') is False
+
+    uset._config = UploadConfig('/uploads')
+    assert uset.file_allowed('notes.txt') is True
+
+
+def test_extension_matcher_all_except() -> None:
+    """
+    Tests matching with `AllExcept` and large extension lists.
+    """
+    uset = UploadSet('files', extensions=AllExcept(FE.Executables))
+    uset._config = UploadConfig(
+        '/uploads', deny=tuple(f'x{n}' for n in range(500))
+    )
+
+    assert uset.file_allowed('foo.txt') is True
+    assert uset.file_allowed('foo.EXE') is False
+    assert uset.file_allowed('foo.x499') is False
+    assert uset.matcher is uset.matcher
@@ -0,0 +1,246 @@
+"""
+tests.test_resumable
+"""
+import base64
+import os
+import time
+from pathlib import Path
+import pytest
+from quart import Quart
+from quart_uploads import UploadSet, configure_uploads
+from quart_uploads import resumable
+
+DATA = b"Some foo text." * 1000
+
+PATCH_HEADERS = {'Content-Type': 'application/offset+octet-stream'}
+
+
+def metadata(filename: str) -> str:
+    """
+    Encodes the filename for the `Upload-Metadata` header.
+    """
+    return 'filename ' + base64.b64encode(filename.encode()).decode()
+
+
+@pytest.fixture
+def app(tmp_path: Path) -> Quart:
+    """
+    Creates a Quart app with resumable uploads.
+    """
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path / 'uploads'),
+        UPLOADS_RESUMABLE=True
+    )
+    configure_uploads(app, UploadSet('files'))
+    return app
+
+
+@pytest.mark.asyncio
+async def test_resumable(app: Quart, tmp_path: Path) -> None:
+    """
+    Tests uploading a file in chunks and resuming after an error.
+    """
+    client = app.test_client()
+    response = await client.post(
+        '/_uploads/resumable/files/',
+        headers={
+            'Upload-Length': str(len(DATA)),
+            'Upload-Metadata': metadata('foo.txt')
+        }
+    )
+    assert response.status_code == 201
+    assert response.headers['Tus-Resumable'] == '1.0.0'
+    location = response.headers['Location']
+
+    response = await client.patch(
+        location, data=DATA[:5000],
+        headers={**PATCH_HEADERS, 'Upload-Offset': '0'}
+    )
+    assert response.status_code == 204
+    assert response.headers['Upload-Offset'] == '5000'
+
+    response = await client.patch(
+        location, data=DATA[:5000],
+        headers={**PATCH_HEADERS, 'Upload-Offset': '0'}
+    )
+    assert response.status_code == 409
+
+    response = await client.head(location)
+    assert response.headers['Upload-Offset'] == '5000'
+    assert response.headers['Upload-Length'] == str(len(DATA))
+
+    response = await client.patch(
+        location, data=DATA[5000:],
+        headers={**PATCH_HEADERS, 'Upload-Offset': '5000'}
+    )
+    assert response.status_code == 204
+    assert response.headers['Upload-Name'] == 'foo.txt'
+    assert (tmp_path / 'uploads' / 'foo.txt').read_bytes() == DATA
+
+    response = await client.head(location)
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_resumable_rejected(app: Quart) -> None:
+    """
+    Tests that disallowed and malformed uploads are rejected.
+    """
+    client = app.test_client()
+    response = await client.post(
+        '/_uploads/resumable/files/',
+        headers={'Upload-Length': '10', 'Upload-Metadata': metadata('x.exe')}
+    )
+    assert response.status_code == 403
+
+    response = await client.post(
+        '/_uploads/resumable/files/',
+        headers={'Upload-Metadata': metadata('foo.txt')}
+    )
+    assert response.status_code == 400
+
+    response = await client.head('/_uploads/resumable/files/../../etc')
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_resumable_delete(app: Quart) -> None:
+    """
+    Tests abandoning an upload.
+    """
+    client = app.test_client()
+    response = await client.post(
+        '/_uploads/resumable/files/',
+        headers={'Upload-Length': '10', 'Upload-Metadata': metadata('a.txt')}
+    )
+    location = response.headers['Location']
+
+    response = await client.patch(
+        location, data=b"x" * 20,
+        headers={**PATCH_HEADERS, 'Upload-Offset': '0'}
+    )
+    assert response.status_code == 400
+
+    response = await client.delete(location)
+    assert response.status_code == 204
+    response = await client.head(location)
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_resumable_locked(app: Quart, tmp_path: Path) -> None:
+    """
+    Tests that an upload another process is writing to is locked.
+    """
+    fcntl = pytest.importorskip('fcntl')
+    client = app.test_client()
+    response = await client.post(
+        '/_uploads/resumable/files/',
+        headers={'Upload-Length': '10', 'Upload-Metadata': metadata('a.txt')}
+    )
+    location = response.headers['Location']
+    upload_id = location.rsplit('/', 1)[1]
+    part = tmp_path / 'uploads' / '.resumable' / f'{upload_id}.part'
+
+    with open(part, 'ab') as other:
+        fcntl.flock(other.fileno(), fcntl.LOCK_EX)
+        other.write(b"x" * 5)
+        response = await client.patch(
+            location, data=b"x" * 5,
+            headers={**PATCH_HEADERS, 'Upload-Offset': '0'}
+        )
+        assert response.status_code == 423
+        response = await client.delete(location)
+        assert response.status_code == 423
+
+    # the offset is checked once the lock is held.
+    response = await client.patch(
+        location, data=b"x" * 5,
+        headers={**PATCH_HEADERS, 'Upload-Offset': '0'}
+    )
+    assert response.status_code == 409
+    response = await client.patch(
+        location, data=b"x" * 5,
+        headers={**PATCH_HEADERS, 'Upload-Offset': '5'}
+    )
+    assert response.headers['Upload-Name'] == 'a.txt'
+    assert (tmp_path / 'uploads' / 'a.txt').read_bytes() == b"x" * 10
+
+
+@pytest.mark.asyncio
+async def test_resumable_stale(
+    app: Quart, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Tests that partial uploads left untouched are removed.
+    """
+    monkeypatch.setattr(resumable, 'SWEEP_INTERVAL', 0)
+    app.config['UPLOADS_RESUMABLE_TTL'] = 3600
+    client = app.test_client()
+    locations = []
+    for _ in range(2):
+        response = await client.post(
+            '/_uploads/resumable/files/',
+            headers={
+                'Upload-Length': '10', 'Upload-Metadata': metadata('a.txt')
+            }
+        )
+        locations.append(response.headers['Location'])
+    folder = tmp_path / 'uploads' / '.resumable'
+    old = time.time() - 7200
+    for path in folder.iterdir():
+        os.utime(path, (old, old))
+    # an upload that was resumed recently is kept.
+    response = await client.patch(
+        locations[1], data=b"x" * 5,
+        headers={**PATCH_HEADERS, 'Upload-Offset': '0'}
+    )
+    assert response.status_code == 204
+
+    await client.post(
+        '/_uploads/resumable/files/',
+        headers={'Upload-Length': '10', 'Upload-Metadata': metadata('b.txt')}
+    )
+    response = await client.head(locations[0])
+    assert response.status_code == 404
+    response = await client.head(locations[1])
+    assert response.headers['Upload-Offset'] == '5'
+    assert len(list(folder.iterdir())) == 4
+
+    # nor is one that is being written to.
+    upload_id = locations[1].rsplit('/', 1)[1]
+    fcntl = pytest.importorskip('fcntl')
+    others = sorted(
+        path.stem for path in folder.glob('*.json') if path.stem != upload_id
+    )
+    with open(folder / f'{upload_id}.part', 'ab') as other:
+        fcntl.flock(other.fileno(), fcntl.LOCK_EX)
+        removed = resumable.remove_stale(str(folder), 0, time.time() + 1)
+    assert removed == others
+    assert sorted(path.name for path in folder.iterdir()) == [
+        f'{upload_id}.json', f'{upload_id}.part'
+    ]
+
+
+@pytest.mark.asyncio
+async def test_resumable_quota(tmp_path: Path) -> None:
+    """
+    Tests that an upload too big for the set's quota is refused up front.
+    """
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path),
+        UPLOADED_FILES_QUOTA=len(DATA) - 1,
+        UPLOADS_RESUMABLE=True
+    )
+    configure_uploads(app, UploadSet('files'))
+
+    response = await app.test_client().post(
+        '/_uploads/resumable/files/',
+        headers={
+            'Upload-Length': str(len(DATA)),
+            'Upload-Metadata': metadata('foo.txt')
+        }
+    )
+    assert response.status_code == 413
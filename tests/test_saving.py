@@ -1,10 +1,27 @@
 """
 testing.test_saving
 """
+import asyncio
+import errno
+import hashlib
+import io
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any
 import pytest
-from quart_uploads import UploadConfig, UploadSet, TestingFileStorage, ALL
+from quart.datastructures import FileStorage
+from quart_uploads import (
+    UploadConfig,
+    UploadResult,
+    UploadSet,
+    UploadNotAllowed,
+    UploadTooLarge,
+    TestingFileStorage,
+    ALL
+)
+from quart_uploads.utils import file_mode
 
 
 @pytest.mark.asyncio
@@ -136,3 +153,405 @@ async def test_secured_filename(tmp_path: Path) -> None:
     res2 = await uset.save(tfs2)
     assert res2 == 'myapp.wsgi'
     assert tfs2.saved == os.path.join(directory, 'myapp.wsgi')
+
+
+@pytest.mark.asyncio
+async def test_save_many(tmp_path: Path) -> None:
+    """
+    Tests saving a batch of files.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+    (directory / "foo.txt").write_text("Some foo text.")
+    dest = directory.absolute().as_posix()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(dest)
+
+    storages = [
+        TestingFileStorage(filename='foo.txt'),
+        TestingFileStorage(filename='warez.exe'),
+        TestingFileStorage(filename='bar.txt'),
+        TestingFileStorage(filename='bar.txt'),
+    ]
+    res = await uset.save_many(storages, folder='someguy', concurrency=2)
+
+    assert res[0] == 'someguy/foo.txt'
+    assert isinstance(res[1], UploadNotAllowed)
+    assert res[2] == 'someguy/bar.txt'
+    assert res[3] == 'someguy/bar_1.txt'
+    assert storages[1].saved is None
+    assert storages[3].saved == os.path.join(directory, 'someguy/bar_1.txt')
+
+
+@pytest.mark.asyncio
+async def test_save_many_conflicts(tmp_path: Path) -> None:
+    """
+    Tests a batch of files conflicting with existing files.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+    (directory / "foo.txt").write_text("Some foo text.")
+    dest = directory.absolute().as_posix()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(dest)
+
+    storages = [TestingFileStorage(filename='foo.txt') for _ in range(3)]
+    res = await uset.save_many(storages)
+    assert res == ['foo_1.txt', 'foo_2.txt', 'foo_3.txt']
+
+
+@pytest.mark.asyncio
+async def test_save_with_result(tmp_path: Path) -> None:
+    """
+    Tests saving a file and hashing it on the way to disk.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+    dest = directory.absolute().as_posix()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(dest)
+
+    data = b"Some foo text." * 5000
+    storage = FileStorage(io.BytesIO(data), filename='foo.txt')
+    res = await uset.save_with_result(
+        storage, folder='someguy', hashes=('sha256', 'md5')
+    )
+
+    assert res == UploadResult(
+        'someguy/foo.txt',
+        len(data),
+        {
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'md5': hashlib.md5(data).hexdigest()
+        }
+    )
+    assert (directory / 'someguy' / 'foo.txt').read_bytes() == data
+
+
+@pytest.mark.asyncio
+async def test_save_with_result_unknown_hash(tmp_path: Path) -> None:
+    """
+    Tests that an unknown hash algorithm fails before writing.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(directory.absolute().as_posix())
+
+    storage = FileStorage(io.BytesIO(b"foo"), filename='foo.txt')
+    with pytest.raises(ValueError):
+        await uset.save_with_result(storage, hashes=('nope',))
+    assert not (directory / 'foo.txt').exists()
+
+
+class BrokenStream(io.BytesIO):
+    """
+    A stream that fails after the first chunk.
+    """
+    def read(self, size: int = -1) -> bytes:
+        if self.tell() > 0:
+            raise OSError("connection lost")
+        return super().read(size)
+
+
+@pytest.mark.parametrize('fsync', ['never', 'file', 'batch'])
+@pytest.mark.asyncio
+async def test_save_atomic(tmp_path: Path, fsync: str) -> None:
+    """
+    Tests atomic saves with each fsync policy.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(
+        directory.absolute().as_posix(), reserve=True, atomic=True,
+        fsync=fsync
+    )
+
+    data = b"Some foo text." * 5000
+    results = await asyncio.gather(*(
+        uset.save_with_result(
+            FileStorage(io.BytesIO(data), filename='foo.txt')
+        )
+        for _ in range(3)
+    ))
+
+    assert sorted(res.name for res in results) == [
+        'foo.txt', 'foo_1.txt', 'foo_2.txt'
+    ]
+    assert sorted(os.listdir(directory)) == [
+        'foo.txt', 'foo_1.txt', 'foo_2.txt'
+    ]
+    assert (directory / 'foo_2.txt').read_bytes() == data
+    assert (directory / 'foo_2.txt').stat().st_mode & 0o777 == file_mode()
+
+
+@pytest.mark.asyncio
+async def test_save_atomic_failure(tmp_path: Path) -> None:
+    """
+    Tests that a failed atomic save leaves nothing behind.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(directory.absolute().as_posix(), atomic=True)
+
+    stream = BrokenStream(b"Some foo text." * 5000)
+    with pytest.raises(OSError):
+        await uset.save_with_result(FileStorage(stream, filename='foo.txt'))
+    assert os.listdir(directory) == []
+
+
+@pytest.mark.asyncio
+async def test_save_named_spool(tmp_path: Path) -> None:
+    """
+    Tests that an upload spooled to a named file is linked into place.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(directory.absolute().as_posix())
+
+    data = b"Some foo text." * 5000
+    with tempfile.NamedTemporaryFile(dir=tmp_path) as spool:
+        spool.write(data)
+        spool.seek(0)
+        res = await uset.save(FileStorage(spool, filename='foo.txt'))
+        assert os.path.samefile(spool.name, directory / res)
+    assert (directory / res).read_bytes() == data
+    assert (directory / res).stat().st_mode & 0o777 == file_mode()
+
+
+@pytest.mark.asyncio
+async def test_save_foreign_file(tmp_path: Path) -> None:
+    """
+    Tests that a file the upload doesn't own is copied, leaving it as it
+    was.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(directory.absolute().as_posix())
+
+    private = tmp_path / 'private.txt'
+    private.write_bytes(b"Some foo text.")
+    private.chmod(0o600)
+    with open(private, 'rb') as stream:
+        res = await uset.save(FileStorage(stream, filename='foo.txt'))
+    assert (directory / res).read_bytes() == b"Some foo text."
+    assert not os.path.samefile(private, directory / res)
+    assert private.stat().st_mode & 0o777 == 0o600
+    assert private.stat().st_nlink == 1
+
+
+@pytest.mark.parametrize('hide', [(), ('link',), ('link', 'copy_file_range')])
+@pytest.mark.asyncio
+async def test_save_anonymous_spool(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, hide: tuple
+) -> None:
+    """
+    Tests moving an upload spooled to an anonymous file, with each of the
+    ways of moving it.
+    """
+    if not hasattr(os, 'sendfile'):
+        pytest.skip("needs os.sendfile")
+
+    def cross_device_link(*args: str, **kwargs: bool) -> None:
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    if 'link' in hide:
+        monkeypatch.setattr(os, 'link', cross_device_link)
+    if 'copy_file_range' in hide:
+        monkeypatch.delattr(os, 'copy_file_range', raising=False)
+
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(directory.absolute().as_posix())
+
+    data = b"Some foo text." * 5000
+    spool = tempfile.SpooledTemporaryFile(max_size=1024)
+    spool.write(data)
+    spool.seek(0)
+    res = await uset.save(FileStorage(spool, filename='foo.txt'))
+    assert (directory / res).read_bytes() == data
+    assert spool.tell() == len(data)
+
+
+@pytest.mark.asyncio
+async def test_save_memory_spool(tmp_path: Path) -> None:
+    """
+    Tests that an upload held in memory is saved normally.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(directory.absolute().as_posix())
+
+    spool = tempfile.SpooledTemporaryFile(max_size=1024)
+    spool.write(b"Some foo text.")
+    spool.seek(0)
+    res = await uset.save(FileStorage(spool, filename='foo.txt'))
+    assert (directory / res).read_bytes() == b"Some foo text."
+
+
+class _Unsized(io.RawIOBase):
+    """
+    A stream whose size can't be known without reading it.
+    """
+    def __init__(self, data: bytes) -> None:
+        self._data = io.BytesIO(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        return self._data.read(size)
+
+
+@pytest.mark.asyncio
+async def test_save_max_size(tmp_path: Path) -> None:
+    """
+    Tests that files over the size limit are rejected.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(
+        directory.absolute().as_posix(),
+        max_size=10,
+        folder_max_sizes={'big': 100}
+    )
+
+    with pytest.raises(UploadTooLarge):
+        await uset.save(
+            FileStorage(io.BytesIO(b"x" * 11), filename='foo.txt')
+        )
+    with pytest.raises(UploadTooLarge):
+        await uset.save(
+            FileStorage(_Unsized(b"x" * 11), filename='foo.txt')
+        )
+    with pytest.raises(UploadTooLarge):
+        await uset.save_with_result(
+            FileStorage(_Unsized(b"x" * 11), filename='foo.txt')
+        )
+    assert list(directory.iterdir()) == []
+
+    res = await uset.save(
+        FileStorage(_Unsized(b"x" * 10), filename='foo.txt')
+    )
+    assert (directory / res).read_bytes() == b"x" * 10
+
+    res = await uset.save(
+        FileStorage(_Unsized(b"x" * 50), filename='foo.txt'), folder='big'
+    )
+    assert res == 'big/foo.txt'
+
+    results = await uset.save_many([
+        FileStorage(io.BytesIO(b"x" * 5), filename='bar.txt'),
+        FileStorage(_Unsized(b"x" * 20), filename='baz.txt')
+    ])
+    assert results[0] == 'bar.txt'
+    assert isinstance(results[1], UploadTooLarge)
+    assert not (directory / 'baz.txt').exists()
+
+
+@pytest.mark.asyncio
+async def test_save_max_size_spool(tmp_path: Path) -> None:
+    """
+    Tests that the size limit is checked from disk for spooled uploads.
+    """
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+
+    uset = UploadSet('files')
+    uset._config = UploadConfig(
+        directory.absolute().as_posix(), max_size=10
+    )
+
+    spool = tempfile.SpooledTemporaryFile(max_size=1)
+    spool.write(b"x" * 11)
+    spool.seek(0)
+    with pytest.raises(UploadTooLarge):
+        await uset.save(FileStorage(spool, filename='foo.txt'))
+    assert spool.tell() == 0
+
+
+class _CountingExecutor(ThreadPoolExecutor):
+    """
+    A thread pool that counts the calls submitted to it.
+    """
+    def __init__(self) -> None:
+        super().__init__(2)
+        self.calls = 0
+
+    def submit(self, *args: Any, **kwargs: Any) -> Any:
+        self.calls += 1
+        return super().submit(*args, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_save_executor(tmp_path: Path) -> None:
+    """
+    Tests that file operations run in the set's executor.
+    """
+    executor = _CountingExecutor()
+    uset = UploadSet('files')
+    uset._config = UploadConfig(
+        str(tmp_path), executor=executor, atomic=True
+    )
+
+    res = await uset.save(FileStorage(io.BytesIO(b"foo"), filename='a.txt'))
+    assert (tmp_path / res).read_bytes() == b"foo"
+    assert executor.calls > 0
+
+    calls = executor.calls
+    res = await uset.save_with_result(
+        FileStorage(io.BytesIO(b"foo"), filename='a.txt')
+    )
+    assert res.name == 'a_1.txt'
+    assert executor.calls > calls
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_save_max_writes(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Tests that the set caps its writes in flight.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path), max_writes=2)
+
+    active, peak = 0, 0
+    write_file = uset._write_file
+
+    async def tracking(*args: Any, **kwargs: Any) -> int:
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        try:
+            return await write_file(*args, **kwargs)
+        finally:
+            active -= 1
+
+    monkeypatch.setattr(uset, '_write_file', tracking)
+    await asyncio.gather(*(
+        uset.save(FileStorage(io.BytesIO(b"x"), filename=f'{index}.txt'))
+        for index in range(6)
+    ))
+    assert peak == 2
+    assert len(list(tmp_path.iterdir())) == 6
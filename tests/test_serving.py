@@ -0,0 +1,361 @@
+"""
+tests.test_serving
+"""
+import gzip
+import io
+import os
+import threading
+from pathlib import Path
+from typing import List
+import pytest
+from quart import Quart
+from quart.datastructures import FileStorage
+from quart_uploads import UploadSet, configure_uploads
+from quart_uploads import serve
+from quart_uploads.utils import file_mode, get_stored_digest
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def app(tmp_path: Path) -> Quart:
+    """
+    Creates a Quart app serving a set with a single file.
+    """
+    (tmp_path / 'foo.bin').write_bytes(DATA)
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path),
+        UPLOADED_FILES_MAX_AGE=3600
+    )
+    configure_uploads(app, UploadSet('files'))
+    return app
+
+
+@pytest.mark.asyncio
+async def test_serve(app: Quart, tmp_path: Path) -> None:
+    """
+    Tests serving a whole file.
+    """
+    client = app.test_client()
+    response = await client.get('/_uploads/files/foo.bin')
+
+    assert response.status_code == 200
+    assert await response.get_data() == DATA
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.cache_control.max_age == 3600
+    assert response.get_etag() == (response.get_etag()[0], False)
+
+    response = await client.get('/_uploads/files/bar.bin')
+    assert response.status_code == 404
+    response = await client.get('/_uploads/files/..%2Ffoo.bin')
+    assert response.status_code == 404
+    (tmp_path / '.blobs').mkdir()
+    (tmp_path / '.blobs' / 'blob').write_bytes(DATA)
+    response = await client.get('/_uploads/files/.blobs/blob')
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_not_modified(app: Quart) -> None:
+    """
+    Tests conditional requests.
+    """
+    client = app.test_client()
+    response = await client.get('/_uploads/files/foo.bin')
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+
+    response = await client.get(
+        '/_uploads/files/foo.bin', headers={'If-None-Match': etag}
+    )
+    assert response.status_code == 304
+    assert await response.get_data() == b""
+    assert response.headers['ETag'] == etag
+
+    response = await client.get(
+        '/_uploads/files/foo.bin',
+        headers={'If-Modified-Since': last_modified}
+    )
+    assert response.status_code == 304
+
+    response = await client.get(
+        '/_uploads/files/foo.bin', headers={'If-None-Match': '"other"'}
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_single_range(app: Quart) -> None:
+    """
+    Tests single byte range requests.
+    """
+    client = app.test_client()
+    response = await client.get(
+        '/_uploads/files/foo.bin', headers={'Range': 'bytes=100-199'}
+    )
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(DATA)}'
+    assert await response.get_data() == DATA[100:200]
+
+    response = await client.get(
+        '/_uploads/files/foo.bin', headers={'Range': 'bytes=-10'}
+    )
+    assert await response.get_data() == DATA[-10:]
+
+    response = await client.get(
+        '/_uploads/files/foo.bin',
+        headers={'Range': f'bytes={len(DATA)}-'}
+    )
+    assert response.status_code == 416
+
+    response = await client.get(
+        '/_uploads/files/foo.bin',
+        headers={'Range': 'bytes=0-9', 'If-Range': '"other"'}
+    )
+    assert response.status_code == 200
+    assert await response.get_data() == DATA
+
+
+@pytest.mark.asyncio
+async def test_multi_range(app: Quart) -> None:
+    """
+    Tests multiple byte range requests.
+    """
+    client = app.test_client()
+    response = await client.get(
+        '/_uploads/files/foo.bin',
+        headers={'Range': 'bytes=0-9,5-19,100-109'}
+    )
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+
+    body = await response.get_data()
+    assert len(body) == response.content_length
+    boundary = response.mimetype_params['boundary'].encode()
+    parts = body.split(b'--' + boundary)[1:-1]
+    assert len(parts) == 2
+    assert parts[0].endswith(b'\r\n\r\n' + DATA[0:20] + b'\r\n')
+    assert b'Content-Range: bytes 100-109/' in parts[1]
+    assert parts[1].endswith(DATA[100:110] + b'\r\n')
+
+
+@pytest.mark.asyncio
+async def test_hash_etag(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Tests ETags from the digest stored when the file was saved, which is
+    read off the event loop.
+    """
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path), UPLOADED_FILES_ETAG='hash'
+    )
+    uset = UploadSet('files', extensions=('bin',))
+    configure_uploads(app, uset)
+
+    async with app.app_context():
+        res = await uset.save_with_result(
+            FileStorage(io.BytesIO(DATA), filename='foo.bin')
+        )
+    if get_stored_digest(os.path.join(tmp_path, res.name)) is None:
+        pytest.skip("extended attributes aren't supported here")
+
+    threads: List[threading.Thread] = []
+
+    def recording_digest(path: str) -> object:
+        threads.append(threading.current_thread())
+        return get_stored_digest(path)
+
+    monkeypatch.setattr(serve, 'get_stored_digest', recording_digest)
+    client = app.test_client()
+    response = await client.get('/_uploads/files/foo.bin')
+    assert response.get_etag()[0] == res.digests['sha256']
+    assert threads and threading.main_thread() not in threads
+
+
+@pytest.mark.asyncio
+async def test_sharded(tmp_path: Path) -> None:
+    """
+    Tests saving, resolving conflicts and serving in a sharded set.
+    """
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path), UPLOADED_FILES_SHARD_DEPTH=2
+    )
+    uset = UploadSet('files', extensions=('bin',))
+    configure_uploads(app, uset)
+
+    async with app.app_context():
+        first = await uset.save(
+            FileStorage(io.BytesIO(DATA), filename='foo.bin')
+        )
+        second = await uset.save(
+            FileStorage(io.BytesIO(b"other"), filename='foo.bin')
+        )
+        assert (first, second) == ('foo.bin', 'foo_1.bin')
+        assert uset.path(first) != os.path.join(tmp_path, first)
+        with open(uset.path(first), 'rb') as file_:
+            assert file_.read() == DATA
+        assert not (tmp_path / 'foo.bin').exists()
+
+    client = app.test_client()
+    response = await client.get('/_uploads/files/foo.bin')
+    assert await response.get_data() == DATA
+    response = await client.get('/_uploads/files/foo_1.bin')
+    assert await response.get_data() == b"other"
+
+
+@pytest.mark.asyncio
+async def test_precompressed(tmp_path: Path) -> None:
+    """
+    Tests negotiating `Accept-Encoding` and serving precompressed copies.
+    """
+    text = b"quart uploads " * 100
+    (tmp_path / 'notes.txt').write_bytes(text)
+    (tmp_path / 'short.txt').write_bytes(b"short")
+    (tmp_path / 'foo.bin').write_bytes(DATA)
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path), UPLOADED_FILES_COMPRESS=['gzip']
+    )
+    configure_uploads(app, UploadSet('files'))
+    client = app.test_client()
+    copy = tmp_path / '.compressed' / 'notes.txt.gz'
+
+    response = await client.get(
+        '/_uploads/files/notes.txt', headers={'Accept-Encoding': 'br, gzip'}
+    )
+    assert response.status_code == 200
+    assert response.content_encoding == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert response.mimetype == 'text/plain'
+    body = await response.get_data()
+    assert len(body) == response.content_length < len(text)
+    assert gzip.decompress(body) == text
+    etag = response.get_etag()[0]
+    assert etag.endswith('-gzip')
+    mtime = copy.stat().st_mtime_ns
+    assert copy.stat().st_mode & 0o777 == file_mode()
+
+    response = await client.get(
+        '/_uploads/files/notes.txt',
+        headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'"{etag}"'}
+    )
+    assert response.status_code == 304
+    assert 'Accept-Encoding' in response.vary
+
+    response = await client.get(
+        '/_uploads/files/notes.txt', headers={'Accept-Encoding': 'identity'}
+    )
+    assert response.content_encoding is None
+    assert 'Accept-Encoding' in response.vary
+    assert await response.get_data() == text
+
+    # the copy is only made again once the file changes.
+    await client.get(
+        '/_uploads/files/notes.txt', headers={'Accept-Encoding': 'gzip'}
+    )
+    assert copy.stat().st_mtime_ns == mtime
+    (tmp_path / 'notes.txt').write_bytes(b"changed " * 100)
+    os.utime(tmp_path / 'notes.txt', ns=(mtime + 10**9, mtime + 10**9))
+    response = await client.get(
+        '/_uploads/files/notes.txt', headers={'Accept-Encoding': 'gzip'}
+    )
+    assert gzip.decompress(await response.get_data()) == b"changed " * 100
+
+    for name in ('short.txt', 'foo.bin'):
+        response = await client.get(
+            f'/_uploads/files/{name}', headers={'Accept-Encoding': 'gzip'}
+        )
+        assert response.content_encoding is None
+        assert 'Accept-Encoding' not in response.vary
+
+
+@pytest.mark.asyncio
+async def test_compress_on_save(tmp_path: Path) -> None:
+    """
+    Tests making the compressed copies when files are saved.
+    """
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path),
+        UPLOADED_FILES_COMPRESS=['gzip'],
+        UPLOADED_FILES_COMPRESS_ON_SAVE=True
+    )
+    uset = UploadSet('files', extensions=('csv', 'bin'))
+    configure_uploads(app, uset)
+
+    async with app.app_context():
+        await uset.save(
+            FileStorage(io.BytesIO(b"a,b\n" * 100), filename='data.csv')
+        )
+        await uset.save(FileStorage(io.BytesIO(DATA), filename='foo.bin'))
+    assert os.listdir(tmp_path / '.compressed') == ['data.csv.gz']
+    assert gzip.decompress(
+        (tmp_path / '.compressed' / 'data.csv.gz').read_bytes()
+    ) == b"a,b\n" * 100
+
+
+@pytest.mark.asyncio
+async def test_sendfile(tmp_path: Path) -> None:
+    """
+    Tests handing files to the front server.
+    """
+    text = b"quart uploads " * 100
+    (tmp_path / 'foo.bin').write_bytes(DATA)
+    (tmp_path / 'my notes.txt').write_bytes(text)
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path),
+        UPLOADED_FILES_SENDFILE='x-accel-redirect',
+        UPLOADED_FILES_SENDFILE_PREFIX='/protected/files',
+        UPLOADED_FILES_COMPRESS=['gzip']
+    )
+    configure_uploads(app, UploadSet('files'))
+    client = app.test_client()
+
+    response = await client.get(
+        '/_uploads/files/foo.bin', headers={'Range': 'bytes=0-9'}
+    )
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == '/protected/files/foo.bin'
+    assert await response.get_data() == b""
+    assert response.mimetype == 'application/octet-stream'
+    etag = response.get_etag()[0]
+
+    response = await client.get(
+        '/_uploads/files/foo.bin', headers={'If-None-Match': f'"{etag}"'}
+    )
+    assert response.status_code == 304
+    assert 'X-Accel-Redirect' not in response.headers
+    response = await client.get('/_uploads/files/bar.bin')
+    assert response.status_code == 404
+
+    response = await client.get(
+        '/_uploads/files/my notes.txt', headers={'Accept-Encoding': 'gzip'}
+    )
+    assert response.headers['X-Accel-Redirect'] == (
+        '/protected/files/.compressed/my%20notes.txt.gz'
+    )
+    assert response.content_encoding == 'gzip'
+
+
+def test_sendfile_config(tmp_path: Path) -> None:
+    """
+    Tests the sendfile settings.
+    """
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path),
+        UPLOADED_FILES_SENDFILE='x-sendfile'
+    )
+    configure_uploads(app, UploadSet('files'))
+    config = app.extensions['uploads']['files']
+    assert config.sendfile_prefix == str(tmp_path) + '/'
+
+    for sendfile in ('x-accel-redirect', 'nginx'):
+        app.config['UPLOADED_FILES_SENDFILE'] = sendfile
+        with pytest.raises(ValueError):
+            configure_uploads(app, UploadSet('files'))
@@ -0,0 +1,153 @@
+"""
+tests.test_signals
+"""
+import io
+from pathlib import Path
+from typing import Any, List, Tuple
+import pytest
+from quart import Quart
+from quart.datastructures import FileStorage
+from quart_uploads import (
+    UploadConfig,
+    UploadNotAllowed,
+    UploadSet,
+    configure_uploads,
+    conflict_resolved,
+    file_served,
+    upload_rejected,
+    upload_saved,
+    upload_started
+)
+from quart_uploads import route
+
+
+@pytest.mark.asyncio
+async def test_save_signals(tmp_path: Path) -> None:
+    """
+    Tests the signals sent while saving.
+    """
+    events: List[Tuple[str, Any, dict]] = []
+
+    def recorder(kind: str) -> Any:
+        def receiver(sender: Any, **kwargs: Any) -> None:
+            events.append((kind, sender, kwargs))
+        return receiver
+
+    receivers = {
+        signal: recorder(signal.name) for signal in (
+            upload_started, upload_saved, upload_rejected, conflict_resolved
+        )
+    }
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path))
+
+    with upload_started.connected_to(receivers[upload_started]), \
+            upload_saved.connected_to(receivers[upload_saved]), \
+            upload_rejected.connected_to(receivers[upload_rejected]), \
+            conflict_resolved.connected_to(receivers[conflict_resolved]):
+        await uset.save(FileStorage(io.BytesIO(b"foo"), filename='foo.txt'))
+        await uset.save_with_result(
+            FileStorage(io.BytesIO(b"foo"), filename='foo.txt')
+        )
+        with pytest.raises(UploadNotAllowed):
+            await uset.save(FileStorage(io.BytesIO(b"x"), filename='x.exe'))
+
+    kinds = [kind for kind, _, _ in events]
+    assert kinds == [
+        'upload-started', 'upload-saved',
+        'upload-started', 'conflict-resolved', 'upload-saved',
+        'upload-started', 'upload-rejected'
+    ]
+    assert all(sender is uset for _, sender, _ in events)
+    assert events[1][2]['name'] == 'foo.txt'
+    assert events[3][2]['probes'] == 1
+    assert events[4][2]['name'] == 'foo_1.txt'
+    assert events[4][2]['size'] == 3
+    assert events[4][2]['duration'] >= 0
+    assert events[6][2]['filename'] == 'x.exe'
+
+
+@pytest.mark.asyncio
+async def test_metrics(tmp_path: Path) -> None:
+    """
+    Tests the metrics endpoint.
+    """
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path), UPLOADS_METRICS=True
+    )
+    uset = UploadSet('files')
+    configure_uploads(app, uset)
+
+    served: List[dict] = []
+
+    def on_served(sender: Any, **kwargs: Any) -> None:
+        served.append(kwargs)
+
+    async with app.app_context():
+        await uset.save(FileStorage(io.BytesIO(b"foo"), filename='foo.txt'))
+        with pytest.raises(UploadNotAllowed):
+            await uset.save(FileStorage(io.BytesIO(b"x"), filename='x.exe'))
+
+    client = app.test_client()
+    with file_served.connected_to(on_served):
+        await client.get('/_uploads/files/foo.txt')
+        await client.get('/_uploads/files/bar.txt')
+    assert [event['status'] for event in served] == [200, 404]
+    assert served[0]['size'] == 3
+
+    response = await client.get('/_uploads/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = await response.get_data(as_text=True)
+    assert 'quart_uploads_saved_total{set="files"} 1' in text
+    assert 'quart_uploads_written_bytes_total{set="files"} 3' in text
+    assert (
+        'quart_uploads_rejected_total{reason="UploadNotAllowed",set="files"} 1'
+        in text
+    )
+    assert 'quart_uploads_served_total{set="files",status="200"} 1' in text
+    assert 'quart_uploads_served_total{set="files",status="404"} 1' in text
+    assert 'quart_uploads_file_bytes_bucket{set="files",le="1024"} 1' in text
+    assert 'quart_uploads_save_seconds_count{set="files"} 1' in text
+
+
+@pytest.mark.asyncio
+async def test_served_error(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Tests that a failure while serving is sent as a 500 and raised as it
+    is.
+    """
+    app = Quart(__name__)
+    app.config['UPLOADED_FILES_DEST'] = str(tmp_path)
+    configure_uploads(app, UploadSet('files'))
+
+    async def denied(*args: Any, **kwargs: Any) -> None:
+        raise PermissionError("denied")
+
+    monkeypatch.setattr(route, 'send_upload', denied)
+    served: List[dict] = []
+
+    def on_served(sender: Any, **kwargs: Any) -> None:
+        served.append(kwargs)
+
+    app.config['PROPAGATE_EXCEPTIONS'] = True
+    with file_served.connected_to(on_served):
+        with pytest.raises(PermissionError):
+            await app.test_client().get('/_uploads/files/foo.txt')
+    assert served[0]['status'] == 500
+
+
+@pytest.mark.asyncio
+async def test_metrics_disabled(tmp_path: Path) -> None:
+    """
+    Tests that the metrics endpoint is off by default.
+    """
+    app = Quart(__name__)
+    app.config['UPLOADED_FILES_DEST'] = str(tmp_path)
+    configure_uploads(app, UploadSet('files'))
+
+    response = await app.test_client().get('/_uploads/metrics')
+    assert response.status_code == 404
@@ -0,0 +1,133 @@
+"""
+tests.test_sniffing
+"""
+import io
+import tempfile
+from pathlib import Path
+import pytest
+from quart.datastructures import FileStorage
+from quart_uploads import (
+    MemoryBackend,
+    UploadConfig,
+    UploadSet,
+    UploadTypeMismatch,
+    ALL
+)
+from quart_uploads.sniff import SNIFF_SIZE, Sniffer, sniff
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 1000
+EXE = (
+    b'MZ' + b'\x00' * 58 + (0x80).to_bytes(4, 'little') + b'\x00' * 64 +
+    b'PE\x00\x00' + b'\x00' * 1000
+)
+
+
+def test_sniff() -> None:
+    """
+    Tests recognising formats from their first bytes.
+    """
+    assert sniff(PNG) == 'image/png'
+    assert sniff(b'\xff\xd8\xff\xe0') == 'image/jpeg'
+    assert sniff(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == 'image/webp'
+    assert sniff(b'PK\x03\x04') == 'application/zip'
+    assert sniff(b'\x00' * 257 + b'ustar\x00') == 'application/x-tar'
+    assert sniff(b'Some foo text.') is None
+    assert sniff(EXE) == 'application/x-msdownload'
+    assert sniff(b'MZ' + b'\x00' * 500) is None
+    assert sniff(b'BZh91AY&SY\x00') == 'application/x-bzip2'
+    assert sniff(b'ID3\x03\x00\x00') == 'audio/mpeg'
+
+
+@pytest.mark.parametrize('text', [
+    b'BZh is my nickname',
+    b'ID3 tags explained',
+    b'MZ' + b' Mark Zuckerberg' * 40,
+    b'OggS and fLaC are audio formats',
+    b'%PDF-1.7 is the last version',
+])
+def test_sniff_text(text: bytes) -> None:
+    """
+    Tests that text starting like a signature passes as text.
+    """
+    sniffer = Sniffer('txt')
+    sniffer.update(text)
+    assert sniffer.finish() is None
+
+
+def test_sniffer() -> None:
+    """
+    Tests that the sniffer checks as soon as it has enough bytes.
+    """
+    sniffer = Sniffer('JPG')
+    with pytest.raises(UploadTypeMismatch):
+        sniffer.update(PNG[:SNIFF_SIZE + 1])
+
+    sniffer = Sniffer('png')
+    sniffer.update(PNG[:4])
+    assert not sniffer.checked
+    sniffer.update(PNG[4:])
+    assert sniffer.checked
+    assert sniffer.finish() == 'image/png'
+
+    sniffer = Sniffer('unknown')
+    sniffer.update(EXE)
+    assert sniffer.finish() == 'application/x-msdownload'
+
+
+@pytest.mark.asyncio
+async def test_save_sniffed(tmp_path: Path) -> None:
+    """
+    Tests that mismatched content is rejected and removed.
+    """
+    uset = UploadSet('files', ALL)
+    uset._config = UploadConfig(str(tmp_path), sniff=True)
+
+    res = await uset.save_with_result(
+        FileStorage(io.BytesIO(PNG), filename='foo.png')
+    )
+    assert res.content_type == 'image/png'
+    res = await uset.save_with_result(
+        FileStorage(io.BytesIO(b"Some foo text."), filename='foo.txt')
+    )
+    assert res.content_type is None
+
+    with pytest.raises(UploadTypeMismatch):
+        await uset.save(FileStorage(io.BytesIO(EXE), filename='bar.jpg'))
+    with pytest.raises(UploadTypeMismatch):
+        await uset.save(FileStorage(io.BytesIO(EXE), filename='bar.txt'))
+    res = await uset.save_with_result(
+        FileStorage(io.BytesIO(b'MZ short'), filename='baz.txt')
+    )
+    assert res.content_type is None
+    spool = tempfile.SpooledTemporaryFile(max_size=1)
+    spool.write(EXE)
+    spool.seek(0)
+    with pytest.raises(UploadTypeMismatch):
+        await uset.save(FileStorage(spool, filename='bar.png'))
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        'baz.txt', 'foo.png', 'foo.txt'
+    ]
+
+
+@pytest.mark.asyncio
+async def test_save_sniffed_deduplicated(tmp_path: Path) -> None:
+    """
+    Tests sniffing in deduplicating and atomic sets and with a backend.
+    """
+    for config in (
+        UploadConfig(str(tmp_path), sniff=True, deduplicate=True),
+        UploadConfig(str(tmp_path), sniff=True, atomic=True)
+    ):
+        uset = UploadSet('files', ALL)
+        uset._config = config
+        with pytest.raises(UploadTypeMismatch):
+            await uset.save(FileStorage(io.BytesIO(b'MZ'), filename='a.gif'))
+        assert not (tmp_path / 'a.gif').exists()
+
+    backend = MemoryBackend()
+    uset = UploadSet('files', ALL)
+    uset._config = UploadConfig('', backend=backend, sniff=True)
+    with pytest.raises(UploadTypeMismatch):
+        await uset.save(FileStorage(io.BytesIO(b'MZ'), filename='a.gif'))
+    assert backend.files == {}
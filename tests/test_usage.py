@@ -0,0 +1,286 @@
+"""
+tests.test_usage
+"""
+import asyncio
+import io
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, List
+import pytest
+from quart import Quart
+from quart.datastructures import FileStorage
+from quart_uploads import (
+    MemoryBackend,
+    QuotaExceeded,
+    UploadConfig,
+    UploadSet,
+    UploadTooLarge,
+    Usage,
+    configure_uploads,
+    upload_deleted
+)
+from quart_uploads import usage
+
+
+class Unsized(io.RawIOBase):
+    """
+    A stream whose size can't be found without reading it.
+    """
+    def __init__(self, data: bytes) -> None:
+        self.data = io.BytesIO(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        data = self.data.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def storage(data: bytes, filename: str = 'foo.txt') -> FileStorage:
+    """
+    Returns a storage for the data.
+    """
+    return FileStorage(io.BytesIO(data), filename=filename)
+
+
+@pytest.mark.asyncio
+async def test_usage(tmp_path: Path) -> None:
+    """
+    Tests counting a destination and keeping the counts up to date.
+    """
+    (tmp_path / 'a.txt').write_bytes(b"12345")
+    (tmp_path / 'someguy').mkdir()
+    (tmp_path / 'someguy' / 'b.txt').write_bytes(b"123")
+    (tmp_path / '.blobs').mkdir()
+    (tmp_path / '.blobs' / 'blob').write_bytes(b"1" * 100)
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path))
+
+    assert await uset.usage() == Usage(8, 2)
+    assert await uset.usage('someguy') == Usage(3, 1)
+    assert await uset.usage('nobody') == Usage(0, 0)
+
+    name = await uset.save(storage(b"1234567"), folder='someguy')
+    assert await uset.usage('someguy') == Usage(10, 2)
+    assert await uset.usage() == Usage(15, 3)
+
+    deleted: List[dict] = []
+
+    def on_deleted(sender: Any, **kwargs: Any) -> None:
+        deleted.append(kwargs)
+
+    with upload_deleted.connected_to(on_deleted):
+        await uset.delete(name)
+    assert deleted == [{'name': 'someguy/foo.txt', 'size': 7}]
+    assert not (tmp_path / 'someguy' / 'foo.txt').exists()
+    assert await uset.usage('someguy') == Usage(3, 1)
+    with pytest.raises(FileNotFoundError):
+        await uset.delete(name)
+
+
+@pytest.mark.asyncio
+async def test_usage_snapshot(tmp_path: Path) -> None:
+    """
+    Tests that the counts are persisted, and rebuilt on request.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path), shard_depth=1)
+    await uset.save(storage(b"12345"))
+    assert await uset.usage() == Usage(5, 1)
+    await uset._usage[str(tmp_path)].flush()
+    assert (tmp_path / '.usage.json').exists()
+
+    # a process that didn't shut down cleanly may have missed a change,
+    # so the next one scans again.
+    (tmp_path / 'extra.txt').write_bytes(b"123")
+    other = UploadSet('files')
+    other._config = UploadConfig(str(tmp_path), shard_depth=1)
+    assert await other.usage() == Usage(8, 2)
+
+    # after a clean shutdown, it reads the snapshot instead of scanning.
+    await other.close_usage()
+    (tmp_path / 'more.txt').write_bytes(b"1")
+    third = UploadSet('files')
+    third._config = UploadConfig(str(tmp_path), shard_depth=1)
+    assert await third.usage() == Usage(8, 2)
+
+    await third.rebuild_usage()
+    assert await third.usage() == Usage(9, 3)
+
+
+@pytest.mark.asyncio
+async def test_usage_snapshot_lifecycle(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture
+) -> None:
+    """
+    Tests that the app closes the snapshot when it shuts down, and that a
+    snapshot that couldn't be written is logged.
+    """
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path), UPLOADED_FILES_QUOTA=100
+    )
+    files = UploadSet('files')
+    configure_uploads(app, files)
+    async with app.test_app():
+        async with app.app_context():
+            await files.save(storage(b"12345"))
+    with open(tmp_path / '.usage.json') as file_:
+        assert json.load(file_)['closed']
+
+    def failing_write(*args: Any) -> None:
+        raise OSError("disk full")
+
+    monkeypatch.setattr(usage, '_write_snapshot', failing_write)
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path), quota=100)
+    await uset.save(storage(b"123", filename='bar.txt'))
+    with pytest.raises(OSError):
+        await uset._usage[str(tmp_path)].flush()
+    await asyncio.sleep(0)
+    assert "Couldn't write the usage snapshot" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_quota(tmp_path: Path) -> None:
+    """
+    Tests rejecting uploads over the set's quota.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path), reserve=True, quota=10)
+
+    await uset.save(storage(b"123456"))
+    assert await uset.quota_remaining() == 4
+    with pytest.raises(QuotaExceeded):
+        await uset.save(storage(b"12345"))
+    assert sorted(os.listdir(tmp_path)) == ['.usage.json', 'foo.txt']
+
+    # a stream of unknown size is stopped once it runs out of room.
+    with pytest.raises(QuotaExceeded):
+        await uset.save(FileStorage(Unsized(b"12345"), filename='bar.txt'))
+    assert not (tmp_path / 'bar.txt').exists()
+    assert await uset.usage() == Usage(6, 1)
+
+    await uset.save(storage(b"1234"))
+    assert await uset.quota_remaining() == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_quota(tmp_path: Path) -> None:
+    """
+    Tests that concurrent saves can't together go over the quota.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path), quota=10)
+
+    results = await asyncio.gather(
+        *(
+            uset.save(storage(b"12345678", filename=f'{name}.txt'))
+            for name in ('a', 'b', 'c')
+        ),
+        return_exceptions=True
+    )
+    assert sum(isinstance(result, str) for result in results) == 1
+    assert sum(isinstance(result, QuotaExceeded) for result in results) == 2
+    assert await uset.usage() == Usage(8, 1)
+    assert await uset.quota_remaining() == 2
+
+
+def spooled(data: bytes, filename: str) -> FileStorage:
+    """
+    Returns a storage for the data in a spooled file that is still held in
+    memory, as a small multipart upload arrives.
+    """
+    stream = tempfile.SpooledTemporaryFile(max_size=500 * 1024)
+    stream.write(data)
+    stream.seek(0)
+    return FileStorage(stream, filename=filename)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_quota_spooled(tmp_path: Path) -> None:
+    """
+    Tests that concurrent saves of spooled and unsized streams only
+    reserve the room they need.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path), quota=1000)
+
+    results = await asyncio.gather(*(
+        uset.save(spooled(b"1" * 100, f'a{number}.txt'))
+        for number in range(4)
+    ))
+    assert results == [f'a{number}.txt' for number in range(4)]
+    results = await uset.save_many(
+        [spooled(b"1" * 100, f'b{number}.txt') for number in range(4)]
+    )
+    assert results == [f'b{number}.txt' for number in range(4)]
+    assert await uset.quota_remaining() == 200
+
+    # unsized streams reserve room as they are read.
+    results = await asyncio.gather(
+        *(
+            uset.save(
+                FileStorage(Unsized(b"1" * 80), filename=f'c{number}.txt')
+            )
+            for number in range(3)
+        ),
+        return_exceptions=True
+    )
+    assert sum(isinstance(result, str) for result in results) == 2
+    assert sum(isinstance(result, QuotaExceeded) for result in results) == 1
+    assert await uset.usage() == Usage(960, 10)
+    assert await uset.quota_remaining() == 40
+
+
+@pytest.mark.asyncio
+async def test_folder_quota(tmp_path: Path) -> None:
+    """
+    Tests quotas that apply to each folder.
+    """
+    uset = UploadSet('files')
+    uset._config = UploadConfig(str(tmp_path), folder_quota=5, max_size=4)
+
+    results = await uset.save_many(
+        [storage(b"123"), storage(b"1234"), storage(b"12")],
+        folder='someguy',
+        concurrency=1
+    )
+    assert results[0] == 'someguy/foo.txt'
+    assert isinstance(results[1], QuotaExceeded)
+    assert results[2] == 'someguy/foo_2.txt'
+    assert await uset.quota_remaining('someguy') == 0
+    assert await uset.quota_remaining('other') == 5
+
+    # the size limit is still a size limit when it is the smaller one.
+    with pytest.raises(UploadTooLarge) as info:
+        await uset.save(
+            FileStorage(Unsized(b"12345"), filename='foo.txt'), folder='other'
+        )
+    assert not isinstance(info.value, QuotaExceeded)
+
+
+def test_quota_config(tmp_path: Path) -> None:
+    """
+    Tests the quota settings.
+    """
+    app = Quart(__name__)
+    app.config.update(
+        UPLOADED_FILES_DEST=str(tmp_path),
+        UPLOADED_FILES_QUOTA=1024,
+        UPLOADED_FILES_FOLDER_QUOTA=512
+    )
+    files = UploadSet('files')
+    configure_uploads(app, files)
+    config = app.extensions['uploads']['files']
+    assert (config.quota, config.folder_quota) == (1024, 512)
+
+    app.config['UPLOADED_FILES_BACKEND'] = MemoryBackend()
+    with pytest.raises(ValueError):
+        configure_uploads(app, files)